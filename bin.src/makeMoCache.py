@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+from lsst.sims.maf.slicers import MoObjSlicer, moCacheDir
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build the binary caches of the orbit and observation files"
+                                                 " of a moving object population, so that they are not"
+                                                 " parsed again by each run_moving.py.")
+    parser.add_argument("--orbitFile", type=str, help="File containing the moving object orbits.")
+    parser.add_argument("--obsFile", type=str, default=None,
+                        help="File containing the observations of the moving objects.")
+    parser.add_argument("--obsChunksize", type=int, default=1000000,
+                        help="Number of lines of the obsFile to read at a time (the observations are"
+                             " not all read into memory).")
+    args = parser.parse_args()
+
+    if args.orbitFile is None:
+        print('Must specify an orbitFile')
+        exit()
+
+    # Reading the orbits through the slicer writes (or refreshes) their cache.
+    slicer = MoObjSlicer()
+    slicer.setupSlicer(args.orbitFile, useCache=True)
+    print('Cached %d orbits in %s' % (slicer.nSso, moCacheDir(args.orbitFile)))
+    if args.obsFile is not None:
+        # The observation cache is built chunk by chunk.
+        nObs = slicer.cacheObs(args.obsFile, chunksize=args.obsChunksize)
+        print('Cached %d observations in %s' % (nObs, moCacheDir(args.obsFile)))
@@ -8,6 +8,7 @@ See run_glance and run_cadence for examples.
 from __future__ import print_function
 
 import os
+import shutil
 import argparse
 import matplotlib
 matplotlib.use('Agg')
@@ -61,13 +62,38 @@ def setSQL(opsdb, sqlConstraint=None, extraMeta=None):
     return (propids, proptags, sqltags, metadata)
 
 
+def addIndexes(bdict, opsdb, inPlace=False, localCopy=None, timeQueries=True):
+    # Add indexes for the constraints of the metric bundles to a local copy of the opsim database
+    # (or to the database itself, if inPlace), reporting how much faster the queries are with them.
+    if not hasattr(opsdb, 'ensureIndexes'):
+        print('Can only add indexes to opsim databases; not adding indexes.')
+        return opsdb
+    constraints = set([b.constraint for b in bdict.values()])
+    # With timeQueries, ensureIndexes prints the time of each query without and with the new indexes
+    # (saved in the indexTimes of the returned database), and the total.
+    return opsdb.ensureIndexes(constraints, inPlace=inPlace, localCopy=localCopy, timeQueries=timeQueries)
+
+
 def run(bdict, opsdb, colmap, args):
-    resultsDb = db.ResultsDb(outDir=args.outDir)
-    group = mb.MetricBundleGroup(bdict, opsdb, outDir=args.outDir, resultsDb=resultsDb)
-    group.runAll()
-    group.plotAll()
-    resultsDb.close()
-    mafUtils.writeConfigs(opsdb, args.outDir)
+    if getattr(args, 'ensureIndexes', False):
+        indexedDb = addIndexes(bdict, opsdb, inPlace=getattr(args, 'indexInPlace', False),
+                               localCopy=getattr(args, 'indexCopy', None),
+                               timeQueries=getattr(args, 'timeIndexes', True))
+    else:
+        indexedDb = opsdb
+    try:
+        resultsDb = db.ResultsDb(outDir=args.outDir)
+        group = mb.MetricBundleGroup(bdict, indexedDb, outDir=args.outDir, resultsDb=resultsDb)
+        group.runAll()
+        group.plotAll()
+        resultsDb.close()
+        mafUtils.writeConfigs(opsdb, args.outDir)
+    finally:
+        if indexedDb is not opsdb:
+            indexedDb.close()
+            # Remove the indexed copy of the database, if it was made in a temporary directory.
+            if getattr(indexedDb, 'indexCopyDir', None) is not None:
+                shutil.rmtree(indexedDb.indexCopyDir, ignore_errors=True)
 
 
 def replot(bdict, opsdb, colmap, args):
@@ -98,6 +124,18 @@ def parseArgs(subdir='out', parser=None):
     parser.add_argument("--ditherStacker", type=str, default=None,
                         help="Name of dither stacker to use for RA/Dec, e.g. 'RandomDitherPerNightStacker'."
                         " Note that this currently is only applied to the run_srd script. ")
+    parser.add_argument('--ensureIndexes', dest='ensureIndexes', action='store_true', default=False,
+                        help="Add indexes for the sql constraints of the metrics to a local copy of the "
+                             "database before running.")
+    parser.add_argument('--indexInPlace', dest='indexInPlace', action='store_true', default=False,
+                        help="With --ensureIndexes, add the indexes to the database file itself "
+                             "(if it is writable) instead of to a local copy.")
+    parser.add_argument('--indexCopy', type=str, default=None,
+                        help="With --ensureIndexes, the file to copy the database to before adding the "
+                             "indexes (this is kept). Default is a temporary file, removed after the run.")
+    parser.add_argument('--noTimeIndexes', dest='timeIndexes', action='store_false', default=True,
+                        help="With --ensureIndexes, don't time the queries before and after adding the "
+                             "indexes (timing runs each query twice).")
     args = parser.parse_args()
 
     if args.runName is None:
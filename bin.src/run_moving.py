@@ -20,7 +20,7 @@ import lsst.sims.maf.batches as batches
 
 
 
-def runMetrics(bdict, outDir, resultsDb=None, Hmark=None):
+def runMetrics(bdict, outDir, resultsDb=None, Hmark=None, nWorkers=None):
     """
     Run metrics, write basic output in OutDir.
 
@@ -34,6 +34,8 @@ def runMetrics(bdict, outDir, resultsDb=None, Hmark=None):
         The results database to use to track metrics and summary statistics.
     Hmark : float, optional
         The Hmark value to add to the completeness bundles plotDicts.
+    nWorkers : int, optional
+        The number of worker processes to use to calculate the metric values. Default None (serial).
 
     Returns
     -------
@@ -43,7 +45,7 @@ def runMetrics(bdict, outDir, resultsDb=None, Hmark=None):
     print("Calculating metric values.")
     bg = mmb.MoMetricBundleGroup(bdict, outDir=outDir, resultsDb=resultsDb)
     # Calculate basic metrics.
-    bg.runAll()
+    bg.runAll(nWorkers=nWorkers)
     # Generate completeness bundles.
     completeness = batches.addMoCompletenessBundles(bdict, Hmark, outDir, resultsDb)
     bdict.update(completeness)
@@ -78,6 +80,9 @@ if __name__ == '__main__':
                              "Default 10.")
     parser.add_argument("--startTime", type=float, default=59580,
                         help="Time at start of survey (to set time for summary metrics).")
+    parser.add_argument("--nWorkers", type=int, default=None,
+                        help="Number of worker processes to use to calculate the metric values. "
+                             "Default None (calculate serially).")
     parser.add_argument("--plotOnly", action='store_true', default=False,
                         help="Reload metric values from disk and replot them.")
     args = parser.parse_args()
@@ -126,7 +131,7 @@ if __name__ == '__main__':
         bdictT, pbundleT = batches.quickDiscoveryBatch(slicer, colmap=colmap, runName=args.opsimRun,
                                                      metadata=args.metadata, detectionLosses='trailing',
                                                      albedo=args.albedo, Hmark=args.hMark, times=times)
-        bdictT = runMetrics(bdictT, args.outDir, resultsDb, args.hMark)
+        bdictT = runMetrics(bdictT, args.outDir, resultsDb, args.hMark, nWorkers=args.nWorkers)
         # Run all discovery metrics using 'detection' losses
         bdictD, pbundleD = batches.quickDiscoveryBatch(slicer, colmap=colmap, runName=args.opsimRun,
                                                      metadata=args.metadata, detectionLosses='detection',
@@ -136,13 +141,13 @@ if __name__ == '__main__':
                                                 times=times)
         bdictD.update(bdict)
         pbundleD.append(pbundle)
-        bdictD = runMetrics(bdictD, args.outDir, resultsDb, args.hMark)
+        bdictD = runMetrics(bdictD, args.outDir, resultsDb, args.hMark, nWorkers=args.nWorkers)
         # Run all characterization metrics
         bdictC, pbundle = batches.characterizationBatch(slicer, colmap=colmap, runName=args.opsimRun,
                                                         metadata=args.metadata, albedo=args.albedo,
                                                         Hmark=args.hMark, constraint=None,
                                                         npReduce=npReduce, windows=windows, bins=bins)
-        bdictC = runMetrics(bdictC, args.outDir, resultsDb, args.hMark)
+        bdictC = runMetrics(bdictC, args.outDir, resultsDb, args.hMark, nWorkers=args.nWorkers)
 
 
     #plotMetrics(allBundles, args.outDir, args.metadata, args.opsimRun, mParams,
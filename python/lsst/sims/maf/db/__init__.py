@@ -1,5 +1,6 @@
 from .database import *
 from .opsimDatabase import *
 from .resultsDb import *
+from .sqlConstraint import *
 from .trackingDb import *
 from .sdssDatabase import *
@@ -7,6 +7,10 @@ from sqlalchemy import func, text
 from sqlalchemy import Table
 from sqlalchemy.engine import reflection
 import warnings
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 with warnings.catch_warnings():
     warnings.simplefilter("ignore", UserWarning)
     from lsst.sims.catalogs.db import DBObject
@@ -14,6 +18,39 @@ with warnings.catch_warnings():
 
 __all__ = ['DatabaseRegistry', 'Database']
 
+
+class _LazyTableDict(Mapping):
+    """A read-only dictionary keyed by table name, where each value is only created when first used.
+
+    Parameters
+    ----------
+    tableNames : list of str
+        The keys (table names).
+    loader : callable
+        Function which returns the value for a table name.
+    """
+    def __init__(self, tableNames, loader):
+        self._tableNames = list(tableNames)
+        self._loader = loader
+        self._values = {}
+
+    def __getitem__(self, tablename):
+        if tablename not in self._values:
+            if tablename not in self._tableNames:
+                raise KeyError(tablename)
+            self._values[tablename] = self._loader(tablename)
+        return self._values[tablename]
+
+    def __contains__(self, tablename):
+        return tablename in self._tableNames
+
+    def __iter__(self):
+        return iter(self._tableNames)
+
+    def __len__(self):
+        return len(self._tableNames)
+
+
 class DatabaseRegistry(type):
     """
     Meta class for databases, to build a registry of database classes.
@@ -77,6 +114,7 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
             if not os.path.isfile(database):
                 raise IOError('Sqlite database file "%s" not found.' %(database))
 
+        self.driver = driver
         # Connect to database using DBObject init.
         super(Database, self).__init__(database=database, driver=driver,
                                        host=host, port=port, verbose=verbose, connection=None)
@@ -94,22 +132,26 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
                             'STRING':(np.str, 1024)}
             self.dbTypeMap.update(typeOverRide)
 
-        # Get a dict (keyed by the table names) of all the columns in each table and view.
-        self.tableNames = reflection.Inspector.from_engine(self.connection.engine).get_table_names()
-        self.tableNames += reflection.Inspector.from_engine(self.connection.engine).get_view_names()
-        self.columnNames = {}
-        for t in self.tableNames:
-            cols = reflection.Inspector.from_engine(self.connection.engine).get_columns(t)
-            self.columnNames[t] = [xxx['name'] for xxx in cols]
-        # Create all the sqlalchemy table objects. This lets us see the schema and query it with types.
-        self.tables = {}
-        for tablename in self.tableNames:
-            self.tables[tablename] = Table(tablename, self.connection.metadata, autoload=True)
+        # Get the names of the tables and views (cheap), but only look up the columns of each table
+        # and reflect its schema when the table is first used.
+        self._inspector = reflection.Inspector.from_engine(self.connection.engine)
+        self.tableNames = self._inspector.get_table_names()
+        self.tableNames += self._inspector.get_view_names()
+        # A dict (keyed by the table names) of all the columns in each table and view.
+        self.columnNames = _LazyTableDict(self.tableNames, self._reflectColumnNames)
+        # The sqlalchemy table objects. These let us see the schema and query it with types.
+        self.tables = _LazyTableDict(self.tableNames, self._reflectTable)
         self.defaultTable = defaultTable
         # if there is is only one table and we haven't said otherwise, set defaultTable automatically.
         if self.defaultTable is None and len(self.tableNames) == 1:
             self.defaultTable = self.tableNames[0]
 
+    def _reflectColumnNames(self, tablename):
+        return [xxx['name'] for xxx in self._inspector.get_columns(tablename)]
+
+    def _reflectTable(self, tablename):
+        return Table(tablename, self.connection.metadata, autoload=True)
+
     def close(self):
         self.connection.session.close()
         self.connection.engine.dispose()
@@ -178,7 +220,7 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
         return self.execute_arbitrary(sqlQuery, dtype=dtype)
 
     def query_columns(self, tablename, colnames=None, sqlconstraint=None,
-                            groupBy=None, numLimit=None, chunksize=1000000):
+                            groupBy=None, numLimit=None, chunksize=1000000, columnar=False):
         """Query a table in the database and return data from colnames in recarray.
 
         Parameters
@@ -195,6 +237,10 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
             Number of records to return. Default no limit.
         chunksize : int, opt
             Query database and convert to recarray in series of chunks of chunksize.
+        columnar : bool, opt
+            If True, fetch the results with the DB-API cursor and copy each column of each chunk straight
+            into a preallocated numpy array, instead of converting each row through sqlalchemy.
+            Default False. (See tests/diagnose/benchmarkQueryColumns.py to compare the two methods.)
 
         Returns
         -------
@@ -209,11 +255,16 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
                                   groupBy=groupBy, numLimit=numLimit)
 
         # Determine dtype for numpy recarray.
+        if colnames is None:
+            colnames = self.columnNames[tablename]
         dtype = []
         for col in colnames:
             dt = self.dbTypeMap[self.tables[tablename].c[col].type.__visit_name__]
             dtype.append((col,) + dt)
 
+        if columnar:
+            return self._query_columnar(query, dtype, chunksize)
+
         # Execute query on database.
         exec_query = self.connection.session.execute(query)
 
@@ -234,10 +285,57 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
                 data = np.hstack(chunks)
         return data
 
-    def _build_query(self, tablename, colnames, sqlconstraint=None, groupBy=None, numLimit=None):
+    def iterColumns(self, tablename, colnames=None, sqlconstraint=None, orderBy=None,
+                    chunksize=1000000, columnar=False):
+        """Query a table in the database, returning the data from colnames as a series of recarray chunks.
+
+        Unlike query_columns, the chunks are not gathered into one array, so the full result does not
+        need to fit into memory.
+
+        Parameters
+        ----------
+        tablename : str
+            Name of table to query.
+        colnames : list of str or None, opt
+            Columns from the table to query for. If None, all columns are selected.
+        sqlconstraint : str or None, opt
+            Constraint to apply to to the query.  Default None.
+        orderBy : str or None, opt
+            Name of column to order the results by. Default None.
+        chunksize : int, opt
+            Number of rows in each chunk. Default 1000000.
+        columnar : bool, opt
+            Fetch the results with the DB-API cursor (see query_columns). Default False.
+
+        Yields
+        ------
+        numpy.recarray
+        """
+        query = self._build_query(tablename, colnames=colnames, sqlconstraint=sqlconstraint,
+                                  orderBy=orderBy)
+        if colnames is None:
+            colnames = self.columnNames[tablename]
+        dtype = []
+        for col in colnames:
+            dt = self.dbTypeMap[self.tables[tablename].c[col].type.__visit_name__]
+            dtype.append((col,) + dt)
+        if chunksize is None or chunksize == 0:
+            chunksize = 1000000
+        if columnar:
+            for chunk in self._iter_columnar(query, dtype, chunksize):
+                yield chunk
+        else:
+            exec_query = self.connection.session.execute(query)
+            results = exec_query.fetchmany(chunksize)
+            while len(results) > 0:
+                yield self._convert_results(results, dtype)
+                results = exec_query.fetchmany(chunksize)
+
+    def _build_query(self, tablename, colnames, sqlconstraint=None, groupBy=None, numLimit=None,
+                     orderBy=None):
         if tablename not in self.tables:
             raise ValueError('Tablename %s not in list of available tables (%s).'
-                             % (tablename, self.tables.keys()))
+                             % (tablename, self.tableNames))
         if colnames is None:
             colnames = self.columnNames[tablename]
         else:
@@ -259,10 +357,78 @@ class Database(with_metaclass(DatabaseRegistry, DBObject)):
                 query = query.filter(text(sqlconstraint))
         if groupBy is not None:
             query = query.group_by(groupBy)
+        if orderBy is not None:
+            if orderBy not in self.columnNames[tablename]:
+                raise ValueError("OrderBy column %s is not available in table %s" % (orderBy, tablename))
+            query = query.order_by(orderBy)
         if numLimit is not None:
             query = query.limit(numLimit)
         return query
 
+    def _query_columnar(self, query, dtype, chunksize=1000000):
+        """Execute a query with the DB-API cursor, copying each column of the results into a numpy array.
+
+        This skips the sqlalchemy result rows (and the numpy conversion of each row tuple).
+        Each chunk of rows from the cursor is copied into the (preallocated, and grown as needed)
+        returned array one column at a time.
+
+        Parameters
+        ----------
+        query : sqlalchemy.orm.Query
+            The query (from _build_query).
+        dtype : list of tuple
+            The dtype of the recarray to return.
+        chunksize : int, opt
+            Number of rows to fetch from the cursor at a time.
+
+        Returns
+        -------
+        numpy.recarray
+        """
+        if chunksize is None or chunksize == 0:
+            chunksize = 1000000
+        data = np.recarray((0,), dtype=dtype)
+        nrows = 0
+        for results in self._fetch_cursor(query, chunksize):
+            if nrows + len(results) > len(data):
+                # Grow geometrically, so each row is only copied a few times.
+                grown = np.recarray((max(2 * len(data), nrows + len(results)),), dtype=dtype)
+                grown[:nrows] = data[:nrows]
+                data = grown
+            self._fill_columns(data, nrows, results)
+            nrows += len(results)
+        return data[:nrows]
+
+    def _iter_columnar(self, query, dtype, chunksize):
+        """Execute a query with the DB-API cursor, yielding each chunk of rows as a numpy recarray.
+        """
+        for results in self._fetch_cursor(query, chunksize):
+            data = np.recarray((len(results),), dtype=dtype)
+            self._fill_columns(data, 0, results)
+            yield data
+
+    def _fetch_cursor(self, query, chunksize):
+        """Execute a query with the DB-API cursor, yielding each (non-empty) list of chunksize rows.
+        """
+        sql = str(query.statement.compile(dialect=self.connection.engine.dialect,
+                                          compile_kwargs={'literal_binds': True}))
+        cursor = self.connection.session.connection().connection.cursor()
+        try:
+            cursor.execute(sql)
+            results = cursor.fetchmany(chunksize)
+            while len(results) > 0:
+                yield results
+                results = cursor.fetchmany(chunksize)
+        finally:
+            cursor.close()
+
+    def _fill_columns(self, data, start, results):
+        """Copy the rows in results into data[start:start + len(results)], one column at a time.
+        """
+        stop = start + len(results)
+        for col, values in zip(data.dtype.names, zip(*results)):
+            data[col][start:stop] = values
+
     def _convert_results(self, results, dtype):
         if len(results) == 0:
             data = np.recarray((0,), dtype=dtype)
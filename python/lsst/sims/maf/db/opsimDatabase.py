@@ -2,9 +2,16 @@ from __future__ import print_function
 from builtins import str
 from builtins import zip
 import os, re
+import hashlib
+import tempfile
+import shutil
+import time
 import numpy as np
 import warnings
+from sqlalchemy import text
+from sqlalchemy.engine import reflection
 from .database import Database
+from .sqlConstraint import SqlConstraint
 from lsst.sims.utils import Site
 from lsst.sims.maf.utils import getDateVersion
 
@@ -22,7 +29,7 @@ def testOpsimVersion(database, driver='sqlite', host=None, port=None):
     return version
 
 def OpsimDatabase(database, driver='sqlite', host=None, port=None,
-                  longstrings=False, verbose=False):
+                  longstrings=False, verbose=False, cacheDir=None):
     """Convenience method to return an appropriate OpsimDatabaseV3/V4 version.
 
     This is here for backwards compatibility, as 'opsdb = db.OpsimDatabase(dbFile)' will
@@ -32,10 +39,10 @@ def OpsimDatabase(database, driver='sqlite', host=None, port=None,
     version = testOpsimVersion(database)
     if version == 'V4':
         opsdb = OpsimDatabaseV4(database, driver=driver, host=host, port=port,
-                                longstrings=longstrings, verbose=verbose)
+                                longstrings=longstrings, verbose=verbose, cacheDir=cacheDir)
     elif version == 'V3':
         opsdb =  OpsimDatabaseV3(database, driver=driver, host=host, port=port,
-                                 longstrings=longstrings, verbose=verbose)
+                                 longstrings=longstrings, verbose=verbose, cacheDir=cacheDir)
     else:
         warnings.warn('Could not identify opsim database version; just using Database class instead')
         opsdb = Database(database, driver=driver, host=host, port=port,
@@ -46,12 +53,33 @@ def OpsimDatabase(database, driver='sqlite', host=None, port=None,
 class BaseOpsimDatabase(Database):
     """Base opsim database class to gather common methods among different versions of the opsim schema.
 
-    Not intended to be used directly; use OpsimDatabaseV3 or OpsimDatabaseV4 instead."""
+    Not intended to be used directly; use OpsimDatabaseV3 or OpsimDatabaseV4 instead.
+
+    If cacheDir is set (for sqlite databases), each column of the default table is saved as a
+    (memory-mappable) numpy .npy file in a subdirectory of cacheDir the first time it is fetched
+    with fetchMetricData. The columns are always queried ordered by the columns which identify each row
+    (cacheKeyCols: the observation and proposal ids), and the key columns fetched with each query are
+    checked against the cached keys, so the files line up row for row. Later calls to fetchMetricData
+    (in this or later python sessions) assemble the data from these files and apply the sqlconstraint
+    with numpy, instead of querying the database.
+    The cache subdirectory is specific to the database file, its size and its modification time,
+    so changing the database invalidates the cache. Sqlconstraints which can't be evaluated with
+    numpy (see SqlConstraint) are still sent to the database."""
     def __init__(self, database, driver='sqlite', host=None, port=None, defaultTable=None,
-                 longstrings=False, verbose=False):
+                 longstrings=False, verbose=False, cacheDir=None):
         super(BaseOpsimDatabase, self).__init__(database=database, driver=driver, host=host, port=port,
                                                 defaultTable=defaultTable, longstrings=longstrings,
                                                 verbose=verbose)
+        if cacheDir is not None and driver != 'sqlite':
+            warnings.warn('The column cache is only available for sqlite databases; not using cacheDir.')
+            cacheDir = None
+        self.cacheDir = cacheDir
+        self._databaseFile = database
+        self._longstrings = longstrings
+        # The columns identifying each row of the default table (set for each opsim version in _colNames).
+        self.cacheKeyCols = None
+        # The tables for which the column cache can't be used (and why).
+        self._cacheDisabled = {}
         # Save filterlist so that we get the filter info per proposal in this desired order.
         self.filterlist = np.array(['u', 'g', 'r', 'i', 'z', 'y'])
         self.defaultTable = defaultTable
@@ -76,6 +104,9 @@ class BaseOpsimDatabase(Database):
         groupBy : str, opt
             The column to group the returned data by.
             Default (when using summaryTable) is the MJD, otherwise will be None.
+            The grouping is not done by the database: the data matching the sqlconstraint is queried,
+            sorted by groupBy (if it is not already in order) and then, if any values of groupBy are
+            repeated, one row is kept for each value of groupBy with numpy.
         tableName : str, opt
             The table to query. The default (None) will use the summary table, set by self.summaryTable.
 
@@ -90,11 +121,388 @@ class BaseOpsimDatabase(Database):
             groupBy = self.mjdCol
         if groupBy is 'default' and tableName!=self.defaultTable:
             groupBy = None
+        if self.cacheDir is not None and tableName == self.defaultTable:
+            metricdata = self._fetchCachedData(colnames, sqlconstraint, groupBy, tableName)
+            if metricdata is not None:
+                return metricdata
+        if groupBy is not None and tableName in self.tableNames and groupBy in self.columnNames[tableName]:
+            return self._fetchGroupedData(colnames, sqlconstraint, groupBy, tableName)
         metricdata = super(BaseOpsimDatabase, self).fetchMetricData(colnames=colnames,
                                                                 sqlconstraint=sqlconstraint,
                                                                 groupBy=groupBy, tableName=tableName)
         return metricdata
 
+    def _fetchGroupedData(self, colnames, sqlconstraint, groupBy, tableName):
+        """Fetch metric data grouped by groupBy, doing the grouping with numpy instead of in the database.
+
+        A GROUP BY makes the database sort the whole result set; a plain query (followed by a sort,
+        if needed, and dropping the rows with repeated values of groupBy) is much faster for large tables.
+        Whether groupBy has repeated values is checked on the data matching the sqlconstraint,
+        so the row kept for each value always matches the sqlconstraint.
+        """
+        queryCols = list(colnames)
+        if groupBy not in queryCols:
+            queryCols.append(groupBy)
+        data = super(BaseOpsimDatabase, self).fetchMetricData(colnames=queryCols,
+                                                          sqlconstraint=sqlconstraint,
+                                                          groupBy=None, tableName=tableName)
+        values = data[groupBy]
+        # Match the order of the GROUP BY (opsim outputs are usually already in MJD order).
+        if len(values) > 1 and np.any(values[1:] < values[:-1]):
+            rows = np.argsort(values, kind='mergesort')
+            sortedValues = values[rows]
+        else:
+            rows = None
+            sortedValues = values
+        repeated = sortedValues[1:] == sortedValues[:-1]
+        if np.any(repeated):
+            # Keep the first row for each value (the stable sort keeps the rows for a value in order).
+            keep = np.concatenate(([True], ~repeated))
+            rows = np.where(keep)[0] if rows is None else rows[keep]
+        if len(queryCols) == len(colnames):
+            if rows is None:
+                return data
+            return data[rows]
+        if rows is None:
+            rows = slice(None)
+        metricdata = np.recarray((len(values[rows]),), dtype=[(col, data.dtype[col]) for col in colnames])
+        for col in colnames:
+            metricdata[col] = data[col][rows]
+        return metricdata
+
+    def iterMetricData(self, colnames, sqlconstraint=None, tableName=None, chunksize=1000000):
+        """
+        Fetch 'colnames' from 'tableName' as a series of chunks, ordered by MJD.
+
+        For the default table, only one visit is returned for each MJD
+        (matching the default groupBy of fetchMetricData).
+
+        Parameters
+        ----------
+        colnames : list
+            The columns to fetch from the table.
+        sqlconstraint : str, opt
+            The sql constraint to apply to the data (minus "WHERE"). Default None.
+        tableName : str, opt
+            The table to query. The default (None) will use the summary table, set by self.defaultTable.
+        chunksize : int, opt
+            The (maximum) number of visits in each chunk. Default 1000000.
+
+        Yields
+        ------
+        np.recarray
+            A structured array containing the next chunk of the data queried from the database.
+        """
+        if tableName is None:
+            tableName = self.defaultTable
+        if tableName != self.defaultTable:
+            for chunk in self.iterColumns(tableName, colnames=colnames, sqlconstraint=sqlconstraint,
+                                          chunksize=chunksize):
+                yield chunk
+            return
+        queryCols = list(colnames)
+        if self.mjdCol not in queryCols:
+            queryCols.append(self.mjdCol)
+        lastMJD = None
+        for chunk in self.iterColumns(tableName, colnames=queryCols, sqlconstraint=sqlconstraint,
+                                      orderBy=self.mjdCol, chunksize=chunksize):
+            # Drop repeated visits (duplicate MJDs are adjacent, but may cross chunk boundaries).
+            mjd = chunk[self.mjdCol]
+            keep = np.ones(len(chunk), dtype=bool)
+            keep[1:] = mjd[1:] != mjd[:-1]
+            if lastMJD is not None:
+                keep[0] = mjd[0] != lastMJD
+            lastMJD = mjd[-1]
+            if len(queryCols) != len(colnames):
+                data = np.recarray((keep.sum(),), dtype=[(col, chunk.dtype[col]) for col in colnames])
+                for col in colnames:
+                    data[col] = chunk[col][keep]
+            else:
+                data = chunk[keep]
+            if len(data) > 0:
+                yield data
+
+    def _columnCacheDir(self):
+        """Return the directory of the column cache for this database file (making it, if needed).
+        """
+        dbFile = os.path.abspath(self._databaseFile)
+        stat = os.stat(dbFile)
+        # The size and modification time of the database identify its version.
+        dbId = hashlib.sha1(('%s %d %r' % (dbFile, stat.st_size, stat.st_mtime)).encode('utf-8')).hexdigest()
+        cacheDir = os.path.join(self.cacheDir, '%s_%s' % (os.path.basename(dbFile), dbId[:16]))
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        return cacheDir
+
+    def _fetchCachedColumns(self, colnames, tableName):
+        """Return a dict of (memory-mapped) arrays for colnames, from the column cache.
+
+        Columns which are not yet in the cache are queried from the database in a single query,
+        together with the key columns (self.cacheKeyCols) and ordered by them, and written to the cache.
+        Raises a ValueError if the key columns don't identify the rows uniquely, or if the keys
+        don't match the keys of the columns already in the cache.
+        """
+        keyCols = self.cacheKeyCols
+        if keyCols is None or len(keyCols) == 0:
+            raise ValueError('no columns identifying the rows are known for this database')
+        for col in keyCols:
+            if col not in self.columnNames[tableName]:
+                raise ValueError('key column %s is not in table %s' % (col, tableName))
+        cacheDir = self._columnCacheDir()
+        allCols = list(keyCols) + [col for col in colnames if col not in keyCols]
+        filenames = dict([(col, os.path.join(cacheDir, '%s.%s.npy' % (tableName, col))) for col in allCols])
+        missing = [col for col in colnames if not os.path.isfile(filenames[col])]
+        if len(missing) > 0:
+            if getattr(self, 'verbose', False):
+                print('Adding columns %s of table %s to the column cache in %s'
+                      % (missing, tableName, cacheDir))
+            queryCols = list(keyCols) + [col for col in missing if col not in keyCols]
+            query = self._build_query(tableName, colnames=queryCols)
+            query = query.order_by(*keyCols)
+            dtype = [(col,) + self.dbTypeMap[self.tables[tableName].c[col].type.__visit_name__]
+                     for col in queryCols]
+            data = self._query_columnar(query, dtype)
+            # The rows are sorted by the keys, so any repeated keys are adjacent.
+            if len(data) > 1:
+                repeated = np.ones(len(data) - 1, dtype=bool)
+                for col in keyCols:
+                    repeated &= data[col][1:] == data[col][:-1]
+                if np.any(repeated):
+                    raise ValueError('columns %s do not identify the rows of %s uniquely'
+                                     % (keyCols, tableName))
+            for col in keyCols:
+                if os.path.isfile(filenames[col]):
+                    if not np.array_equal(np.load(filenames[col], mmap_mode='r'), data[col]):
+                        raise ValueError('the rows of %s do not match the rows in the column cache %s'
+                                         % (tableName, cacheDir))
+            for col in queryCols:
+                if os.path.isfile(filenames[col]):
+                    continue
+                values = np.ascontiguousarray(data[col])
+                if values.dtype.kind == 'U' and len(values) > 0:
+                    # Save strings at their actual (not the maximum) length.
+                    values = values.astype('U%d' % max(1, np.char.str_len(values).max()))
+                # Write to a temporary file first, so other processes never see a partial file.
+                fd, tmpFile = tempfile.mkstemp(dir=cacheDir, suffix='.npy.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, values)
+                os.rename(tmpFile, filenames[col])
+        return dict([(col, np.load(filenames[col], mmap_mode='r')) for col in colnames])
+
+    def _fetchCachedData(self, colnames, sqlconstraint, groupBy, tableName):
+        """Fetch metric data from the column cache, applying the sqlconstraint and groupBy in numpy.
+
+        Returns None if the data can't be fetched from the cache (and so should be queried from the database).
+        """
+        try:
+            constraint = SqlConstraint(sqlconstraint, columns=self.columnNames[tableName])
+        except ValueError:
+            return None
+        for col in list(colnames) + list(constraint.cols) + [groupBy]:
+            if col is not None and col not in self.columnNames[tableName]:
+                # Let the database query report the missing column.
+                return None
+        neededCols = list(colnames) + [col for col in constraint.cols if col not in colnames]
+        if groupBy is not None and groupBy not in neededCols:
+            neededCols.append(groupBy)
+        if tableName in self._cacheDisabled:
+            return None
+        try:
+            columns = self._fetchCachedColumns(neededCols, tableName)
+        except Exception as e:
+            # Only warn once: the cache isn't used for this table again.
+            warnings.warn('Could not use the column cache for table %s (%s); querying the database.'
+                          % (tableName, e))
+            self._cacheDisabled[tableName] = str(e)
+            return None
+        nrows = len(columns[neededCols[0]])
+        if len(constraint.cols) > 0:
+            constraintData = np.empty(nrows, dtype=[(col, columns[col].dtype) for col in constraint.cols])
+            for col in constraint.cols:
+                constraintData[col] = columns[col]
+            rows = np.where(constraint(constraintData))[0]
+        else:
+            rows = np.arange(nrows)
+        if groupBy is not None:
+            # Like the sql GROUP BY, return one row for each value of groupBy, sorted by groupBy.
+            uniq, first = np.unique(columns[groupBy][rows], return_index=True)
+            rows = rows[first]
+        dtype = [(col,) + self.dbTypeMap[self.tables[tableName].c[col].type.__visit_name__] for col in colnames]
+        metricdata = np.recarray((len(rows),), dtype=dtype)
+        for col in colnames:
+            metricdata[col] = columns[col][rows]
+        return metricdata
+
+    def ensureIndexes(self, constraints, groupBy='default', tableName=None, inPlace=False, localCopy=None,
+                      timeQueries=False, verbose=True):
+        """Create the indexes on the sqlite database which will speed up the queries for 'constraints'.
+
+        Opsim outputs don't have indexes on the columns used in sqlconstraints, so each query for metric
+        data (such as 'filter = "r" and night < 365', grouped by MJD) is a full scan of the table followed
+        by a sort. For each constraint, this adds an index on the columns used in the constraint, followed
+        by the groupBy column, so that sqlite can find the matching rows and return them in groupBy order
+        directly from the index. Constraints which can't be parsed by SqlConstraint are skipped.
+
+        Views (such as SummaryAllProps in opsim v4 outputs) can't be indexed: for a view, the indexes are
+        added to the tables the view selects from which have all of the columns of the index (the groupBy
+        column is left out of the index if the table doesn't have it). Indexes which can't be added
+        to any of these tables are skipped, with a warning.
+
+        By default the database is copied to 'localCopy' and the indexes are added to the copy, so the
+        original database file is never changed. With inPlace=True the indexes are added to the database
+        file itself, if it is writable (note that this changes the file, so any column cache for the
+        database is rebuilt).
+
+        Parameters
+        ----------
+        constraints : list of str
+            The sqlconstraints which will be used to fetch the metric data, e.g. the constraints of all
+            of the bundles in a MetricBundleGroup.
+        groupBy : str, opt
+            The column the data will be grouped by. Default is the MJD for the default table, otherwise None.
+        tableName : str, opt
+            The table (or view) which will be queried. Default (None) uses the default table.
+        inPlace : bool, opt
+            Add the indexes to the database file itself, if it is writable. Default False.
+        localCopy : str, opt
+            The filename to copy the database to, if the indexes are not added in place.
+            Default None (copy it to a new temporary directory).
+        timeQueries : bool, opt
+            Time the query for each constraint before and after adding the indexes (this runs each query
+            twice). The times (in seconds) are available in the indexTimes attribute of the returned
+            database, a dict keyed by constraint. Default False.
+        verbose : bool, opt
+            Print the indexes created (and the query times, if timeQueries is True). Default True.
+
+        Returns
+        -------
+        OpsimDatabase
+            The database with the indexes: either this database, or a new database object for the local copy.
+            If the local copy was made in a new temporary directory, the indexCopyDir attribute of the
+            returned database is that directory; remove it when the copy is no longer needed.
+            The database is not copied if it already has all of the indexes.
+        """
+        if self.driver != 'sqlite':
+            warnings.warn('Can only create indexes for sqlite databases; not changing the database.')
+            return self
+        if tableName is None:
+            tableName = self.defaultTable
+        if groupBy == 'default':
+            groupBy = self.mjdCol if tableName == self.defaultTable else None
+        if tableName not in self.tableNames:
+            raise ValueError('Table %s not recognized; not in list of database tables.' % (tableName))
+        columns = self.columnNames[tableName]
+        # Work out which indexes are needed (and which constraints they will speed up).
+        indexes = {}
+        for constraint in set(constraints):
+            try:
+                cols = sorted(SqlConstraint(constraint, columns=columns).cols)
+            except ValueError:
+                warnings.warn('Could not parse constraint %s; not adding an index for it.' % (constraint))
+                continue
+            if groupBy is not None and groupBy not in cols:
+                cols.append(groupBy)
+            if len(cols) > 0:
+                indexes.setdefault(tuple(cols), []).append(constraint)
+        # Find the tables to add each index to.
+        if tableName in self._inspector.get_view_names():
+            baseTables = self._viewTables(tableName)
+        else:
+            baseTables = [tableName]
+        tableIndexes = {}
+        for cols in indexes:
+            found = False
+            for table in baseTables:
+                tableCols = [col for col in cols if col in self.columnNames[table]]
+                # The groupBy column is optional, but all of the constraint columns must be in the table.
+                missing = [col for col in cols if col not in tableCols and col != groupBy]
+                if len(missing) == 0 and len(tableCols) > 0:
+                    tableIndexes.setdefault((table, tuple(tableCols)), []).extend(indexes[cols])
+                    found = True
+            if not found:
+                warnings.warn('None of the tables %s have the columns %s (%s is a view of these tables);'
+                              ' not adding an index for constraints %s.'
+                              % (baseTables, cols, tableName, indexes[cols]))
+        # Only create the indexes which aren't there already.
+        # (A new inspector, as the reflected indexes would otherwise be cached.)
+        inspector = reflection.Inspector.from_engine(self.connection.engine)
+        newIndexes = []
+        for table, cols in sorted(tableIndexes):
+            existing = set([tuple(index['column_names']) for index in inspector.get_indexes(table)])
+            if cols not in existing:
+                newIndexes.append((table, cols))
+        if len(newIndexes) == 0:
+            if verbose and len(tableIndexes) > 0:
+                print('Database %s already has the indexes for these constraints.' % (self._databaseFile))
+            self.indexTimes = {}
+            return self
+        # Only change the database file itself if asked to (and if we can).
+        dbFile = self._databaseFile
+        dbDir = os.path.dirname(os.path.abspath(dbFile))
+        if inPlace and os.access(dbFile, os.W_OK) and os.access(dbDir, os.W_OK):
+            opsdb = self
+        else:
+            if inPlace:
+                warnings.warn('Database %s is not writable; adding the indexes to a copy.' % (dbFile))
+            copyDir = None
+            if localCopy is None:
+                copyDir = tempfile.mkdtemp(prefix='opsimIndexed')
+                localCopy = os.path.join(copyDir, os.path.basename(dbFile))
+            if verbose:
+                print('Copying database %s to %s to add indexes' % (dbFile, localCopy))
+            shutil.copyfile(dbFile, localCopy)
+            opsdb = self.__class__(localCopy, driver=self.driver, defaultTable=self.defaultTable,
+                                   longstrings=self._longstrings, verbose=getattr(self, 'verbose', False),
+                                   cacheDir=self.cacheDir)
+            # The temporary directory (if any) is left for the caller to remove once done with the copy.
+            opsdb.indexCopyDir = copyDir
+        constraints = sorted(set([c for index in newIndexes for c in tableIndexes[index]]))
+        times = {}
+        if timeQueries:
+            for constraint in constraints:
+                times[constraint] = [opsdb._timeQuery(tableName, constraint, groupBy), None]
+        for table, cols in newIndexes:
+            indexName = 'maf_%s_%s' % (table, '_'.join(cols))
+            sql = 'CREATE INDEX IF NOT EXISTS "%s" ON "%s" (%s)' % (indexName, table,
+                                                                   ', '.join(['"%s"' % c for c in cols]))
+            if verbose:
+                print('Creating index %s on %s (%s)' % (indexName, table, ', '.join(cols)))
+            opsdb.connection.engine.execute(text(sql))
+        if timeQueries:
+            for constraint in constraints:
+                times[constraint][1] = opsdb._timeQuery(tableName, constraint, groupBy)
+                if verbose:
+                    print('Query for constraint "%s": %.3fs without indexes, %.3fs with indexes'
+                          % (constraint, times[constraint][0], times[constraint][1]))
+            if verbose and len(constraints) > 0:
+                before = sum([t[0] for t in times.values()])
+                after = sum([t[1] for t in times.values()])
+                print('Total query time: %.3fs without indexes, %.3fs with indexes' % (before, after))
+        opsdb.indexTimes = times
+        return opsdb
+
+    def _viewTables(self, viewName):
+        """Return the names of the tables which appear in the definition of a view.
+        """
+        definition = self._inspector.get_view_definition(viewName)
+        if definition is None:
+            return []
+        words = set(re.findall(r'\w+', definition))
+        return [table for table in self._inspector.get_table_names() if table in words]
+
+    def _timeQuery(self, tableName, constraint, groupBy):
+        """Return the time taken to run the query (without returning the data) for constraint and groupBy.
+        """
+        sql = 'SELECT count(*) FROM (SELECT * FROM "%s"' % (tableName)
+        if constraint is not None and len(constraint) > 0:
+            sql += ' WHERE %s' % (constraint)
+        if groupBy is not None:
+            sql += ' GROUP BY "%s"' % (groupBy)
+        sql += ')'
+        t = time.time()
+        self.connection.engine.execute(text(sql)).fetchall()
+        return time.time() - t
+
     def fetchFieldsFromSummaryTable(self, sqlconstraint=None, raColName=None, decColName=None):
         """
         Fetch field information (fieldID/RA/Dec) from the summary table.
@@ -256,12 +664,15 @@ class OpsimDatabaseV4(BaseOpsimDatabase):
     dbTables : dict, opt
         Dictionary of the names of the tables in the database.
         The dict should be key = table name, value = [table name, primary key].
+    cacheDir : str, opt
+        Directory for a cache of the columns of the default table, to speed up repeated queries
+        of the same database (see BaseOpsimDatabase). Default None (no cache).
     """
     def __init__(self, database, driver='sqlite', host=None, port=None, defaultTable='SummaryAllProps',
-                 longstrings=False, verbose=False):
+                 longstrings=False, verbose=False, cacheDir=None):
         super(OpsimDatabaseV4, self).__init__(database=database, driver=driver, host=host, port=port,
                                               defaultTable=defaultTable, longstrings=longstrings,
-                                              verbose=verbose)
+                                              verbose=verbose, cacheDir=cacheDir)
 
     def _colNames(self):
         """
@@ -289,6 +700,8 @@ class OpsimDatabaseV4(BaseOpsimDatabase):
         self.runLengthParam = 'survey/duration'
         self.raDecInDeg = True
         self.opsimVersion = 'V4'
+        # There is a row in SummaryAllProps for each proposal of each visit.
+        self.cacheKeyCols = ['observationId', 'proposalId']
 
     def fetchFieldsFromFieldTable(self, propId=None, degreesToRadians=True):
         """
@@ -692,7 +1105,7 @@ class OpsimDatabaseV4(BaseOpsimDatabase):
 
 class OpsimDatabaseV3(BaseOpsimDatabase):
     def __init__(self, database, driver='sqlite', host=None, port=None, defaultTable='Summary',
-                 longstrings=False, verbose=False):
+                 longstrings=False, verbose=False, cacheDir=None):
         """
         Instantiate object to handle queries of the opsim database.
         (In general these will be the sqlite database files produced by opsim, but could
@@ -702,11 +1115,12 @@ class OpsimDatabaseV3(BaseOpsimDatabase):
         driver =  Name of database dialect+driver for sqlalchemy (e.g. 'sqlite', 'pymssql+mssql')
         host = Name of database host (optional)
         port = String port number (optional)
+        cacheDir = Directory for a cache of the columns of the default table (optional, see BaseOpsimDatabase)
 
         """
         super(OpsimDatabaseV3, self).__init__(database=database, driver=driver, host=host, port=port,
                                               defaultTable=defaultTable, longstrings=longstrings,
-                                              verbose=verbose)
+                                              verbose=verbose, cacheDir=cacheDir)
 
     def _colNames(self):
         """
@@ -734,6 +1148,8 @@ class OpsimDatabaseV3(BaseOpsimDatabase):
         self.runLengthParam = 'nRun'
         self.raDecInDeg = False
         self.opsimVersion = 'V3'
+        # There is a row in Summary for each proposal of each visit.
+        self.cacheKeyCols = ['obsHistID', 'propID']
 
     def fetchFieldsFromFieldTable(self, propId=None, degreesToRadians=True):
         """
@@ -1,7 +1,8 @@
 from builtins import str
 from builtins import object
 import os, warnings
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine import url
 from sqlalchemy.ext.declarative import declarative_base
@@ -98,9 +99,17 @@ class SummaryStatRow(Base):
 
 class ResultsDb(object):
     def __init__(self, outDir= None, database=None, driver='sqlite',
-                 host=None, port=None, verbose=False):
+                 host=None, port=None, verbose=False, autocommit=True, commitEvery=1000, walMode=False):
         """
         Instantiate the results database, creating metrics, plots and summarystats tables.
+
+        If autocommit is True (the default), every update is committed immediately.
+        If autocommit is False, the updates are only committed when commit() is called,
+        when commitEvery updates have accumulated, or when the database is closed; use this (or the
+        batch() context manager) when writing many results, as each commit is a (slow) sync to disk.
+        For sqlite databases, walMode=True uses the write-ahead-log journal, which makes commits cheaper
+        and lets other processes read the database while it is being written. It is off by default,
+        as the write-ahead-log does not work for databases on network filesystems (such as NFS).
         """
         # Connect to database
         # for sqlite, connecting to non-existent database creates it automatically
@@ -142,6 +151,18 @@ class ResultsDb(object):
                             database=self.database)
 
         engine = create_engine(dbAddress, echo=verbose)
+        if self.driver == 'sqlite' and walMode:
+            @event.listens_for(engine, 'connect')
+            def _setJournalMode(dbapiConnection, connectionRecord):
+                cursor = dbapiConnection.cursor()
+                cursor.execute('PRAGMA journal_mode=WAL')
+                cursor.execute('PRAGMA synchronous=NORMAL')
+                cursor.close()
+        self.autocommit = autocommit
+        self.commitEvery = commitEvery
+        self._nUncommitted = 0
+        # The keys of the metrics added to self._metricIds since the last commit.
+        self._uncommittedMetricKeys = []
         self.Session = sessionmaker(bind=engine)
         self.session = self.Session()
         # Create the tables, if they don't already exist.
@@ -150,13 +171,79 @@ class ResultsDb(object):
         except DatabaseError:
             raise ValueError("Cannot create a %s database at %s. Check directory exists." %(self.driver, self.database))
         self.slen = 1024
+        # The maximum number of metricIds to put in a single query.
+        self._maxQueryIds = 500
+        # Index of the metricIds already in the metrics table, keyed by
+        # (metricName, slicerName, simDataName, sqlConstraint, metricMetadata), so that updateMetric
+        # does not have to query the database.
+        self._metricIds = {}
+        for m in self.session.query(MetricRow.metricId, MetricRow.metricName, MetricRow.slicerName,
+                                    MetricRow.simDataName, MetricRow.sqlConstraint,
+                                    MetricRow.metricMetadata).order_by(MetricRow.metricId):
+            key = (m.metricName, m.slicerName, m.simDataName, m.sqlConstraint, m.metricMetadata)
+            self._metricIds.setdefault(key, m.metricId)
 
     def close(self):
         """
-        Close connection to database.
+        Close connection to database (committing any outstanding updates).
         """
+        if self._nUncommitted > 0:
+            self.commit()
         self.session.close()
 
+    def commit(self):
+        """
+        Commit all outstanding updates to the database.
+        """
+        self.session.commit()
+        self._nUncommitted = 0
+        self._uncommittedMetricKeys = []
+
+    def rollback(self):
+        """
+        Discard all of the updates made since the last commit.
+        """
+        self.session.rollback()
+        for key in self._uncommittedMetricKeys:
+            del self._metricIds[key]
+        self._nUncommitted = 0
+        self._uncommittedMetricKeys = []
+
+    def _update(self, nrows=1):
+        """
+        Commit the latest update, or count it towards the next commit if not in autocommit mode.
+        """
+        if self.autocommit:
+            self.commit()
+        else:
+            self._nUncommitted += nrows
+            if self.commitEvery is not None and self._nUncommitted >= self.commitEvery:
+                self.commit()
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager to commit all of the updates made inside it together, at the end.
+
+        If an exception is raised inside it, the outstanding updates are rolled back instead
+        (updates already committed because commitEvery updates had accumulated are kept).
+
+        For example:
+            with resultsDb.batch():
+                for b in bundles:
+                    b.computeSummaryStats(resultsDb)
+        """
+        autocommit = self.autocommit
+        self.autocommit = False
+        try:
+            yield self
+        except BaseException:
+            self.autocommit = autocommit
+            self.rollback()
+            raise
+        self.autocommit = autocommit
+        self.commit()
+
     def updateMetric(self, metricName, slicerName, simDataName, sqlConstraint,
                   metricMetadata, metricDataFile):
         """
@@ -170,7 +257,8 @@ class ResultsDb(object):
         - metricDatafile: the data file the metric data is stored in
 
         If same metric (same metricName, slicerName, simDataName, sqlConstraint, metadata)
-        already exists, it does nothing.
+        already exists, it does nothing. (The existing metrics are looked up in an in-memory index,
+        so this assumes the metrics table is not being modified by another ResultsDb at the same time.)
 
         Returns metricId: the Id number of this metric in the metrics table.
         """
@@ -183,20 +271,19 @@ class ResultsDb(object):
         if metricDataFile is None:
             metricDataFile = 'NULL'
         # Check if metric has already been added to database.
-        prev = self.session.query(MetricRow).filter_by(metricName=metricName,
-                                                       slicerName=slicerName,
-                                                       simDataName=simDataName,
-                                                       metricMetadata=metricMetadata,
-                                                       sqlConstraint=sqlConstraint).all()
-        if len(prev) == 0:
-            metricinfo = MetricRow(metricName=metricName, slicerName=slicerName, simDataName=simDataName,
-                                   sqlConstraint=sqlConstraint, metricMetadata=metricMetadata,
-                                   metricDataFile=metricDataFile)
-            self.session.add(metricinfo)
-            self.session.commit()
-        else:
-            metricinfo = prev[0]
-        return metricinfo.metricId
+        key = (metricName, slicerName, simDataName, sqlConstraint, metricMetadata)
+        if key in self._metricIds:
+            return self._metricIds[key]
+        metricinfo = MetricRow(metricName=metricName, slicerName=slicerName, simDataName=simDataName,
+                               sqlConstraint=sqlConstraint, metricMetadata=metricMetadata,
+                               metricDataFile=metricDataFile)
+        self.session.add(metricinfo)
+        # Assign the metricId (before committing, which would expire metricinfo).
+        self.session.flush()
+        self._metricIds[key] = metricinfo.metricId
+        self._uncommittedMetricKeys.append(key)
+        self._update()
+        return self._metricIds[key]
 
     def updateDisplay(self, metricId, displayDict, overwrite=True):
         """
@@ -236,7 +323,7 @@ class ResultsDb(object):
                                  displayGroup=displayGroup, displaySubgroup=displaySubgroup,
                                  displayOrder=displayOrder, displayCaption=displayCaption)
         self.session.add(displayinfo)
-        self.session.commit()
+        self._update()
 
     def updatePlot(self, metricId, plotType, plotFile):
         """
@@ -255,7 +342,7 @@ class ResultsDb(object):
                 self.session.delete(p)
         plotinfo = PlotRow(metricId=metricId, plotType=plotType, plotFile=plotFile)
         self.session.add(plotinfo)
-        self.session.commit()
+        self._update()
 
     def updateSummaryStat(self, metricId, summaryName, summaryValue):
         """
@@ -275,17 +362,19 @@ class ResultsDb(object):
         #   'name' and 'value' columns.  (specificially needed for TableFraction summary statistic).
         if isinstance(summaryValue, np.ndarray):
             if (('name' in summaryValue.dtype.names) and ('value' in summaryValue.dtype.names)):
+                summarystats = []
                 for value in summaryValue:
                     sSuffix = value['name']
                     if isinstance(sSuffix, bytes):
                         sSuffix = sSuffix.decode('utf-8')
                     else:
                         sSuffix = str(sSuffix)
-                    summarystat = SummaryStatRow(metricId=metricId,
-                                                 summaryName=summaryName + ' ' + sSuffix,
-                                                 summaryValue=value['value'])
-                    self.session.add(summarystat)
-                    self.session.commit()
+                    summarystats.append({'metricId': metricId,
+                                         'summaryName': summaryName + ' ' + sSuffix,
+                                         'summaryValue': float(value['value'])})
+                # Insert all of the rows at once.
+                self.session.bulk_insert_mappings(SummaryStatRow, summarystats)
+                self._update(len(summarystats))
             else:
                 warnings.warn('Warning! Cannot save non-conforming summary statistic.')
         # Most summary statistics will be simple floats.
@@ -294,7 +383,7 @@ class ResultsDb(object):
                 summarystat = SummaryStatRow(metricId=metricId, summaryName=summaryName,
                                              summaryValue=summaryValue)
                 self.session.add(summarystat)
-                self.session.commit()
+                self._update()
             else:
                 warnings.warn('Warning! Cannot save summary statistic that is not a simple float or int')
 
@@ -351,20 +440,31 @@ class ResultsDb(object):
         Optionally, also specify the summary metric name.
         Returns a numpy array of the metric information + summary statistic information.
         """
+        # Join the metric table and the summarystat table, based on the metricID.
+        query = (self.session.query(MetricRow.metricId, MetricRow.metricName, MetricRow.slicerName,
+                                    MetricRow.metricMetadata, SummaryStatRow.summaryName,
+                                    SummaryStatRow.summaryValue)
+                 .filter(MetricRow.metricId == SummaryStatRow.metricId))
+        if summaryName is not None:
+            query = query.filter(SummaryStatRow.summaryName == summaryName)
         if metricId is None:
-            metricId = self.getAllMetricIds()
-        if not hasattr(metricId, '__iter__'):
-            metricId = [metricId,]
-        summarystats = []
-        for mid in metricId:
-            # Join the metric table and the summarystat table, based on the metricID (the second filter)
-            query = (self.session.query(MetricRow, SummaryStatRow).filter(MetricRow.metricId == mid)
-                     .filter(MetricRow.metricId == SummaryStatRow.metricId))
-            if summaryName is not None:
-                query = query.filter(SummaryStatRow.summaryName == summaryName)
-            for m, s in query:
-                summarystats.append((m.metricId, m.metricName, m.slicerName, m.metricMetadata,
-                                     s.summaryName, s.summaryValue))
+            # All of the summary stats at once.
+            summarystats = [tuple(m) for m in query.order_by(MetricRow.metricId, SummaryStatRow.statId)]
+        else:
+            if not hasattr(metricId, '__iter__'):
+                metricId = [metricId,]
+            # Query for all of the metricIds at once
+            # (in chunks, as sqlite limits the number of variables in a query).
+            metricId = [int(mid) for mid in metricId]
+            found = {}
+            for i in range(0, len(metricId), self._maxQueryIds):
+                chunk = query.filter(MetricRow.metricId.in_(metricId[i:i + self._maxQueryIds]))
+                for m in chunk.order_by(SummaryStatRow.statId):
+                    found.setdefault(m.metricId, []).append(tuple(m))
+            # Return the stats in the order of metricId.
+            summarystats = []
+            for mid in metricId:
+                summarystats.extend(found.get(mid, []))
         # Convert to numpy array.
         dtype = np.dtype([('metricId', int), ('metricName', np.str_, self.slen),
                           ('slicerName', np.str_, self.slen), ('metricMetadata', np.str_, self.slen),
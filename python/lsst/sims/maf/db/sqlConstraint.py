@@ -0,0 +1,261 @@
+from builtins import object
+import re
+import operator
+import numpy as np
+
+__all__ = ['SqlConstraint']
+
+
+class SqlConstraint(object):
+    """Evaluate a (simple) sql constraint on a numpy structured array, instead of in the database.
+
+    The common forms of sql constraint used in MAF are supported: comparisons (=, ==, !=, <>, <, <=, >, >=)
+    between columns, numbers and strings, arithmetic (+, -, *, /, %), IN (...), BETWEEN .. AND ..,
+    NOT, AND, OR and parentheses.
+    Anything else (functions, LIKE, subqueries, ..) raises a ValueError when the SqlConstraint is created,
+    so that the constraint can be sent to the database instead.
+
+    Parameters
+    ----------
+    sqlconstraint : str
+        The sql constraint (minus "WHERE"), e.g. 'filter = "r" and night < 365'.
+    columns : list of str, opt
+        The names of the columns in the database table. These are used to match the (case-insensitive)
+        column names in the constraint, and to tell double-quoted column names from double-quoted strings.
+        Default None (any identifier in the constraint is treated as a column name, as written).
+
+    Attributes
+    ----------
+    cols : set of str
+        The names of the columns used by the constraint.
+    """
+    _tokenRegex = re.compile(r"""\s*(?:(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+                                     |(?P<string>'(?:[^']|'')*')
+                                     |(?P<quoted>"(?:[^"]|"")*")
+                                     |(?P<bracketed>\[[^\]]*\]|`[^`]*`)
+                                     |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+                                     |(?P<op><=|>=|<>|!=|==|[=<>+\-*/%(),]))""", re.VERBOSE)
+    _keywords = set(['and', 'or', 'not', 'in', 'between', 'is', 'null', 'like', 'glob', 'escape',
+                     'case', 'when', 'then', 'else', 'end', 'select', 'exists'])
+
+    def __init__(self, sqlconstraint, columns=None):
+        self.sqlconstraint = sqlconstraint
+        if columns is None:
+            self._columns = None
+        else:
+            self._columns = dict([(col.lower(), col) for col in columns])
+        self.cols = set()
+        if sqlconstraint is None or len(sqlconstraint.strip()) == 0:
+            self._expr = None
+        else:
+            self._tokens = self._tokenize(sqlconstraint)
+            self._pos = 0
+            self._expr = self._parseOr()
+            if self._pos != len(self._tokens):
+                raise ValueError('Could not parse sqlconstraint %s beyond %s'
+                                 % (sqlconstraint, self._tokens[self._pos][1]))
+            del self._tokens
+
+    def __call__(self, data):
+        """Return the boolean mask of the rows of data which match the constraint.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            A structured array containing (at least) the columns in self.cols.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array, True where the constraint is met.
+        """
+        if self._expr is None:
+            return np.ones(len(data), dtype=bool)
+        mask = self._expr(data)
+        return np.broadcast_to(np.asarray(mask, dtype=bool), (len(data),)).copy()
+
+    def _tokenize(self, sqlconstraint):
+        tokens = []
+        pos = 0
+        sqlconstraint = sqlconstraint.rstrip()
+        while pos < len(sqlconstraint):
+            match = self._tokenRegex.match(sqlconstraint, pos)
+            if match is None or match.end() == pos:
+                raise ValueError('Could not parse sqlconstraint %s at %s' % (sqlconstraint, sqlconstraint[pos:]))
+            kind = match.lastgroup
+            tokens.append((kind, match.group(kind)))
+            pos = match.end()
+        return tokens
+
+    def _peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return (None, None)
+
+    def _isKeyword(self, word):
+        kind, value = self._peek()
+        return kind == 'name' and value.lower() == word
+
+    def _isOp(self, *ops):
+        kind, value = self._peek()
+        return kind == 'op' and value in ops
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise ValueError('Unexpected end of sqlconstraint %s' % (self.sqlconstraint))
+        self._pos += 1
+        return token
+
+    def _expect(self, op):
+        kind, value = self._next()
+        if kind != 'op' or value != op:
+            raise ValueError('Expected %s in sqlconstraint %s, found %s' % (op, self.sqlconstraint, value))
+
+    def _parseOr(self):
+        terms = [self._parseAnd()]
+        while self._isKeyword('or'):
+            self._next()
+            terms.append(self._parseAnd())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda data: np.logical_or.reduce([term(data) for term in terms])
+
+    def _parseAnd(self):
+        terms = [self._parseNot()]
+        while self._isKeyword('and'):
+            self._next()
+            terms.append(self._parseNot())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda data: np.logical_and.reduce([term(data) for term in terms])
+
+    def _parseNot(self):
+        if self._isKeyword('not'):
+            self._next()
+            term = self._parseNot()
+            return lambda data: np.logical_not(term(data))
+        return self._parseComparison()
+
+    def _parseComparison(self):
+        left = self._parseSum()
+        negate = False
+        if self._isKeyword('not'):
+            self._next()
+            negate = True
+            if not (self._isKeyword('in') or self._isKeyword('between')):
+                raise ValueError('Could not parse NOT in sqlconstraint %s' % (self.sqlconstraint))
+        if self._isKeyword('in'):
+            self._next()
+            self._expect('(')
+            values = [self._parseSum()]
+            while self._isOp(','):
+                self._next()
+                values.append(self._parseSum())
+            self._expect(')')
+            result = lambda data: np.logical_or.reduce([left(data) == value(data) for value in values])
+        elif self._isKeyword('between'):
+            self._next()
+            low = self._parseSum()
+            if not self._isKeyword('and'):
+                raise ValueError('Expected AND after BETWEEN in sqlconstraint %s' % (self.sqlconstraint))
+            self._next()
+            high = self._parseSum()
+            result = lambda data: (left(data) >= low(data)) & (left(data) <= high(data))
+        elif self._isOp('=', '==', '!=', '<>', '<', '<=', '>', '>='):
+            op = self._next()[1]
+            right = self._parseSum()
+            comparisons = {'=': operator.eq, '==': operator.eq, '!=': operator.ne, '<>': operator.ne,
+                           '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+            compare = comparisons[op]
+            result = lambda data: compare(left(data), right(data))
+        else:
+            return left
+        if negate:
+            return lambda data: np.logical_not(result(data))
+        return result
+
+    def _parseSum(self):
+        expr = self._parseProduct()
+        while self._isOp('+', '-'):
+            op = self._next()[1]
+            expr = self._binary(op, expr, self._parseProduct())
+        return expr
+
+    def _parseProduct(self):
+        expr = self._parseUnary()
+        while self._isOp('*', '/', '%'):
+            op = self._next()[1]
+            expr = self._binary(op, expr, self._parseUnary())
+        return expr
+
+    @staticmethod
+    def _binary(op, left, right):
+        if op == '+':
+            return lambda data: np.add(left(data), right(data))
+        if op == '-':
+            return lambda data: np.subtract(left(data), right(data))
+        if op == '*':
+            return lambda data: np.multiply(left(data), right(data))
+
+        def divide(data):
+            a = np.asarray(left(data))
+            b = np.asarray(right(data))
+            if np.issubdtype(a.dtype, np.integer) and np.issubdtype(b.dtype, np.integer):
+                # Integer division (and remainder) truncates towards zero in sql.
+                quotient = np.trunc(np.true_divide(a, b)).astype(np.result_type(a, b))
+                if op == '/':
+                    return quotient
+                return a - b * quotient
+            if op == '/':
+                return np.true_divide(a, b)
+            return np.fmod(a, b)
+        return divide
+
+    def _parseUnary(self):
+        if self._isOp('-'):
+            self._next()
+            term = self._parseUnary()
+            return lambda data: np.negative(term(data))
+        if self._isOp('+'):
+            self._next()
+            return self._parseUnary()
+        return self._parseAtom()
+
+    def _parseAtom(self):
+        kind, value = self._next()
+        if kind == 'op' and value == '(':
+            expr = self._parseOr()
+            self._expect(')')
+            return expr
+        if kind == 'number':
+            if re.match(r'^\d+$', value):
+                number = int(value)
+            else:
+                number = float(value)
+            return lambda data: number
+        if kind == 'string':
+            string = value[1:-1].replace("''", "'")
+            return lambda data: string
+        if kind == 'quoted':
+            # Double quotes mark an identifier if it matches a column; otherwise sqlite treats them as a string.
+            name = value[1:-1].replace('""', '"')
+            if self._columns is not None and name.lower() in self._columns:
+                return self._column(name)
+            return lambda data: name
+        if kind == 'bracketed':
+            return self._column(value[1:-1])
+        if kind == 'name':
+            if value.lower() in self._keywords or self._isOp('('):
+                raise ValueError('Could not evaluate %s in sqlconstraint %s' % (value, self.sqlconstraint))
+            return self._column(value)
+        raise ValueError('Could not parse %s in sqlconstraint %s' % (value, self.sqlconstraint))
+
+    def _column(self, name):
+        if self._columns is not None:
+            if name.lower() not in self._columns:
+                raise ValueError('Column %s in sqlconstraint %s is not in the table'
+                                 % (name, self.sqlconstraint))
+            name = self._columns[name.lower()]
+        self.cols.add(name)
+        return lambda data: data[name]
@@ -1,21 +1,28 @@
 from __future__ import print_function
 from builtins import object
 import os
+import multiprocessing
 import numpy as np
 import numpy.ma as ma
 import matplotlib.pyplot as plt
 from collections import OrderedDict
+from contextlib import contextmanager
 
 import lsst.sims.maf.db as db
 import lsst.sims.maf.utils as utils
 from lsst.sims.maf.plots import PlotHandler
 import lsst.sims.maf.maps as maps
-from lsst.sims.maf.stackers import BaseDitherStacker
+from lsst.sims.maf.stackers import StackerPlan
 from .metricBundle import MetricBundle, createEmptyMetricBundle
 import warnings
 
 __all__ = ['makeBundlesDictFromList', 'MetricBundleGroup']
 
+# State shared with the worker processes used to calculate metric values in parallel.
+# This is set immediately before the worker pool is forked, so that the workers inherit
+# simData and the (set up) slicer through shared memory instead of receiving pickled copies.
+_sharedState = {}
+
 
 def makeBundlesDictFromList(bundleList):
     """Utility to convert a list of MetricBundles into a dictionary, keyed by the fileRoot names.
@@ -35,6 +42,189 @@ def makeBundlesDictFromList(bundleList):
     return bDict
 
 
+def _buildSliceIndexCSR(slicer):
+    """Gather the simData indexes for each slicepoint of a set up slicer into CSR form.
+
+    Parameters
+    ----------
+    slicer : lsst.sims.maf.slicers.BaseSlicer
+        The slicer, after setupSlicer has been run.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The (indptr, indices) arrays; the indexes for slicepoint i are indices[indptr[i]:indptr[i+1]].
+    """
+    # Spatial slicers precompute these arrays in setupSlicer.
+    if getattr(slicer, 'sliceIndexCSR', None) is not None:
+        return slicer.sliceIndexCSR
+    idxList = []
+    for slice_i in slicer:
+        idxs = np.asarray(slice_i['idxs'])
+        # Some slicers (e.g. the UniSlicer) return a boolean mask rather than indexes.
+        if idxs.dtype == bool:
+            idxs = np.where(idxs)[0]
+        idxList.append(idxs.astype(int))
+    indptr = np.zeros(len(idxList) + 1, dtype=int)
+    indptr[1:] = np.cumsum([len(idxs) for idxs in idxList])
+    if len(idxList) > 0:
+        indices = np.concatenate(idxList)
+    else:
+        indices = np.array([], dtype=int)
+    return indptr, indices
+
+
+class _SliceCache(object):
+    """Least-recently-used cache of where metric values were stored for each set of simData indexes.
+
+    Sets of indexes are identified by a 64-bit hash of the sorted indexes; the indexes themselves are
+    kept to check for hash collisions.
+
+    Parameters
+    ----------
+    maxSize : int
+        The maximum number of index sets to keep in the cache.
+    maxBytes : int, optional
+        The maximum total size (in bytes) of the index arrays kept in the cache. Default None (no limit).
+    """
+    def __init__(self, maxSize, maxBytes=None):
+        self.maxSize = maxSize
+        self.maxBytes = maxBytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def lookup(self, idxs):
+        """Find the location of the metric values previously calculated for these simData indexes.
+
+        Parameters
+        ----------
+        idxs : numpy.ndarray or list
+            The simData indexes at a slicepoint.
+
+        Returns
+        -------
+        location : int or None
+            The location of the cached metric values, or None if these indexes are not in the cache.
+        key : int
+            The hash of the indexes, to pass to add.
+        sortedIdxs : numpy.ndarray
+            The sorted indexes, to pass to add.
+        """
+        sortedIdxs = np.sort(np.asarray(idxs))
+        key = hash(sortedIdxs.tobytes())
+        entry = self._cache.get(key)
+        if entry is not None and np.array_equal(entry[0], sortedIdxs):
+            # Move this value to the end of the OrderedDict (most recently used).
+            self._cache[key] = self._cache.pop(key)
+            self.hits += 1
+            return entry[1], key, sortedIdxs
+        self.misses += 1
+        return None, key, sortedIdxs
+
+    def add(self, key, sortedIdxs, location):
+        """Add the location of the metric values for a set of simData indexes, evicting old entries.
+        """
+        if key in self._cache:
+            # A hash collision: replace the older entry.
+            self.nbytes -= self._cache.pop(key)[0].nbytes
+        self._cache[key] = (sortedIdxs, location)
+        self.nbytes += sortedIdxs.nbytes
+        while len(self._cache) > self.maxSize or (self.maxBytes is not None and
+                                                   self.nbytes > self.maxBytes and len(self._cache) > 1):
+            # Drop the least recently used element.
+            self.nbytes -= self._cache.popitem(last=False)[1][0].nbytes
+
+
+def _calcSliceValues(simData, slicer, metricList, metricValues, start, stop, cacheBytes=None):
+    """Calculate metric values for slicepoints start through stop-1 of a set up slicer.
+
+    Parameters
+    ----------
+    simData : numpy.ndarray
+        The simulated data (with all stacker columns already added).
+    slicer : lsst.sims.maf.slicers.BaseSlicer
+        The slicer, after setupSlicer has been run.
+    metricList : list of lsst.sims.maf.metrics.BaseMetric
+        The metrics to calculate at each slicepoint.
+    metricValues : list of numpy.ma.MaskedArray
+        The masked arrays (one per metric) to fill with the metric values.
+        Slicepoint i is stored at index i - start.
+    start : int
+        The first slicepoint to calculate.
+    stop : int
+        One more than the last slicepoint to calculate.
+    cacheBytes : int, optional
+        The maximum size (in bytes) of the simData indexes kept in the slice cache, if the slicer
+        uses the cache (slicer.cacheSize > 0). Default None (limited only by slicer.cacheSize).
+
+    Returns
+    -------
+    int, int
+        The number of cache hits and misses.
+    """
+    if slicer.cacheSize > 0:
+        cache = _SliceCache(slicer.cacheSize, cacheBytes)
+    else:
+        cache = None
+    for i in range(start, stop):
+        slice_i = slicer[i]
+        j = i - start
+        slicedata = simData[slice_i['idxs']]
+        if len(slicedata) == 0:
+            # No data at this slicepoint. Mask data values.
+            for mv in metricValues:
+                mv.mask[j] = True
+        elif cache is not None:
+            # There is data - use the cached values if these simData indexes have been seen before.
+            location, key, sortedIdxs = cache.lookup(slice_i['idxs'])
+            if location is not None:
+                for mv in metricValues:
+                    mv.data[j] = mv.data[location]
+            else:
+                for metric, mv in zip(metricList, metricValues):
+                    mv.data[j] = metric.run(slicedata, slicePoint=slice_i['slicePoint'])
+                cache.add(key, sortedIdxs, j)
+        else:
+            # Not using memoize, just calculate things normally
+            for metric, mv in zip(metricList, metricValues):
+                mv.data[j] = metric.run(slicedata, slicePoint=slice_i['slicePoint'])
+    if cache is None:
+        return 0, 0
+    return cache.hits, cache.misses
+
+
+def _calcSliceChunk(chunk):
+    """Calculate the metric values for a chunk of slicepoints, in a worker process.
+
+    The simData, slicer, metrics and (empty) metricValues arrays are read from _sharedState.
+
+    Parameters
+    ----------
+    chunk : tuple of int
+        The (start, stop) range of slicepoints to calculate.
+
+    Returns
+    -------
+    list of tuple
+        The (data, mask) arrays of the metric values for this chunk, one tuple per metric.
+    tuple of int
+        The number of slice cache hits and misses.
+    """
+    start, stop = chunk
+    metricValues = [mv[start:stop].copy() for mv in _sharedState['metricValues']]
+    cacheStats = _calcSliceValues(_sharedState['simData'], _sharedState['slicer'], _sharedState['metricList'],
+                                  metricValues, start, stop, cacheBytes=_sharedState['cacheBytes'])
+    return [(mv.data, mv.mask) for mv in metricValues], cacheStats
+
+
+@contextmanager
+def _noBatch():
+    # Stand-in for ResultsDb.batch, when there is no resultsDb.
+    yield None
+
+
 class MetricBundleGroup(object):
     """The MetricBundleGroup exists to calculate the metric values for a group of
     MetricBundles.
@@ -78,15 +268,48 @@ class MetricBundleGroup(object):
         If False, metric values will only be saved after summary statistics are calculated.
     dbTable : Optional[str]
         The name of the table in the dbObj to query for data.
+    cacheBytes : Optional[int]
+        The maximum memory (in bytes) used to remember the simData indexes of the slicepoints
+        in the slice cache (for slicers which use the cache, e.g. the HealpixSlicer with useCache=True).
+        The number of slicepoints remembered is also limited by the slicer cacheSize.
+        Default None (limited only by the slicer cacheSize).
+    lazyStackers : Optional[bool]
+        If True, stacker columns are only calculated when they are first accessed (e.g. by a metric),
+        so stackers whose columns are never read are never run. Default False.
+    shareQueries : Optional[bool]
+        If True, runAll queries the database once for all of the constraints which can be evaluated
+        in memory (see lsst.sims.maf.db.SqlConstraint), fetching the union of their rows and columns
+        (without grouping by MJD), and then selects the data for each constraint from this result,
+        keeping one visit per MJD after the constraint is applied. Constraints which cannot be
+        evaluated in memory, or which use a column whose value can differ between the rows of
+        a single visit (such as the proposalId in SummaryAllProps), are still queried from the
+        database individually. Default False.
+    useBulk : Optional[bool]
+        If True, the metric values of a set of compatible metricBundles whose metrics all implement
+        runBulk are calculated for all slicepoints at once (and nWorkers is not used for them).
+        If False, the metric values are always calculated slicepoint by slicepoint. Default True.
     """
     def __init__(self, bundleDict, dbObj, outDir='.', resultsDb=None, verbose=True,
-                 saveEarly=True, dbTable=None):
+                 saveEarly=True, dbTable=None, cacheBytes=None, lazyStackers=False, shareQueries=False,
+                 useBulk=True):
         """Set up the MetricBundleGroup.
         """
         # Print occasional messages to screen.
         self.verbose = verbose
         # Save metric results as soon as possible (in case of crash).
         self.saveEarly = saveEarly
+        # Memory budget for the slice cache.
+        self.cacheBytes = cacheBytes
+        # Calculate stacker columns on first access.
+        self.lazyStackers = lazyStackers
+        # Query the data for multiple constraints at once (in runAll).
+        self.shareQueries = shareQueries
+        # Calculate the values of metrics which implement runBulk for all slicepoints at once.
+        self.useBulk = useBulk
+        self._sharedQuery = None
+        self._sharedData = None
+        self._sharedConstraints = {}
+        self._sharedPerVisit = {}
         # Check for output directory, create it if needed.
         self.outDir = outDir
         if not os.path.isdir(self.outDir):
@@ -118,6 +341,9 @@ class MetricBundleGroup(object):
                 raise ValueError('resultsDb should be an ResultsDb object')
         self.resultsDb = resultsDb
 
+        # The stacker plan for the current constraint (set in runCurrent).
+        self.stackerPlan = None
+
         # Dict to keep track of what's been run:
         self.hasRun = {}
         for bk in bundleDict:
@@ -219,7 +445,7 @@ class MetricBundleGroup(object):
         else:
             self.fieldData = None
 
-    def runAll(self, clearMemory=False, plotNow=False, plotKwargs=None):
+    def runAll(self, clearMemory=False, plotNow=False, plotKwargs=None, nWorkers=None, chunksize=None):
         """Runs all the metricBundles in the metricBundleGroup, over all constraints.
 
         Calculates metric values, then runs reduce functions and summary statistics for
@@ -233,13 +459,90 @@ class MetricBundleGroup(object):
             If True, plots the metric values immediately after calculation.
         plotKwargs : Optional[kwargs]
             kwargs to pass to plotCurrent.
+        nWorkers : Optional[int]
+            Number of worker processes to use to calculate the metric values at the slicepoints.
+            This is not used for compatible metricBundles whose values are calculated for all slicepoints
+            at once with runBulk (see useBulk), nor when the data are streamed (see chunksize).
+            Default None (calculate serially, in this process).
+        chunksize : Optional[int]
+            If set, stream the data for each constraint from the database in chunks of this many visits,
+            where all of the metricBundles for that constraint allow it (see runCurrent).
+            Default None (query all of the data for each constraint at once).
+        """
+        if self.shareQueries:
+            self._planQueries()
+        try:
+            for constraint in self.constraints:
+                # Set the 'currentBundleDict' which is a dictionary of the metricBundles which match this
+                #  constraint.
+                self.setCurrent(constraint)
+                with self._resultsDbBatch():
+                    self.runCurrent(constraint, clearMemory=clearMemory,
+                                    plotNow=plotNow, plotKwargs=plotKwargs, nWorkers=nWorkers,
+                                    chunksize=chunksize)
+        finally:
+            # Release the shared data.
+            self._sharedQuery = None
+            self._sharedData = None
+            self._sharedConstraints = {}
+            self._sharedPerVisit = {}
+
+    def _resultsDbBatch(self):
+        """Return a context manager which commits the resultsDb updates made inside it together.
         """
+        if self.resultsDb is None:
+            return _noBatch()
+        return self.resultsDb.batch()
+
+    def _planQueries(self):
+        """Find the constraints whose data can be selected in memory from a single, shared, query.
+
+        The shared query fetches the union of the columns needed for these constraints,
+        with a constraint which is the union ('or') of these constraints. It is not grouped by MJD:
+        the rows for each constraint are selected first, and then one row is kept for each MJD
+        (see _selectSharedData), as the row kept by grouping the union might not match a constraint.
+        """
+        self._sharedQuery = None
+        self._sharedData = None
+        self._sharedConstraints = {}
+        self._sharedPerVisit = {}
+        if self.dbObj is None or len(self.constraints) < 2:
+            return
+        tableCols = getattr(self.dbObj, 'columnNames', {}).get(self.dbTable)
+        if tableCols is None:
+            return
+        # Match the default groupBy of OpsimDatabase.fetchMetricData (one visit per MJD in the default table).
+        groupBy = getattr(self.dbObj, 'mjdCol', None)
+        if self.dbTable != self.dbObj.defaultTable or groupBy not in tableCols:
+            groupBy = None
+        constraints = {}
+        dbCols = set()
+        if groupBy is not None:
+            dbCols.add(groupBy)
         for constraint in self.constraints:
-            # Set the 'currentBundleDict' which is a dictionary of the metricBundles which match this
-            #  constraint.
-            self.setCurrent(constraint)
-            self.runCurrent(constraint, clearMemory=clearMemory,
-                            plotNow=plotNow, plotKwargs=plotKwargs)
+            cols = set()
+            for b in self.bundleDict.values():
+                if b.constraint == constraint:
+                    cols.update(b.dbCols)
+            # Missing columns are reported when this constraint is queried by itself.
+            if not cols.issubset(tableCols):
+                continue
+            try:
+                sqlconstraint = db.SqlConstraint(constraint, columns=tableCols)
+            except ValueError:
+                # This constraint can't be evaluated in memory, so will be queried by itself.
+                continue
+            constraints[constraint] = sqlconstraint
+            dbCols.update(cols)
+            dbCols.update(sqlconstraint.cols)
+        if len(constraints) < 2:
+            return
+        if any([len(constraint.strip()) == 0 for constraint in constraints]):
+            sharedConstraint = ''
+        else:
+            sharedConstraint = ' or '.join(['(%s)' % constraint for constraint in sorted(constraints)])
+        self._sharedQuery = (sharedConstraint, sorted(dbCols), groupBy)
+        self._sharedConstraints = constraints
 
     def setCurrent(self, constraint):
         """Utility to set the currentBundleDict (i.e. a set of metricBundles with the same SQL constraint).
@@ -258,7 +561,8 @@ class MetricBundleGroup(object):
             if b.constraint == constraint:
                 self.currentBundleDict[k] = b
 
-    def runCurrent(self, constraint, simData=None, clearMemory=False, plotNow=False, plotKwargs=None):
+    def runCurrent(self, constraint, simData=None, clearMemory=False, plotNow=False, plotKwargs=None,
+                   nWorkers=None, chunksize=None):
         """Run all the metricBundles which match this constraint in the metricBundleGroup.
 
         Calculates the metric values, then runs reduce functions and summary statistics for
@@ -278,6 +582,17 @@ class MetricBundleGroup(object):
            is to plot after metric values are calculated for all constraints).
         plotKwargs : Optional[kwargs]
            Plotting kwargs to pass to plotCurrent.
+        nWorkers : Optional[int]
+           Number of worker processes to use to calculate the metric values at the slicepoints.
+           This is not used for compatible metricBundles whose values are calculated for all slicepoints
+           at once with runBulk (see useBulk), nor when the data are streamed (see chunksize).
+           Default None (calculate serially, in this process).
+        chunksize : Optional[int]
+           If set, and all of the current metricBundles can be calculated incrementally (their metrics
+           implement accumulate, their slicers can slice streamed data and their stackers are rowLocal),
+           the data are queried from the dbObj in chunks of this many visits (ordered by MJD),
+           so that memory use is bounded. Stackers are run on each chunk separately.
+           Default None (query all of the data at once).
         """
         # Build list of all the columns needed from the database.
         self.dbCols = []
@@ -285,6 +600,14 @@ class MetricBundleGroup(object):
             self.dbCols.extend(b.dbCols)
         self.dbCols = list(set(self.dbCols))
 
+        # Stream the data from the database in chunks, if all of the current metricBundles allow it.
+        streaming = False
+        if simData is None and chunksize is not None:
+            streaming = self._canStream()
+            if not streaming:
+                warnings.warn('Not all of the metricBundles with constraint %s can use streamed data;'
+                              ' querying all of the data at once.' % constraint)
+
         # Can pass simData directly (if had other method for getting data)
         if simData is not None:
             self.simData = simData
@@ -293,7 +616,11 @@ class MetricBundleGroup(object):
             self.simData = None
             # Query for the data.
             try:
-                self.getData(constraint)
+                if streaming:
+                    # Calculate the metric values as each chunk of data arrives.
+                    self._runStreaming(constraint, chunksize)
+                else:
+                    self.getData(constraint)
             except UserWarning:
                 warnings.warn('No data matching constraint %s' % constraint)
                 metricsSkipped = []
@@ -310,18 +637,32 @@ class MetricBundleGroup(object):
                 warnings.warn(' This means skipping metrics %s' % metricsSkipped)
                 return
 
-        # Find compatible subsets of the MetricBundle dictionary,
-        # which can be run/metrics calculated/ together.
-        self._findCompatibleLists()
+        if not streaming:
+            # Find compatible subsets of the MetricBundle dictionary,
+            # which can be run/metrics calculated/ together.
+            self._findCompatibleLists()
+
+            # Plan the stackers for all compatible lists, and add all of their columns to simData at once.
+            stackerLists = []
+            for compatibleList in self.compatibleLists:
+                stackerLists.append([s for key in compatibleList
+                                     for s in self.currentBundleDict[key].stackerList])
+            self.stackerPlan = StackerPlan(stackerLists, nThreads=nWorkers, lazy=self.lazyStackers)
+            self.simData = self.stackerPlan.addColumns(self.simData)
+
+            try:
+                for compatibleList in self.compatibleLists:
+                    if self.verbose:
+                        print('Running: ', compatibleList)
+                    self._runCompatible(compatibleList, nWorkers=nWorkers)
+                    if self.verbose:
+                        print('Completed metric generation.')
+                    for key in compatibleList:
+                        self.hasRun[key] = True
+            finally:
+                # The plan (and its columns) only belong to this constraint's simData.
+                self.stackerPlan = None
 
-        for compatibleList in self.compatibleLists:
-            if self.verbose:
-                print('Running: ', compatibleList)
-            self._runCompatible(compatibleList)
-            if self.verbose:
-                print('Completed metric generation.')
-            for key in compatibleList:
-                self.hasRun[key] = True
         # Run the reduce methods.
         if self.verbose:
             print('Running reduce methods.')
@@ -356,15 +697,25 @@ class MetricBundleGroup(object):
            The constraint for the currently active set of MetricBundles.
         """
         if self.verbose:
-            if constraint == '':
+            if constraint in self._sharedConstraints:
+                print("Selecting data with constraint %s from shared query, for columns %s" %
+                      (constraint, self.dbCols))
+            elif constraint == '':
                 print("Querying database %s with no constraint for columns %s." %
                       (self.dbTable, self.dbCols))
             else:
                 print("Querying database %s with constraint %s for columns %s" %
                       (self.dbTable, constraint, self.dbCols))
         # Note that we do NOT run the stackers at this point (this must be done in each 'compatible' group).
-        self.simData = utils.getSimData(self.dbObj, constraint, self.dbCols,
-                                        groupBy='default', tableName=self.dbTable)
+        self.simData = None
+        if constraint in self._sharedConstraints:
+            self.simData = self._selectSharedData(constraint)
+            if self.simData is None and self.verbose:
+                print("Constraint %s can't be selected from the shared query; querying database %s" %
+                      (constraint, self.dbTable))
+        if self.simData is None:
+            self.simData = utils.getSimData(self.dbObj, constraint, self.dbCols,
+                                            groupBy='default', tableName=self.dbTable)
 
         if self.verbose:
             print("Found %i visits" % (self.simData.size))
@@ -376,8 +727,168 @@ class MetricBundleGroup(object):
         else:
             self.fieldData = None
 
+    def _selectSharedData(self, constraint):
+        """Select the data for constraint from the shared query (running the shared query if needed).
+
+        The rows matching constraint are selected first, and then (for the default table)
+        one row is kept for each MJD, as in a separate query for constraint.
+
+        Parameters
+        ----------
+        constraint : str
+            The constraint, which must be one of the constraints planned by _planQueries.
+
+        Returns
+        -------
+        numpy.ndarray or None
+            The data matching constraint, with the columns in self.dbCols.
+            None if constraint uses a column whose value is not the same for all of the rows of a visit
+            (in which case constraint should be queried by itself).
+        """
+        sharedConstraint, sharedCols, groupBy = self._sharedQuery
+        if self._sharedData is None:
+            if self.verbose:
+                print("Querying database %s with shared constraint %s for columns %s" %
+                      (self.dbTable, sharedConstraint, sharedCols))
+            try:
+                self._sharedData = utils.getSimData(self.dbObj, sharedConstraint, sharedCols,
+                                                    groupBy=None, tableName=self.dbTable)
+            except UserWarning:
+                # No data for any of the shared constraints.
+                self._sharedData = np.zeros(0, dtype=[(col, float) for col in sharedCols])
+        sqlconstraint = self._sharedConstraints[constraint]
+        if groupBy is not None:
+            for col in sqlconstraint.cols:
+                if not self._isPerVisit(col, groupBy):
+                    return None
+        rows = np.where(sqlconstraint(self._sharedData))[0]
+        if groupBy is not None:
+            # Like the GROUP BY of a separate query, keep one row for each MJD (in MJD order).
+            uniq, first = np.unique(self._sharedData[groupBy][rows], return_index=True)
+            rows = rows[first]
+        simData = np.empty(len(rows), dtype=[(col, self._sharedData.dtype[col]) for col in self.dbCols])
+        for col in self.dbCols:
+            simData[col] = self._sharedData[col][rows]
+        if len(simData) == 0:
+            raise UserWarning('No data found matching sqlconstraint %s' % (constraint))
+        return simData
+
+    def _isPerVisit(self, col, groupBy):
+        """Check if col has the same value in all of the rows of the shared data with the same groupBy value.
+
+        Parameters
+        ----------
+        col : str
+            The column to check.
+        groupBy : str
+            The column identifying a visit (the MJD).
+
+        Returns
+        -------
+        bool
+        """
+        if col not in self._sharedPerVisit:
+            if col == groupBy:
+                self._sharedPerVisit[col] = True
+            else:
+                order = np.argsort(self._sharedData[groupBy], kind='mergesort')
+                mjds = self._sharedData[groupBy][order]
+                values = self._sharedData[col][order]
+                sameVisit = mjds[1:] == mjds[:-1]
+                self._sharedPerVisit[col] = not np.any(values[1:][sameVisit] != values[:-1][sameVisit])
+        return self._sharedPerVisit[col]
 
-    def _runCompatible(self, compatibleList):
+    def _canStream(self):
+        """Check if all of the metricBundles in the currentBundleDict can use data streamed in chunks.
+
+        Returns
+        -------
+        bool
+        """
+        if not hasattr(self.dbObj, 'iterMetricData'):
+            return False
+        for b in self.currentBundleDict.values():
+            if not (b.metric.supportsAccumulate and b.metric.shape == 1):
+                return False
+            if not b.slicer.canStream or b.slicer.needsFields:
+                return False
+            for stacker in b.stackerList:
+                if not stacker.rowLocal:
+                    # Running this stacker on each chunk would not match running it on all of the data.
+                    warnings.warn('Stacker %s does not calculate each row independently, so cannot be run'
+                                  ' on streamed data.' % (stacker.__class__.__name__))
+                    return False
+        return True
+
+    def _runStreaming(self, constraint, chunksize):
+        """Calculate the metric values for the currentBundleDict, querying the data in chunks.
+
+        Each chunk of data is sliced and passed to the metric accumulate methods, then discarded.
+
+        Parameters
+        ----------
+        constraint : str
+            The constraint for the currently active set of MetricBundles.
+        chunksize : int
+            The number of visits to query at a time.
+        """
+        if self.verbose:
+            print("Querying database %s with constraint %s for columns %s, in chunks of %d visits" %
+                  (self.dbTable, constraint, self.dbCols, chunksize))
+        self._findCompatibleLists()
+        stackerLists = []
+        for compatibleList in self.compatibleLists:
+            stackerLists.append([s for key in compatibleList
+                                 for s in self.currentBundleDict[key].stackerList])
+        slicers = [None for compatibleList in self.compatibleLists]
+        # The running state of each metric calculation, at each slicepoint.
+        states = {}
+        nvisits = 0
+        for chunk in self.dbObj.iterMetricData(self.dbCols, constraint, tableName=self.dbTable,
+                                               chunksize=chunksize):
+            nvisits += len(chunk)
+            stackerPlan = StackerPlan(stackerLists, lazy=self.lazyStackers)
+            chunk = stackerPlan.addColumns(chunk)
+            for n, compatibleList in enumerate(self.compatibleLists):
+                bDict = {key: self.currentBundleDict.get(key) for key in compatibleList}
+                chunk = stackerPlan.run(chunk, stackerLists[n])
+                if slicers[n] is None:
+                    # Set up the slicer (whose slicepoints don't depend on the data) with the first chunk.
+                    uniqMaps = []
+                    for b in bDict.values():
+                        for m in b.mapsList:
+                            if m not in uniqMaps:
+                                uniqMaps.append(m)
+                    slicers[n] = list(bDict.values())[0].slicer
+                    slicers[n].setupSlicer(chunk, maps=uniqMaps)
+                    for key, b in bDict.items():
+                        b.slicer = slicers[n]
+                        states[key] = [None for i in range(slicers[n].nslice)]
+                for islice, idxs in slicers[n].sliceChunk(chunk):
+                    dataSlice = chunk[idxs]
+                    for key, b in bDict.items():
+                        states[key][islice] = b.metric.accumulate(states[key][islice], dataSlice)
+        if nvisits == 0:
+            raise UserWarning('No data found matching sqlconstraint %s' % (constraint))
+        if self.verbose:
+            print("Found %i visits" % (nvisits))
+        for compatibleList in self.compatibleLists:
+            for key in compatibleList:
+                b = self.currentBundleDict[key]
+                b._setupMetricValues()
+                for islice, state in enumerate(states[key]):
+                    if state is None:
+                        # No data at this slicepoint.
+                        b.metricValues.mask[islice] = True
+                    else:
+                        b.metricValues.data[islice] = b.metric.finalize(state)
+                b.metricValues.mask = np.where(b.metricValues.data == b.metric.badval,
+                                               True, b.metricValues.mask)
+                if self.saveEarly:
+                    b.write(outDir=self.outDir, resultsDb=self.resultsDb)
+                self.hasRun[key] = True
+
+    def _runCompatible(self, compatibleList, nWorkers=None):
         """Runs a set of 'compatible' metricbundles in the MetricBundleGroup dictionary,
         identified by 'compatibleList' keys.
 
@@ -387,6 +898,15 @@ class MetricBundleGroup(object):
         slicer, the same maps applied to the slicer, and stackers which do not clobber each other's data.
 
         This is where the work of calculating the metric values is done.
+
+        Parameters
+        ----------
+        compatibleList : list of str
+            The keys of the compatible metricBundles to run.
+        nWorkers : Optional[int]
+            If greater than 1, the slicepoints are split into chunks which are calculated
+            in this many worker processes. This is ignored if all of the metrics use runBulk.
+            Default None (calculate serially).
         """
 
         if len(self.simData) == 0:
@@ -410,20 +930,13 @@ class MetricBundleGroup(object):
             if m not in uniqMaps:
                 uniqMaps.append(m)
 
-        # Run stackers.
-        # Run dither stackers first. (this is a bit of a hack -- we should probably figure out
-        # proper hierarchy and DAG so that stackers run in the order they need to. This will catch 90%).
-        ditherStackers = []
-        for s in uniqStackers:
-            if isinstance(s, BaseDitherStacker):
-                ditherStackers.append(s)
-        for stacker in ditherStackers:
-            self.simData = stacker.run(self.simData, override=True)
-            uniqStackers.remove(stacker)
-
-        for stacker in uniqStackers:
-            # Note that stackers will clobber previously existing rows with the same name.
-            self.simData = stacker.run(self.simData, override=True)
+        # Run stackers (filling in their columns in simData, unless calculated already for this constraint).
+        stackerPlan = self.stackerPlan
+        if stackerPlan is None:
+            # Not called from runCurrent: plan (and add the columns for) just these stackers.
+            stackerPlan = StackerPlan([uniqStackers], lazy=self.lazyStackers)
+            self.simData = stackerPlan.addColumns(self.simData)
+        self.simData = stackerPlan.run(self.simData, uniqStackers)
 
         # Pull out one of the slicers to use as our 'slicer'.
         # This will be forced back into all of the metricBundles at the end (so that they track
@@ -442,48 +955,18 @@ class MetricBundleGroup(object):
         for b in bDict.values():
             b._setupMetricValues()
 
-        # Set up an ordered dictionary to be the cache if needed:
-        # (Currently using OrderedDict, it might be faster to use 2 regular Dicts instead)
-        if slicer.cacheSize > 0:
-            cacheDict = OrderedDict()
-            cache = True
-        else:
-            cache = False
         # Run through all slicepoints and calculate metrics.
-        for i, slice_i in enumerate(slicer):
-            slicedata = self.simData[slice_i['idxs']]
-            if len(slicedata) == 0:
-                # No data at this slicepoint. Mask data values.
-                for b in bDict.values():
-                    b.metricValues.mask[i] = True
-            else:
-                # There is data! Should we use our data cache?
-                if cache:
-                    # Make the data idxs hashable.
-                    cacheKey = frozenset(slice_i['idxs'])
-                    # If key exists, set flag to use it, otherwise add it
-                    if cacheKey in cacheDict:
-                        useCache = True
-                        cacheVal = cacheDict[cacheKey]
-                        # Move this value to the end of the OrderedDict
-                        del cacheDict[cacheKey]
-                        cacheDict[cacheKey] = cacheVal
-                    else:
-                        cacheDict[cacheKey] = i
-                        useCache = False
-                    for b in bDict.values():
-                        if useCache:
-                            b.metricValues.data[i] = b.metricValues.data[cacheDict[cacheKey]]
-                        else:
-                            b.metricValues.data[i] = b.metric.run(slicedata, slicePoint=slice_i['slicePoint'])
-                    # If we are above the cache size, drop the oldest element from the cache dict.
-                    if len(cacheDict) > slicer.cacheSize:
-                        del cacheDict[list(cacheDict.keys())[0]]
-
-                # Not using memoize, just calculate things normally
-                else:
-                    for b in bDict.values():
-                        b.metricValues.data[i] = b.metric.run(slicedata, slicePoint=slice_i['slicePoint'])
+        metricList = [b.metric for b in bDict.values()]
+        metricValues = [b.metricValues for b in bDict.values()]
+        if self.useBulk and all([metric.supportsBulk and metric.shape == 1 for metric in metricList]):
+            # Every metric can calculate its values for all slicepoints at once.
+            self._runSlicesBulk(slicer, metricList, metricValues)
+        elif nWorkers is not None and nWorkers > 1 and slicer.nslice > 1:
+            self._runSlicesParallel(slicer, metricList, metricValues, nWorkers)
+        else:
+            cacheStats = _calcSliceValues(self.simData, slicer, metricList, metricValues, 0, slicer.nslice,
+                                          cacheBytes=self.cacheBytes)
+            self._reportCacheStats(slicer, cacheStats)
         # Mask data where metrics could not be computed (according to metric bad value).
         for b in bDict.values():
             if b.metricValues.dtype.name == 'object':
@@ -500,6 +983,81 @@ class MetricBundleGroup(object):
             for b in bDict.values():
                 b.write(outDir=self.outDir, resultsDb=self.resultsDb)
 
+    def _reportCacheStats(self, slicer, cacheStats):
+        """Print the number of slice cache hits and misses, if the slicer used the cache.
+        """
+        if self.verbose and slicer.cacheSize > 0:
+            hits, misses = cacheStats
+            print('Slice cache: %d hits, %d misses' % (hits, misses))
+
+    def _runSlicesBulk(self, slicer, metricList, metricValues):
+        """Calculate metric values for all slicepoints using each metric's runBulk method.
+
+        Parameters
+        ----------
+        slicer : lsst.sims.maf.slicers.BaseSlicer
+            The slicer, after setupSlicer has been run.
+        metricList : list of lsst.sims.maf.metrics.BaseMetric
+            The metrics to calculate (all must support runBulk).
+        metricValues : list of numpy.ma.MaskedArray
+            The masked arrays (one per metric) to fill with the metric values.
+        """
+        sliceIndexCSR = _buildSliceIndexCSR(slicer)
+        # No data at these slicepoints: mask the data values.
+        empty = np.diff(sliceIndexCSR[0]) == 0
+        for metric, mv in zip(metricList, metricValues):
+            mv.data[:] = metric.runBulk(self.simData, sliceIndexCSR)
+            mv.mask[:] = empty
+
+    def _runSlicesParallel(self, slicer, metricList, metricValues, nWorkers):
+        """Calculate metric values for all slicepoints using a pool of worker processes.
+
+        The slicepoints are split into contiguous chunks. The workers are forked after simData
+        and the slicer are placed into _sharedState, so these are shared with the workers rather than
+        pickled for each chunk. The values calculated for each chunk are merged back into
+        metricValues in slicepoint order, so the results are identical to the serial calculation.
+
+        Parameters
+        ----------
+        slicer : lsst.sims.maf.slicers.BaseSlicer
+            The slicer, after setupSlicer has been run.
+        metricList : list of lsst.sims.maf.metrics.BaseMetric
+            The metrics to calculate at each slicepoint.
+        metricValues : list of numpy.ma.MaskedArray
+            The masked arrays (one per metric) to fill with the metric values.
+        nWorkers : int
+            The number of worker processes.
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            warnings.warn('Cannot fork worker processes on this platform; calculating metric values serially.')
+            cacheStats = _calcSliceValues(self.simData, slicer, metricList, metricValues, 0, slicer.nslice,
+                                          cacheBytes=self.cacheBytes)
+            self._reportCacheStats(slicer, cacheStats)
+            return
+        # Use several chunks per worker, to balance the load when some regions have more visits.
+        chunkSize = int(np.ceil(slicer.nslice / float(nWorkers * 4)))
+        chunks = [(start, min(start + chunkSize, slicer.nslice))
+                  for start in range(0, slicer.nslice, chunkSize)]
+        _sharedState.update({'simData': self.simData, 'slicer': slicer, 'metricList': metricList,
+                             'metricValues': metricValues, 'cacheBytes': self.cacheBytes})
+        hits = 0
+        misses = 0
+        try:
+            pool = multiprocessing.get_context('fork').Pool(processes=nWorkers)
+            try:
+                for (start, stop), (results, cacheStats) in zip(chunks, pool.imap(_calcSliceChunk, chunks)):
+                    for mv, (data, mask) in zip(metricValues, results):
+                        mv.data[start:stop] = data
+                        mv.mask[start:stop] = mask
+                    hits += cacheStats[0]
+                    misses += cacheStats[1]
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _sharedState.clear()
+        self._reportCacheStats(slicer, (hits, misses))
+
     def reduceAll(self, updateSummaries=True):
         """Run the reduce methods for all metrics in bundleDict.
 
@@ -557,7 +1115,8 @@ class MetricBundleGroup(object):
         """
         for constraint in self.constraints:
             self.setCurrent(constraint)
-            self.summaryCurrent()
+            with self._resultsDbBatch():
+                self.summaryCurrent()
 
     def summaryCurrent(self):
         """Run summary statistics on all the metricBundles in the currently active set of MetricBundles.
@@ -595,8 +1154,9 @@ class MetricBundleGroup(object):
                 print('Plotting figures with "%s" constraint now.' % (constraint))
 
             self.setCurrent(constraint)
-            self.plotCurrent(savefig=savefig, outfileSuffix=outfileSuffix, figformat=figformat, dpi=dpi,
-                             thumbnail=thumbnail, closefigs=closefigs)
+            with self._resultsDbBatch():
+                self.plotCurrent(savefig=savefig, outfileSuffix=outfileSuffix, figformat=figformat, dpi=dpi,
+                                 thumbnail=thumbnail, closefigs=closefigs)
 
     def plotCurrent(self, savefig=True, outfileSuffix=None, figformat='pdf', dpi=600, thumbnail=True,
                     closefigs=True):
@@ -642,7 +1202,8 @@ class MetricBundleGroup(object):
         """
         for constraint in self.constraints:
             self.setCurrent(constraint)
-            self.writeCurrent()
+            with self._resultsDbBatch():
+                self.writeCurrent()
 
     def writeCurrent(self):
         """Save all the MetricBundles in the currently active set to disk.
@@ -1,6 +1,7 @@
 from __future__ import print_function
 from builtins import object
 import os
+import multiprocessing
 import warnings
 import numpy as np
 import numpy.ma as ma
@@ -17,6 +18,38 @@ from .metricBundle import MetricBundle
 
 __all__ = ['MoMetricBundle', 'MoMetricBundleGroup', 'createEmptyMoMetricBundle', 'makeCompletenessBundle']
 
+# State shared with the worker processes used to calculate moving object metric values in parallel.
+# This is set immediately before the worker pool is forked, so that the workers inherit the bundles and
+# the (indexed) slicer observations through shared memory instead of receiving pickled copies.
+_sharedState = {}
+
+
+def _calcObjectChunk(chunk):
+    """Calculate the metric values for a chunk of objects, in a worker process.
+
+    The MoMetricBundleGroup, the keys of the bundles to calculate and their stackers are read
+    from _sharedState. The random number generators of the stackers are reseeded for the chunk
+    (see MoMetricBundleGroup._calcObjects), so the values do not depend on which worker calculates it.
+
+    Parameters
+    ----------
+    chunk : tuple of int
+        The (start, stop) range of the objects (rows of the slicer orbits) to calculate.
+
+    Returns
+    -------
+    list of tuple
+        The (data, mask) arrays of the metric values for this chunk, one tuple per bundle
+        (in the order of MoMetricBundleGroup._compatibleValues).
+    """
+    start, stop = chunk
+    group = _sharedState['group']
+    compatibleList = _sharedState['compatibleList']
+    uniqStackers = _sharedState['uniqStackers']
+    # The metric values are written into this process's (copy-on-write) copy of the bundles.
+    group._calcObjects(compatibleList, uniqStackers, start, stop)
+    return [(mv.data[start:stop], mv.mask[start:stop]) for mv in group._compatibleValues(compatibleList)]
+
 
 def createEmptyMoMetricBundle():
     """Create an empty metric bundle.
@@ -230,8 +263,33 @@ class MoMetricBundle(MetricBundle):
 
 
 class MoMetricBundleGroup(object):
-    def __init__(self, bundleDict, outDir='.', resultsDb=None, verbose=True):
+    """Run groups of MoMetricBundles, which share the same slicer.
+
+    Parameters
+    ----------
+    bundleDict : dict of MoMetricBundle
+        The bundles to run.
+    outDir : str, opt
+        The output directory. Default '.'.
+    resultsDb : ~lsst.sims.maf.db.ResultsDb, opt
+        The results database to track the metrics and summary statistics. Default None.
+    verbose : bool, opt
+        Default True.
+    vectorH : bool, opt
+        If True (default), the stackers and metrics calculate their values for all of the H values
+        of each object at once (with their runH methods), where they support this; otherwise they
+        are run separately for each H value.
+    objectChunkSize : int, opt
+        The objects are calculated in chunks of this many objects (each chunk by one worker process,
+        if nWorkers is used). The random number generators of the stackers (e.g. for the visibility
+        'vis' of MoMagStacker) are reseeded at the start of each chunk, so the metric values do not
+        depend on the number of worker processes. Default 100.
+    """
+    def __init__(self, bundleDict, outDir='.', resultsDb=None, verbose=True, vectorH=True,
+                 objectChunkSize=100):
         self.verbose = verbose
+        self.vectorH = vectorH
+        self.objectChunkSize = objectChunkSize
         self.bundleDict = bundleDict
         self.outDir = outDir
         if not os.path.isdir(self.outDir):
@@ -316,7 +374,7 @@ class MoMetricBundleGroup(object):
                 compatibleLists.append([k,])
         return compatibleLists
 
-    def runConstraint(self, constraint):
+    def runConstraint(self, constraint, nWorkers=None):
         """Calculate the metric values for all the metricBundles which match this constraint in the
         metricBundleGroup. Also calculates child metrics and summary statistics, and writes all to disk.
         (work is actually done in _runCompatible, so that only completely compatible sets of metricBundles
@@ -326,6 +384,9 @@ class MoMetricBundleGroup(object):
         ----------
         constraint : str
             SQL-where or pandas constraint for the metricBundles.
+        nWorkers : int, opt
+            Number of worker processes to use to calculate the metric values of the objects.
+            Default None (calculate serially, in this process).
         """
         # Find the dict keys of the bundles which match this constraint.
         keysMatchingConstraint = []
@@ -336,15 +397,17 @@ class MoMetricBundleGroup(object):
             return
         # Identify the observations which are relevant for this constraint.
         # This sets slicer.obs (valid for all H values).
-        self.slicer.subsetObs(constraint)
+        # (If the slicer streams the observations, the constraint is applied as they are read instead.)
+        if self.slicer.obsChunksize is None:
+            self.slicer.subsetObs(constraint)
         # Identify the sets of these metricBundles can be run at the same time (also have the same stackers).
         compatibleLists = self._findCompatible(keysMatchingConstraint)
 
         # And now run each of those subsets of compatible metricBundles.
         for compatibleList in compatibleLists:
-            self._runCompatible(compatibleList)
+            self._runCompatible(compatibleList, constraint=constraint, nWorkers=nWorkers)
 
-    def _runCompatible(self, compatibleList):
+    def _runCompatible(self, compatibleList, constraint=None, nWorkers=None):
         """Calculate the metric values for set of (parent and child) bundles, as well as the summary stats,
         and write to disk.
 
@@ -354,6 +417,13 @@ class MoMetricBundleGroup(object):
             List of dictionary keys, of the metricBundles which can be calculated together.
             This means they are 'compatible' and have the same slicer, constraint, and non-conflicting
             mappers and stackers.
+        constraint : str, opt
+            The constraint for these metricBundles. This is only used if the slicer streams the
+            observations from disk (see MoObjSlicer.iterObs); otherwise the observations have already
+            been selected with slicer.subsetObs. Default None.
+        nWorkers : int, opt
+            Number of worker processes to use to calculate the metric values of the objects
+            (see _runObjectsParallel). Default None (calculate serially, in this process).
         """
         if self.verbose:
             print('Running metrics %s' % compatibleList)
@@ -385,40 +455,34 @@ class MoMetricBundleGroup(object):
             for cb in b.childBundles.values():
                 cb._setupMetricValues()
         # Calculate the metric values.
-        for i, slicePoint in enumerate(self.slicer):
-            ssoObs = slicePoint['obs']
-            for j, Hval in enumerate(slicePoint['Hvals']):
-                # Run stackers to add extra columns (that depend on Hval)
-                with warnings.catch_warnings():
-                    warnings.simplefilter('ignore')
+        if self.slicer.obsChunksize is None:
+            if nWorkers is not None and nWorkers > 1 and self.slicer.nSso > 1:
+                self._runObjectsParallel(compatibleList, uniqStackers, nWorkers)
+            else:
+                for start, stop in self._objectChunks():
+                    self._calcObjects(compatibleList, uniqStackers, start, stop)
+        else:
+            if nWorkers is not None and nWorkers > 1:
+                warnings.warn('Cannot use worker processes when streaming the observations; '
+                              'calculating metric values serially.')
+            # Stream the observations, object by object.
+            # Reseed the stackers at each chunk of objects, as _calcObjects does (this gives the same values
+            # as the other paths if the observations are in the same order as the orbits).
+            found = np.zeros(self.slicer.nSso, bool)
+            chunkStart = None
+            for i, slicePoint in self.slicer.iterObs(constraint):
+                if i - i % self.objectChunkSize != chunkStart:
+                    chunkStart = i - i % self.objectChunkSize
                     for s in uniqStackers:
-                        ssoObs = s.run(ssoObs, slicePoint['orbit']['H'], Hval)
-                # Run all the parent metrics.
-                for k in compatibleList:
-                    b = self.bundleDict[k]
-                    # Mask the parent metric (and then child metrics) if there was no data.
-                    if len(ssoObs) == 0:
-                        b.metricValues.mask[i][j] = True
-                        for cb in list(b.childBundles.values()):
-                            cb.metricValues.mask[i][j] = True
-                    # Otherwise, calculate the metric value for the parent, and then child.
-                    else:
-                        # Calculate for the parent.
-                        mVal = b.metric.run(ssoObs, slicePoint['orbit'], Hval)
-                        # Mask if the parent metric returned a bad value.
-                        if mVal == b.metric.badval:
-                            b.metricValues.mask[i][j] = True
-                            for cb in b.childBundles.values():
-                                cb.metricValues.mask[i][j] = True
-                        # Otherwise, set the parent value and calculate the child metric values as well.
-                        else:
-                            b.metricValues.data[i][j] = mVal
-                            for cb in b.childBundles.values():
-                                childVal = cb.metric.run(ssoObs, slicePoint['orbit'], Hval, mVal)
-                                if childVal == cb.metric.badval:
-                                    cb.metricValues.mask[i][j] = True
-                                else:
-                                    cb.metricValues.data[i][j] = childVal
+                        s.reseed(chunkStart)
+                self._calcSlicePoint(compatibleList, uniqStackers, i, slicePoint)
+                found[i] = True
+            # Mask the objects which had no observations.
+            for k in compatibleList:
+                b = self.bundleDict[k]
+                b.metricValues.mask[~found] = True
+                for cb in b.childBundles.values():
+                    cb.metricValues.mask[~found] = True
         for k in compatibleList:
             b = self.bundleDict[k]
             b.computeSummaryStats(self.resultsDb)
@@ -429,12 +493,197 @@ class MoMetricBundleGroup(object):
             # Write to disk.
             b.write(outDir=self.outDir, resultsDb=self.resultsDb)
 
-    def runAll(self):
+    def _compatibleValues(self, compatibleList):
+        """Return the metricValues of the bundles in compatibleList, each followed by those of its children.
+        """
+        metricValues = []
+        for k in compatibleList:
+            b = self.bundleDict[k]
+            metricValues.append(b.metricValues)
+            for cb in b.childBundles.values():
+                metricValues.append(cb.metricValues)
+        return metricValues
+
+    def _runObjectsParallel(self, compatibleList, uniqStackers, nWorkers):
+        """Calculate the metric values of all of the objects using a pool of worker processes.
+
+        The orbits are split into contiguous chunks of objects. The slicer observations are indexed
+        by objId (see MoObjSlicer) and the bundles are placed into _sharedState before the workers
+        are forked, so each worker slices the observations of its own chunk of objects from the shared
+        index, rather than receiving pickled copies. The (nSso x nH) values calculated for each chunk
+        are merged back into the metricValues of the parent and child bundles in orbit order.
+        The chunks (see _objectChunks) do not depend on nWorkers, and the stackers are reseeded for each
+        chunk, so the results are identical to the serial calculation, including values which depend on
+        random draws (such as the probabilistic visibility 'vis' of MoMagStacker).
+
+        Parameters
+        ----------
+        compatibleList : list
+            List of dictionary keys, of the metricBundles to calculate.
+        uniqStackers : list
+            The stackers to run on the observations of each object.
+        nWorkers : int
+            The number of worker processes.
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            warnings.warn('Cannot fork worker processes on this platform; calculating metric values serially.')
+            for start, stop in self._objectChunks():
+                self._calcObjects(compatibleList, uniqStackers, start, stop)
+            return
+        # Index the observations before forking, so that the workers share the index.
+        if self.slicer._obsRecords is None:
+            self.slicer._indexObs()
+        chunks = self._objectChunks()
+        metricValues = self._compatibleValues(compatibleList)
+        _sharedState.update({'group': self, 'compatibleList': compatibleList, 'uniqStackers': uniqStackers})
+        try:
+            pool = multiprocessing.get_context('fork').Pool(processes=nWorkers)
+            try:
+                for (start, stop), results in zip(chunks, pool.imap(_calcObjectChunk, chunks)):
+                    for mv, (data, mask) in zip(metricValues, results):
+                        mv.data[start:stop] = data
+                        mv.mask[start:stop] = mask
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _sharedState.clear()
+
+    def _objectChunks(self):
+        """Return the (start, stop) ranges of the chunks of objectChunkSize objects.
+        """
+        nSso = self.slicer.nSso
+        return [(start, min(start + self.objectChunkSize, nSso))
+                for start in range(0, nSso, self.objectChunkSize)]
+
+    def _calcObjects(self, compatibleList, uniqStackers, start, stop):
+        """Calculate the metric values of the bundles in compatibleList for the objects start:stop.
+
+        The random number generators of the stackers are first reseeded with (their seed plus) start,
+        so the values for a chunk are the same whichever process calculates it, and in whatever order.
+
+        Parameters
+        ----------
+        compatibleList : list
+            List of dictionary keys, of the metricBundles to calculate.
+        uniqStackers : list
+            The stackers to run on the observations of each object.
+        start, stop : int
+            The range of the objects (rows of the slicer orbits) to calculate.
+        """
+        for s in uniqStackers:
+            s.reseed(start)
+        for i in range(start, stop):
+            self._calcSlicePoint(compatibleList, uniqStackers, i, self.slicer[i])
+
+    def _calcSlicePoint(self, compatibleList, uniqStackers, i, slicePoint):
+        """Calculate the metric values of the (parent and child) bundles in compatibleList for one object.
+
+        Parameters
+        ----------
+        compatibleList : list
+            List of dictionary keys, of the metricBundles to calculate.
+        uniqStackers : list
+            The stackers to run on the observations of the object.
+        i : int
+            The index of the object in the slicer orbits.
+        slicePoint : dict
+            The slicePoint for the object (its 'obs', 'orbit' and 'Hvals').
+        """
+        ssoObs = slicePoint['obs']
+        if self.vectorH and len(ssoObs) > 0 and all([s.supportsH for s in uniqStackers]):
+            self._calcSlicePointH(compatibleList, uniqStackers, i, slicePoint)
+            return
+        for j, Hval in enumerate(slicePoint['Hvals']):
+            # Run stackers to add extra columns (that depend on Hval)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                for s in uniqStackers:
+                    ssoObs = s.run(ssoObs, slicePoint['orbit']['H'], Hval)
+            # Run all the parent metrics.
+            for k in compatibleList:
+                b = self.bundleDict[k]
+                # Mask the parent metric (and then child metrics) if there was no data.
+                if len(ssoObs) == 0:
+                    b.metricValues.mask[i][j] = True
+                    for cb in list(b.childBundles.values()):
+                        cb.metricValues.mask[i][j] = True
+                # Otherwise, calculate the metric value for the parent, and then child.
+                else:
+                    # Calculate for the parent.
+                    mVal = b.metric.run(ssoObs, slicePoint['orbit'], Hval)
+                    self._setValues(b, i, j, mVal, ssoObs, slicePoint['orbit'], Hval)
+
+    def _calcSlicePointH(self, compatibleList, uniqStackers, i, slicePoint):
+        """Calculate the metric values of the bundles in compatibleList for one object, for all H at once.
+
+        The stackers calculate the columns which depend on H (such as SNR and vis) for all H values
+        in one go, as (nObs x nH) arrays. Parent metrics which support runH use these directly; the other
+        parent metrics, and the child metrics, are run for each H value in turn on the observations,
+        after the columns for that H value are filled in.
+        The object must have observations, and all of uniqStackers must support runH.
+
+        Parameters are as for _calcSlicePoint.
+        """
+        ssoObs = slicePoint['obs']
+        orbit = slicePoint['orbit']
+        Hvals = slicePoint['Hvals']
+        Hcols = {}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for s in uniqStackers:
+                ssoObs, cols = s.runH(ssoObs, orbit['H'], Hvals)
+                Hcols.update(cols)
+        parentValues = {}
+        for k in compatibleList:
+            b = self.bundleDict[k]
+            if b.metric.supportsH:
+                parentValues[k] = b.metric.runH(ssoObs, orbit, Hvals, Hcols)
+        fillCols = (len(parentValues) < len(compatibleList) or
+                    any([len(self.bundleDict[k].childBundles) > 0 for k in compatibleList]))
+        for j, Hval in enumerate(Hvals):
+            if fillCols:
+                for col, values in Hcols.items():
+                    ssoObs[col] = values[:, j]
+            for k in compatibleList:
+                b = self.bundleDict[k]
+                if k in parentValues:
+                    mVal = parentValues[k][j]
+                else:
+                    mVal = b.metric.run(ssoObs, orbit, Hval)
+                self._setValues(b, i, j, mVal, ssoObs, orbit, Hval)
+
+    def _setValues(self, b, i, j, mVal, ssoObs, orbit, Hval):
+        """Store the parent metric value mVal of bundle b (for object i, H index j),
+        and calculate and store the values of its child bundles.
+        """
+        # Mask if the parent metric returned a bad value.
+        if mVal == b.metric.badval:
+            b.metricValues.mask[i][j] = True
+            for cb in b.childBundles.values():
+                cb.metricValues.mask[i][j] = True
+        # Otherwise, set the parent value and calculate the child metric values as well.
+        else:
+            b.metricValues.data[i][j] = mVal
+            for cb in b.childBundles.values():
+                childVal = cb.metric.run(ssoObs, orbit, Hval, mVal)
+                if childVal == cb.metric.badval:
+                    cb.metricValues.mask[i][j] = True
+                else:
+                    cb.metricValues.data[i][j] = childVal
+
+    def runAll(self, nWorkers=None):
         """
         Run all constraints and metrics for these moMetricBundles.
+
+        Parameters
+        ----------
+        nWorkers : int, opt
+            Number of worker processes to use to calculate the metric values of the objects.
+            Default None (calculate serially, in this process).
         """
         for constraint in self.constraints:
-            self.runConstraint(constraint)
+            self.runConstraint(constraint, nWorkers=nWorkers)
         if self.verbose:
             print('Calculated and saved all metrics.')
 
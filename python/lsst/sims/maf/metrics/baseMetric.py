@@ -191,3 +191,89 @@ class BaseMetric(with_metaclass(MetricRegistry, object)):
             The metric value at each slicePoint.
         """
         raise NotImplementedError('Please implement your metric calculation.')
+
+    def runBulk(self, simData, sliceIndexCSR):
+        """Calculate metric values for all slicePoints at once.
+
+        This is optional: metrics which can calculate their values for all slicePoints
+        with vectorized numpy operations may implement runBulk, which the MetricBundleGroup
+        will use instead of calling run at each slicePoint.
+        Metrics which need the slicePoint metadata should not implement runBulk.
+
+        Parameters
+        ----------
+        simData : numpy.NDarray
+           The simulated data for all slicePoints.
+        sliceIndexCSR : tuple of numpy.ndarray
+           The (indptr, indices) arrays identifying the simData indexes in each slice:
+           the indexes for slicePoint i are indices[indptr[i]:indptr[i+1]].
+
+        Returns
+        -------
+        numpy.ndarray
+            The metric values at each slicePoint. Values at slicePoints without data are ignored.
+        """
+        raise NotImplementedError('This metric does not support bulk calculation.')
+
+    def accumulate(self, state, dataSlice):
+        """Update the running state of the metric calculation with one more chunk of data for a slicePoint.
+
+        This is optional: metrics which can be calculated incrementally, from successive chunks of
+        the data at a slicePoint, may implement accumulate and finalize. The MetricBundleGroup can
+        then stream the data from the database in chunks, instead of holding all of it in memory.
+        Metrics which need the slicePoint metadata should not implement accumulate.
+
+        Parameters
+        ----------
+        state : object or None
+           The state returned by the previous call to accumulate for this slicePoint
+           (None for the first chunk of data).
+        dataSlice : numpy.NDarray
+           The next chunk of data at this slicePoint (never empty).
+
+        Returns
+        -------
+        object
+            The updated state.
+        """
+        raise NotImplementedError('This metric does not support incremental calculation.')
+
+    def finalize(self, state):
+        """Calculate the metric value from the state accumulated over all of the chunks of data.
+
+        Parameters
+        ----------
+        state : object
+           The state returned by the last call to accumulate for this slicePoint.
+
+        Returns
+        -------
+        float
+            The metric value.
+        """
+        raise NotImplementedError('This metric does not support incremental calculation.')
+
+    def _implementsWithRun(self, methodName):
+        """True if methodName is implemented (not inherited from BaseMetric) by the same class which defines run.
+        """
+        definedRun = None
+        definedMethod = None
+        for klass in type(self).__mro__:
+            if definedRun is None and 'run' in klass.__dict__:
+                definedRun = klass
+            if definedMethod is None and methodName in klass.__dict__:
+                definedMethod = klass
+        # A subclass which changes run must also provide a matching method.
+        return definedMethod is not BaseMetric and definedMethod is definedRun
+
+    @property
+    def supportsBulk(self):
+        """True if this metric implements runBulk (for the same class which defines run).
+        """
+        return self._implementsWithRun('runBulk')
+
+    @property
+    def supportsAccumulate(self):
+        """True if this metric implements accumulate and finalize (for the same class which defines run).
+        """
+        return self._implementsWithRun('accumulate') and self._implementsWithRun('finalize')
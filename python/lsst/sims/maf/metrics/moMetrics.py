@@ -88,6 +88,53 @@ class BaseMoMetric(BaseMetric):
         """
         raise NotImplementedError
 
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        """Calculate the metric values for all of the H values at once.
+
+        This is optional: metrics which can calculate their values for all H values with vectorized
+        numpy operations may implement runH, which the MoMetricBundleGroup will use instead of calling
+        run for each H value (when the stackers can also calculate their columns for all H values at once).
+
+        Parameters
+        ----------
+        ssoObs: np.ndarray
+            The input data to the metric, with the columns which do not depend on H.
+        orb: np.ndarray
+            The information about the orbit for which the metric is being calculated.
+        Hvals : np.ndarray
+            The H values for which the metric is being calculated.
+        Hcols : dict of np.ndarray
+            The columns which depend on H (such as SNR and vis), as (nObs x nH) arrays.
+
+        Returns
+        -------
+        np.ndarray or list
+            The metric value for each H value.
+        """
+        raise NotImplementedError('This metric does not support calculation for all H values at once.')
+
+    @property
+    def supportsH(self):
+        """True if this metric implements runH (for the same class which defines run).
+        """
+        return type(self).runH is not BaseMoMetric.runH and self._implementsWithRun('runH')
+
+    def _visH(self, ssoObs, Hvals, Hcols):
+        """Return the (nObs x nH) boolean array of the visible observations at each H value.
+
+        As in run, the observations are visible if their SNR is above snrLimit (if set),
+        or otherwise if they are flagged in the visibility column.
+        """
+        if getattr(self, 'snrLimit', None) is not None:
+            col, limit = self.snrCol, self.snrLimit
+            values = Hcols[col] if col in Hcols else np.asarray(ssoObs[col])[:, np.newaxis]
+            visH = values >= limit
+        else:
+            col = self.visCol
+            values = Hcols[col] if col in Hcols else np.asarray(ssoObs[col])[:, np.newaxis]
+            visH = values > 0
+        return np.broadcast_to(visH, (len(ssoObs), len(Hvals)))
+
 
 class BaseChildMetric(BaseMoMetric):
     """Base class for child metrics.
@@ -149,6 +196,9 @@ class NObsMetric(BaseMoMetric):
             vis = np.where(ssoObs[self.visCol] > 0)[0]
             return vis.size
 
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        return self._visH(ssoObs, Hvals, Hcols).sum(axis=0)
+
 
 class NObsNoSinglesMetric(BaseMoMetric):
     """
@@ -194,6 +244,15 @@ class NNightsMetric(BaseMoMetric):
         nights = len(np.unique(ssoObs[self.nightCol][vis]))
         return nights
 
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        visH = self._visH(ssoObs, Hvals, Hcols)
+        # Count the visible observations on each night, then the nights with any visible observations.
+        order = np.argsort(ssoObs[self.nightCol], kind='mergesort')
+        nights = ssoObs[self.nightCol][order]
+        starts = np.concatenate([[0], np.where(nights[1:] != nights[:-1])[0] + 1])
+        nightCounts = np.add.reduceat(visH[order].astype(int), starts, axis=0)
+        return (nightCounts > 0).sum(axis=0)
+
 class ObsArcMetric(BaseMoMetric):
     """Calculate the difference between the first and last observation of an SSobject.
     """
@@ -211,6 +270,14 @@ class ObsArcMetric(BaseMoMetric):
         arc = ssoObs[self.mjdCol][vis].max() - ssoObs[self.mjdCol][vis].min()
         return arc
 
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        visH = self._visH(ssoObs, Hvals, Hcols)
+        times = np.asarray(ssoObs[self.mjdCol], float)[:, np.newaxis]
+        arc = np.where(visH, times, -np.inf).max(axis=0) - np.where(visH, times, np.inf).min(axis=0)
+        # No visible observations.
+        arc[~visH.any(axis=0)] = 0
+        return arc
+
 class DiscoveryMetric(BaseMoMetric):
     """Identify the discovery opportunities for an SSobject.
 
@@ -266,6 +333,21 @@ class DiscoveryMetric(BaseMoMetric):
             vis = np.where(ssoObs[self.snrCol] >= self.snrLimit)[0]
         else:
             vis = np.where(ssoObs[self.visCol] > 0)[0]
+        return self._discoveries(ssoObs, vis)
+
+    def runH(self, ssoObs, orb, Hvals, Hcols):
+        visH = self._visH(ssoObs, Hvals, Hcols)
+        # The discovery opportunities only depend on which observations are visible, so they are
+        # calculated once for each distinct set of visible observations. As SNR decreases with H,
+        # many H values share the same set (e.g. all or none of the observations, at the bright
+        # and faint end of Hrange).
+        visSets, inverse = np.unique(visH.T, axis=0, return_inverse=True)
+        values = [self._discoveries(ssoObs, np.where(visSet)[0]) for visSet in visSets]
+        return [values[k] for k in inverse.ravel()]
+
+    def _discoveries(self, ssoObs, vis):
+        """Identify the discovery opportunities, given the indexes of the visible observations (vis).
+        """
         if len(vis) == 0:
             return self.badval
         # Identify discovery opportunities.
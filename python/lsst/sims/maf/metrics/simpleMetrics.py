@@ -13,6 +13,41 @@ __all__ = ['PassMetric', 'Coaddm5Metric', 'MaxMetric', 'AbsMaxMetric', 'MeanMetr
 twopi = 2.0*np.pi
 
 
+def _segmentSum(values, indptr):
+    """Sum values within each segment values[indptr[i]:indptr[i+1]] (empty segments sum to 0).
+    """
+    counts = np.diff(indptr)
+    sums = np.zeros(len(counts), dtype=float)
+    nonempty = counts > 0
+    if nonempty.any():
+        # Empty segments have zero length, so the next non-empty start marks the end of each segment.
+        sums[nonempty] = np.add.reduceat(values, indptr[:-1][nonempty])
+    return sums
+
+
+def _segmentMedian(values, indptr):
+    """Find the median of values within each segment values[indptr[i]:indptr[i+1]].
+    """
+    counts = np.diff(indptr)
+    medians = np.zeros(len(counts), dtype=float)
+    nonempty = counts > 0
+    if nonempty.any():
+        # Sort the values within each segment, then pick out the middle value(s).
+        segment = np.repeat(np.arange(len(counts)), counts)
+        sortedValues = values[np.lexsort((values, segment))]
+        lo = indptr[:-1][nonempty] + (counts[nonempty] - 1) // 2
+        hi = indptr[:-1][nonempty] + counts[nonempty] // 2
+        medians[nonempty] = (sortedValues[lo] + sortedValues[hi]) / 2.0
+    return medians
+
+
+def _segmentMean(values, indptr):
+    """Find the mean of values within each segment values[indptr[i]:indptr[i+1]].
+    """
+    counts = np.diff(indptr)
+    return _segmentSum(values, indptr) / np.where(counts > 0, counts, 1)
+
+
 class PassMetric(BaseMetric):
     """
     Just pass the entire array through
@@ -34,12 +69,27 @@ class Coaddm5Metric(BaseMetric):
         super(Coaddm5Metric, self).__init__(col=m5Col, metricName=metricName, **kwargs)
     def run(self, dataSlice, slicePoint=None):
         return 1.25 * np.log10(np.sum(10.**(.8*dataSlice[self.colname])))
+    def runBulk(self, simData, sliceIndexCSR):
+        indptr, indices = sliceIndexCSR
+        flux = _segmentSum(10.**(.8*simData[self.colname][indices]), indptr)
+        with np.errstate(divide='ignore'):
+            return 1.25 * np.log10(flux)
+    def accumulate(self, state, dataSlice):
+        flux = np.sum(10.**(.8*dataSlice[self.colname]))
+        return flux if state is None else state + flux
+    def finalize(self, state):
+        return 1.25 * np.log10(state)
 
 class MaxMetric(BaseMetric):
     """Calculate the maximum of a simData column slice.
     """
     def run(self, dataSlice, slicePoint=None):
         return np.max(dataSlice[self.colname])
+    def accumulate(self, state, dataSlice):
+        value = np.max(dataSlice[self.colname])
+        return value if state is None else max(state, value)
+    def finalize(self, state):
+        return state
 
 class AbsMaxMetric(BaseMetric):
     """Calculate the max of the absolute value of a simData column slice.
@@ -52,6 +102,14 @@ class MeanMetric(BaseMetric):
     """
     def run(self, dataSlice, slicePoint=None):
         return np.mean(dataSlice[self.colname])
+    def runBulk(self, simData, sliceIndexCSR):
+        indptr, indices = sliceIndexCSR
+        return _segmentMean(simData[self.colname][indices], indptr)
+    def accumulate(self, state, dataSlice):
+        total, n = (0., 0) if state is None else state
+        return total + np.sum(dataSlice[self.colname]), n + len(dataSlice)
+    def finalize(self, state):
+        return state[0] / float(state[1])
 
 class AbsMeanMetric(BaseMetric):
     """Calculate the mean of the absolute value of a simData column slice.
@@ -64,6 +122,9 @@ class MedianMetric(BaseMetric):
     """
     def run(self, dataSlice, slicePoint=None):
         return np.median(dataSlice[self.colname])
+    def runBulk(self, simData, sliceIndexCSR):
+        indptr, indices = sliceIndexCSR
+        return _segmentMedian(simData[self.colname][indices], indptr)
 
 class AbsMedianMetric(BaseMetric):
     """Calculate the median of the absolute value of a simData column slice.
@@ -76,6 +137,11 @@ class MinMetric(BaseMetric):
     """
     def run(self, dataSlice, slicePoint=None):
         return np.min(dataSlice[self.colname])
+    def accumulate(self, state, dataSlice):
+        value = np.min(dataSlice[self.colname])
+        return value if state is None else min(state, value)
+    def finalize(self, state):
+        return state
 
 class FullRangeMetric(BaseMetric):
     """Calculate the range of a simData column slice.
@@ -94,6 +160,14 @@ class SumMetric(BaseMetric):
     """
     def run(self, dataSlice, slicePoint=None):
         return np.sum(dataSlice[self.colname])
+    def runBulk(self, simData, sliceIndexCSR):
+        indptr, indices = sliceIndexCSR
+        return _segmentSum(simData[self.colname][indices], indptr)
+    def accumulate(self, state, dataSlice):
+        value = np.sum(dataSlice[self.colname])
+        return value if state is None else state + value
+    def finalize(self, state):
+        return state
 
 class CountUniqueMetric(BaseMetric):
     """Return the number of unique values.
@@ -118,6 +192,16 @@ class CountMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return len(dataSlice[self.colname])
 
+    def runBulk(self, simData, sliceIndexCSR):
+        indptr, indices = sliceIndexCSR
+        return np.diff(indptr)
+
+    def accumulate(self, state, dataSlice):
+        return len(dataSlice[self.colname]) + (0 if state is None else state)
+
+    def finalize(self, state):
+        return state
+
 class CountRatioMetric(BaseMetric):
     """Count the length of a simData column slice, then divide by 'normVal'. 
     """
@@ -194,6 +278,15 @@ class FracAboveMetric(BaseMetric):
         fracAbove = np.size(good)/float(np.size(dataSlice[self.colname]))
         fracAbove = fracAbove * self.scale
         return fracAbove
+    def runBulk(self, simData, sliceIndexCSR):
+        indptr, indices = sliceIndexCSR
+        above = np.where(simData[self.colname][indices] >= self.cutoff, 1.0, 0.0)
+        return _segmentMean(above, indptr) * self.scale
+    def accumulate(self, state, dataSlice):
+        nabove, n = (0, 0) if state is None else state
+        return nabove + np.sum(dataSlice[self.colname] >= self.cutoff), n + np.size(dataSlice[self.colname])
+    def finalize(self, state):
+        return state[0] / float(state[1]) * self.scale
 
 class FracBelowMetric(BaseMetric):
     """Find the fraction of data values below a given value.
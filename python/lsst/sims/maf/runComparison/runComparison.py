@@ -3,9 +3,15 @@ from builtins import range
 from builtins import object
 import os
 import warnings
+from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-from lsst.sims.maf.db import ResultsDb
+from lsst.sims.maf.db import ResultsDb, MetricRow, SummaryStatRow
 from lsst.sims.maf.db import OpsimDatabase
 import lsst.sims.maf.metricBundles as mb
 import lsst.sims.maf.plots as plots
@@ -27,6 +33,56 @@ except ImportError:
 __all__ = ['RunComparison']
 
 
+class _ResultsDbPool(object):
+    """Open ResultsDbs when they are needed, keeping at most maxOpen of them open at once.
+
+    When another ResultsDb is needed, the least recently used one is closed.
+    """
+    def __init__(self, maxOpen=50):
+        self.maxOpen = maxOpen
+        self._open = OrderedDict()
+
+    def get(self, outDir):
+        if outDir in self._open:
+            resultsDb = self._open.pop(outDir)
+        else:
+            while len(self._open) > 0 and len(self._open) >= self.maxOpen:
+                self._open.popitem(last=False)[1].close()
+            # The results are only read, so leave the journal mode of the database alone.
+            resultsDb = ResultsDb(outDir=outDir, walMode=False)
+        self._open[outDir] = resultsDb
+        return resultsDb
+
+    def close(self):
+        for resultsDb in self._open.values():
+            resultsDb.close()
+        self._open.clear()
+
+
+class _RunResults(Mapping):
+    """Dictionary of the resultsDbs (keyed by subdirectory) of a run, which are opened from a
+    _ResultsDbPool when they are used.
+    """
+    def __init__(self, pool):
+        self._pool = pool
+        self._outDirs = OrderedDict()
+
+    def addDir(self, subdir, outDir):
+        self._outDirs[subdir] = outDir
+
+    def getOutDir(self, subdir):
+        return self._outDirs[subdir]
+
+    def __getitem__(self, subdir):
+        return self._pool.get(self._outDirs[subdir])
+
+    def __iter__(self):
+        return iter(self._outDirs)
+
+    def __len__(self):
+        return len(self._outDirs)
+
+
 class RunComparison(object):
     """
     Class to read multiple results databases, find requested summary metric comparisons,
@@ -49,9 +105,13 @@ class RunComparison(object):
         A list of directories (relative to baseDir) where the runs in runlist reside.
         Optional - if not provided, assumes directories are simply the names in runlist.
         Must have same length as runlist (note that runlist can contain duplicate entries).
+    maxOpenDbs : int, opt
+        The maximum number of results databases to keep open at once. The results databases are
+        opened when they are first used, and the least recently used are closed when more are needed.
+        Default 50.
     """
     def __init__(self, baseDir, runlist, rundirs=None,
-                 defaultResultsDb='resultsDb_sqlite.db', verbose=False):
+                 defaultResultsDb='resultsDb_sqlite.db', verbose=False, maxOpenDbs=50):
         self.baseDir = baseDir
         self.runlist = runlist
         self.verbose = verbose
@@ -62,6 +122,7 @@ class RunComparison(object):
             self.rundirs = rundirs
         else:
             self.rundirs = runlist
+        self._resultsDbPool = _ResultsDbPool(maxOpen=maxOpenDbs)
         self._connect_to_results()
         # Class attributes to store the stats data:
         self.parameters = None        # Config parameters varied in each run
@@ -69,13 +130,16 @@ class RunComparison(object):
         self.summaryStats = None      # summary stats
         self.normalizedStats = None   # normalized (to baselineRun) version of the summary stats
         self.baselineRun = None       # name of the baseline run
+        self.allSummaryStats = None   # all of the summary stats in all of the results databases
+        self._statsByMetric = None    # allSummaryStats, split up by metricName
 
     def _connect_to_results(self):
         """
-        Open access to all the results database files.
+        Find all the results database files.
         Sets nested dictionary of results databases:
         .. dictionary[run1][subdirectory1] = resultsDb
         .. dictionary[run1][subdirectoryN] = resultsDb ...
+        (The resultsDbs are only opened when they are used.)
         """
         # Open access to all results database files in any subdirectories under 'runs'.
         self.runresults = {}
@@ -86,16 +150,16 @@ class RunComparison(object):
             else:
                 # Add a dictionary to runresults to store resultsDB connections.
                 if r not in self.runresults:
-                    self.runresults[r] = {}
+                    self.runresults[r] = _RunResults(self._resultsDbPool)
                 # Check for a resultsDB in the current checkdir
                 if os.path.isfile(os.path.join(checkdir, self.defaultResultsDb)):
                     s = os.path.split(rdir)[-1]
-                    self.runresults[r][s] = ResultsDb(outDir=checkdir)
+                    self.runresults[r].addDir(s, checkdir)
                 # And look for resultsDb files in subdirectories.
                 sublist = os.listdir(checkdir)
                 for s in sublist:
                     if os.path.isfile(os.path.join(checkdir, s, 'resultsDb_sqlite.db')):
-                        self.runresults[r][s] = ResultsDb(outDir=os.path.join(checkdir, s))
+                        self.runresults[r].addDir(s, os.path.join(checkdir, s))
         # Remove any runs from runlist which we could not find results databases for.
         for r in self.runlist:
             if len(self.runresults[r]) == 0:
@@ -110,9 +174,92 @@ class RunComparison(object):
         self.__del__()
 
     def __del__(self):
-        for r in self.runresults:
-            for s in self.runresults[r]:
-                self.runresults[r][s].close()
+        self._resultsDbPool.close()
+
+    def harvestSummaryStats(self, nThreads=8):
+        """
+        Load all of the summary statistics from all of the results databases, so that later
+        summary stat lookups (addSummaryStats with bulk=True) are done in memory.
+
+        Each results database is read with a single query; the databases are read in parallel.
+
+        Parameters
+        ----------
+        nThreads : int, opt
+            The number of results databases to read at the same time. Default 8.
+
+        Results
+        -------
+        pandas DataFrame
+            The summary stats, with columns runName, subdir, metricId, metricName, slicerName,
+            metricMetadata, summaryName and summaryValue. This is also saved as self.allSummaryStats.
+        """
+        outDirs = []
+        for r in self.runlist:
+            for subdir in self.runresults[r]:
+                outDirs.append((r, subdir, self.runresults[r].getOutDir(subdir)))
+        with ThreadPoolExecutor(max_workers=nThreads) as executor:
+            frames = list(executor.map(lambda x: self._readSummaryStats(*x), outDirs))
+        columns = ['runName', 'subdir', 'metricId', 'metricName', 'slicerName', 'metricMetadata',
+                   'summaryName', 'summaryValue']
+        if len(frames) == 0:
+            self.allSummaryStats = pd.DataFrame(columns=columns)
+        else:
+            self.allSummaryStats = pd.concat(frames, ignore_index=True)[columns]
+        self._statsByMetric = dict([(metricName, stats) for metricName, stats
+                                    in self.allSummaryStats.groupby('metricName', sort=False)])
+        return self.allSummaryStats
+
+    @staticmethod
+    def _readSummaryStats(runName, subdir, outDir):
+        """Read all of the summary stats from the resultsDb in outDir (with one query).
+        """
+        # Open a separate resultsDb for each thread (the pooled resultsDbs are not thread-safe).
+        resultsDb = ResultsDb(outDir=outDir, walMode=False)
+        try:
+            query = (resultsDb.session.query(MetricRow.metricId, MetricRow.metricName, MetricRow.slicerName,
+                                             MetricRow.metricMetadata, SummaryStatRow.summaryName,
+                                             SummaryStatRow.summaryValue)
+                     .filter(MetricRow.metricId == SummaryStatRow.metricId)
+                     .order_by(MetricRow.metricId, SummaryStatRow.statId))
+            stats = pd.DataFrame.from_records([tuple(m) for m in query],
+                                              columns=['metricId', 'metricName', 'slicerName',
+                                                       'metricMetadata', 'summaryName', 'summaryValue'])
+        finally:
+            resultsDb.close()
+        stats['runName'] = runName
+        stats['subdir'] = subdir
+        return stats
+
+    def _getSummaryStats(self, runName, subdir, metricName, metricMetadata=None, slicerName=None,
+                         summaryName=None, bulk=False):
+        """
+        Return the summary stats matching metricName (and optionally metricMetadata, slicerName and
+        summaryName) in the resultsDb for runName/subdir, or None if the metric is not there.
+        If bulk is True, these are found in the harvested summary stats, instead of querying the resultsDb.
+        """
+        if not bulk:
+            mId = self.runresults[runName][subdir].getMetricId(metricName=metricName,
+                                                               metricMetadata=metricMetadata,
+                                                               slicerName=slicerName)
+            if len(mId) == 0:
+                return None
+            return self.runresults[runName][subdir].getSummaryStats(mId, summaryName=summaryName)
+        if metricName not in self._statsByMetric:
+            return None
+        stats = self._statsByMetric[metricName]
+        match = (stats['runName'] == runName) & (stats['subdir'] == subdir)
+        if metricMetadata is not None:
+            match &= (stats['metricMetadata'] == metricMetadata)
+        if slicerName is not None:
+            match &= (stats['slicerName'] == slicerName)
+        if not match.any():
+            return None
+        # Same order as getMetricId (ordered by slicerName and metricMetadata) + getSummaryStats.
+        stats = stats[match].sort_values(['slicerName', 'metricMetadata'], kind='mergesort')
+        if summaryName is not None:
+            stats = stats[stats['summaryName'] == summaryName]
+        return stats.to_records(index=False)
 
     def variedParameters(self, paramNameLike=None, dbDir=None):
         """
@@ -250,7 +397,7 @@ class RunComparison(object):
         return name
 
     def _findSummaryStats(self, metricName, metricMetadata=None, slicerName=None, summaryName=None,
-                          colName=None):
+                          colName=None, bulk=False):
         """
         Look for summary metric values matching metricName (and optionally metricMetadata, slicerName
         and summaryName) among the results databases for each run.
@@ -268,6 +415,9 @@ class RunComparison(object):
         colName : str, opt
             Name of the column header for the dataframe. If more than one summary stat is
             returned from the database, then this will be ignored.
+        bulk : bool, opt
+            Find the summary stats in the harvested summary stats (see harvestSummaryStats),
+            rather than querying the results databases. Default False.
 
         Results
         -------
@@ -283,13 +433,11 @@ class RunComparison(object):
             # Check if this metric/metadata/slicer/summary stat name combo is in
             # this resultsDb .. or potentially in another subdirectory's resultsDb.
             for subdir in self.runresults[r]:
-                mId = self.runresults[r][subdir].getMetricId(metricName=metricName,
-                                                             metricMetadata=metricMetadata,
-                                                             slicerName=slicerName)
                 # Note that we may have more than one matching summary metric value per run.
-                if len(mId) > 0:
+                stats = self._getSummaryStats(r, subdir, metricName, metricMetadata=metricMetadata,
+                                              slicerName=slicerName, summaryName=summaryName, bulk=bulk)
+                if stats is not None:
                     # And we may have more than one summary metric value per resultsDb
-                    stats = self.runresults[r][subdir].getSummaryStats(mId, summaryName=summaryName)
                     if len(stats['summaryName']) == 1 and colName is not None:
                         name = colName
                         summaryValues[r][name] = stats['summaryValue'][0]
@@ -340,7 +488,7 @@ class RunComparison(object):
         stats = pd.concat(tempDFList)
         return header, stats
 
-    def addSummaryStats(self, metricDict):
+    def addSummaryStats(self, metricDict, bulk=False, nThreads=8):
         """
         Combine the summary statistics of a set of metrics into a pandas
         dataframe that is indexed by the opsim run name.
@@ -351,6 +499,12 @@ class RunComparison(object):
             A dictionary of metrics with all of the information needed to query
             a results database.  The metric/metadata/slicer/summary values referred to
             by a metricDict value could be unique but don't have to be.
+        bulk: bool, opt
+            If True, load all of the summary stats from every results database at once
+            (in parallel, with nThreads threads; see harvestSummaryStats) and find the metrics in memory.
+            This is much faster when comparing many runs or many metrics. Default False.
+        nThreads: int, opt
+            The number of threads to use to load the summary stats, if bulk is True. Default 8.
 
         Returns
         -------
@@ -363,14 +517,16 @@ class RunComparison(object):
             <run_123>    <metricValue1>  <metricValue2>
             <run_124>    <metricValue1>  <metricValue2>
         """
+        if bulk and self.allSummaryStats is None:
+            self.harvestSummaryStats(nThreads=nThreads)
         for mName, metric in metricDict.items():
             if 'summaryName' not in metric:
                 metric['summaryName'] = None
-                tempHeader, tempStats = self._findSummaryStats(metricName=metric['metricName'],
-                                                               metricMetadata=metric['metricMetadata'],
-                                                               slicerName=metric['slicerName'],
-                                                               summaryName=metric['summaryName'],
-                                                               colName=mName)
+            tempHeader, tempStats = self._findSummaryStats(metricName=metric['metricName'],
+                                                           metricMetadata=metric['metricMetadata'],
+                                                           slicerName=metric['slicerName'],
+                                                           summaryName=metric['summaryName'],
+                                                           colName=mName, bulk=bulk)
             if self.summaryStats is None:
                 self.summaryStats = tempStats
                 self.headerStats = tempHeader
@@ -9,5 +9,6 @@ from .healpixSlicer import *
 from .opsimFieldSlicer import *
 from .healpixSDSSSlicer import *
 from .userPointsSlicer import *
+from .moCache import *
 from .moSlicer import *
 from .healpixComCamSlicer import *
@@ -116,6 +116,31 @@ class BaseSlicer(with_metaclass(SlicerRegistry, object)):
         raise NotImplementedError()
 
 
+    @property
+    def canStream(self):
+        """True if the slicer can slice data which arrives in chunks (see sliceChunk).
+
+        The slicePoints of such a slicer must not depend on the data.
+        """
+        return False
+
+    def sliceChunk(self, simData):
+        """Find the indexes of one chunk of a stream of data, for each slicePoint.
+
+        The slicer must already be set up (using setupSlicer on the first chunk of data).
+
+        Parameters
+        -----------
+        simData : np.recarray
+            The chunk of simulated data to be sliced.
+
+        Returns
+        -------
+        list of (int, np.ndarray)
+            The slicePoint number and the indexes in simData, for each slicePoint with data in this chunk.
+        """
+        raise NotImplementedError('This slicer can not slice streamed data.')
+
     def getSlicePoints(self):
         """Return the slicePoint metadata, for all slice points.
         """
@@ -6,6 +6,8 @@ from builtins import range
 # The primary things added here are the methods to slice the data (for any spatial slicer)
 #  as this uses a KD-tree built on spatial (RA/Dec type) indexes.
 
+import os
+import hashlib
 import warnings
 import numpy as np
 from functools import wraps
@@ -16,6 +18,7 @@ from lsst.sims.maf.plots.spatialPlotters import BaseHistogram, BaseSkyMap
 from lsst.obs.lsstSim import LsstSimMapper
 from lsst.sims.coordUtils import _chipNameFromRaDec
 import lsst.sims.utils as simsUtils
+from lsst.sims.maf.utils.mafUtils import gnomonic_project_toxy
 
 from .baseSlicer import BaseSlicer
 
@@ -60,11 +63,25 @@ class BaseSpatialSlicer(BaseSlicer):
     chipNames : array-like, optional
         List of chips to accept, if useCamera is True. This lets users turn 'on' only a subset of chips.
         Default 'all' - this uses all chips in the camera.
+    footprintMethod : str, optional
+        How to find the healpixels falling on the chips of each pointing, if useCamera is True.
+        'lsst' evaluates the LSST camera model for each pointing in turn.
+        'raster' projects the healpixels near all pointings into the focal plane at once and looks up
+        the chip at each position in a raster of the camera footprint. This is much faster, but is an
+        approximation: the raster is built from the camera model for a single pointing (at zenith, at a
+        fixed MJD, so differential refraction and aberration at other pointings are ignored) and has a
+        finite resolution, so healpixels close to the chip edges may be assigned differently.
+        Default 'lsst'.
+    cacheDir : str, optional
+        Directory in which to save the slice membership (the simData indexes at each slicePoint)
+        calculated in setupSlicer. If the same simData pointings are sliced again with the same slicer
+        configuration, the membership is read back from this directory instead of being recalculated.
+        Default None (do not cache the slice membership on disk).
     """
     def __init__(self, lonCol='fieldRA', latCol='fieldDec', latLonDeg=True,
                  verbose=True, badval=-666, leafsize=100, radius=1.75,
                  useCamera=False, rotSkyPosColName='rotSkyPos', mjdColName='observationStartMJD',
-                 chipNames='all'):
+                 chipNames='all', footprintMethod='lsst', cacheDir=None):
         super(BaseSpatialSlicer, self).__init__(verbose=verbose, badval=badval)
         self.lonCol = lonCol
         self.latCol = latCol
@@ -83,6 +100,10 @@ class BaseSpatialSlicer(BaseSlicer):
         self.leafsize = leafsize
         self.useCamera = useCamera
         self.chipsToUse = chipNames
+        if footprintMethod not in ('raster', 'lsst'):
+            raise ValueError('footprintMethod should be "raster" or "lsst", not %s' % footprintMethod)
+        self.footprintMethod = footprintMethod
+        self.cacheDir = cacheDir
         # RA and Dec are required slicePoint info for any spatial slicer. Slicepoint RA/Dec are in radians.
         self.slicePoints['sid'] = None
         self.slicePoints['ra'] = None
@@ -90,6 +111,8 @@ class BaseSpatialSlicer(BaseSlicer):
         self.nslice = None
         self.shape = None
         self.plotFuncs = [BaseHistogram, BaseSkyMap]
+        # The simData indexes at each slicePoint, in CSR (indptr, indices) form. Set by setupSlicer.
+        self.sliceIndexCSR = None
 
     def setupSlicer(self, simData, maps=None):
         """Use simData[self.lonCol] and simData[self.latCol] (in radians) to set up KDTree.
@@ -109,15 +132,28 @@ class BaseSpatialSlicer(BaseSlicer):
                               'Should probably set useCache=False in slicer.')
             self._runMaps(maps)
         self._setRad(self.radius)
-        if self.useCamera:
-            self._setupLSSTCamera()
-            self._presliceFootprint(simData)
+        cacheFile = None
+        if self.cacheDir is not None:
+            cacheFile = self._cacheFilename(simData)
+        if cacheFile is not None and os.path.isfile(cacheFile):
+            self._readSliceCache(cacheFile)
         else:
-            if self.latLonDeg:
-                self._buildTree(np.radians(simData[self.lonCol]),
-                                np.radians(simData[self.latCol]), self.leafsize)
+            if self.useCamera:
+                self._setupLSSTCamera()
+                if self.footprintMethod == 'lsst':
+                    self._presliceFootprint(simData)
+                    self.sliceIndexCSR = self._listsToCSR(self.sliceLookup, simData.size)
+                else:
+                    self._presliceFootprintRaster(simData)
             else:
-                self._buildTree(simData[self.lonCol], simData[self.latCol], self.leafsize)
+                if self.latLonDeg:
+                    self._buildTree(np.radians(simData[self.lonCol]),
+                                    np.radians(simData[self.latCol]), self.leafsize)
+                else:
+                    self._buildTree(simData[self.lonCol], simData[self.latCol], self.leafsize)
+                self.sliceIndexCSR = self._querySlicePoints(simData.size)
+            if cacheFile is not None:
+                self._writeSliceCache(cacheFile)
 
         @wraps(self._sliceSimData)
         def _sliceSimData(islice):
@@ -126,14 +162,10 @@ class BaseSpatialSlicer(BaseSlicer):
 
             # Build dict for slicePoint info
             slicePoint = {}
+            indptr, indices = self.sliceIndexCSR
+            indices = indices[indptr[islice]:indptr[islice + 1]]
             if self.useCamera:
-                indices = self.sliceLookup[islice]
                 slicePoint['chipNames'] = self.chipNames[islice]
-            else:
-                sx, sy, sz = simsUtils._xyz_from_ra_dec(self.slicePoints['ra'][islice],
-                                                        self.slicePoints['dec'][islice])
-                # Query against tree.
-                indices = self.opsimtree.query_ball_point((sx, sy, sz), self.rad)
 
             # Loop through all the slicePoint keys. If the first dimension of slicepoint[key] has
             # the same shape as the slicer, assume it is information per slicepoint.
@@ -151,6 +183,114 @@ class BaseSpatialSlicer(BaseSlicer):
             return {'idxs': indices, 'slicePoint': slicePoint}
         setattr(self, '_sliceSimData', _sliceSimData)
 
+    def _querySlicePoints(self, nData, chunkSize=10000):
+        """Find the simData indexes within self.rad of every slicePoint, using the KD-tree.
+
+        The tree is queried with batches of slicePoints (rather than one slicePoint at a time),
+        and the results are stored in CSR form.
+
+        Parameters
+        ----------
+        nData : int
+            The number of points in the simData used to build the tree.
+        chunkSize : int, optional
+            The number of slicePoints to query at once. Default 10000.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            The (indptr, indices) arrays; the simData indexes at slicePoint i are
+            indices[indptr[i]:indptr[i+1]], in increasing order.
+        """
+        # Use the smallest integer type which can hold the simData indexes, to save memory.
+        idxDtype = np.int32 if nData < np.iinfo(np.int32).max else np.int64
+        counts = np.zeros(self.nslice, dtype=np.int64)
+        idxChunks = []
+        for start in range(0, self.nslice, chunkSize):
+            stop = min(start + chunkSize, self.nslice)
+            sx, sy, sz = simsUtils._xyz_from_ra_dec(self.slicePoints['ra'][start:stop],
+                                                    self.slicePoints['dec'][start:stop])
+            results = self.opsimtree.query_ball_point(np.array([sx, sy, sz]).T, self.rad,
+                                                      return_sorted=True)
+            for i, result in enumerate(results):
+                counts[start + i] = len(result)
+                idxChunks.append(np.array(result, dtype=idxDtype))
+        indptr = np.zeros(self.nslice + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(counts)
+        if len(idxChunks) > 0:
+            indices = np.concatenate(idxChunks)
+        else:
+            indices = np.array([], dtype=idxDtype)
+        return indptr, indices
+
+    def _listsToCSR(self, indexLists, nData):
+        """Convert a list of simData index lists (one per slicePoint) into CSR (indptr, indices) form.
+
+        The indices use the same (smallest) integer type as _querySlicePoints, for nData simData points.
+        """
+        idxDtype = np.int32 if nData < np.iinfo(np.int32).max else np.int64
+        indptr = np.zeros(len(indexLists) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(idxs) for idxs in indexLists])
+        if len(indexLists) > 0:
+            indices = np.concatenate([np.asarray(idxs, dtype=idxDtype) for idxs in indexLists])
+        else:
+            indices = np.array([], dtype=idxDtype)
+        return indptr, indices
+
+    def _cacheFilename(self, simData):
+        """Build the name of the slice membership cache file for this simData and slicer configuration.
+
+        The name includes a hash of the simData pointing columns, the slicePoint locations,
+        the radius and (if useCamera is True) the rotation angles, times and chips used.
+        """
+        hasher = hashlib.sha1()
+        cols = [self.lonCol, self.latCol]
+        if self.useCamera:
+            cols += [self.rotSkyPosColName, self.mjdColName]
+        for col in cols:
+            hasher.update(np.ascontiguousarray(simData[col], dtype=float).tobytes())
+        for key in ('ra', 'dec'):
+            hasher.update(np.ascontiguousarray(self.slicePoints[key], dtype=float).tobytes())
+        chipsToUse = self.chipsToUse
+        if chipsToUse != 'all':
+            chipsToUse = sorted(chipsToUse)
+        config = [self.slicerName, self.latLonDeg, float(self.radius), self.useCamera, chipsToUse,
+                  self.footprintMethod]
+        hasher.update(repr(config).encode('utf-8'))
+        return os.path.join(self.cacheDir, '%s_%s.npz' % (self.slicerName, hasher.hexdigest()))
+
+    def _writeSliceCache(self, cacheFile):
+        """Save the slice membership (and chip names, if using the camera) to cacheFile.
+        """
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        indptr, indices = self.sliceIndexCSR
+        arrays = {'indptr': indptr, 'indices': indices}
+        if self.useCamera:
+            # The chip names line up with the indices of each slicePoint.
+            arrays['chipNames'] = np.array([chipName for chipNames in self.chipNames
+                                            for chipName in chipNames], dtype=str)
+        # Write to a temporary file first, so other processes never read a partial file.
+        tmpFile = cacheFile.replace('.npz', '_%d.tmp.npz' % os.getpid())
+        np.savez_compressed(tmpFile, **arrays)
+        os.rename(tmpFile, cacheFile)
+        if self.verbose:
+            print('Saved slice membership to %s' % cacheFile)
+
+    def _readSliceCache(self, cacheFile):
+        """Restore the slice membership (and chip names, if using the camera) from cacheFile.
+        """
+        with np.load(cacheFile) as cached:
+            indptr = cached['indptr']
+            indices = cached['indices']
+            self.sliceIndexCSR = (indptr, indices)
+            if self.useCamera:
+                chipNames = cached['chipNames']
+                self.chipNames = [chipNames[indptr[i]:indptr[i + 1]] for i in range(self.nslice)]
+                self.sliceLookup = [indices[indptr[i]:indptr[i + 1]] for i in range(self.nslice)]
+        if self.verbose:
+            print('Read slice membership from %s' % cacheFile)
+
     def _setupLSSTCamera(self):
         """If we want to include the camera chip gaps, etc"""
         mapper = LsstSimMapper()
@@ -204,6 +344,159 @@ class BaseSpatialSlicer(BaseSlicer):
         if self.verbose:
             "Created lookup table after checking for chip gaps."
 
+    def _buildChipRaster(self, rasterScale=10.):
+        """Evaluate the camera model on a grid in the focal plane, to build a raster of chip locations.
+
+        The raster is evaluated for a pointing at zenith (to minimize refraction) with rotSkyPos=0.
+        The direction of rotation of the focal plane with rotSkyPos is then checked against the camera
+        model at a second rotation angle.
+
+        Parameters
+        ----------
+        rasterScale : float, optional
+            The size of each raster pixel, in arcseconds. Default 10.
+        """
+        site = simsUtils.Site(name='LSST')
+        mjd = 59580.
+        lmst, last = simsUtils.calcLmstLast(mjd, np.radians(site.longitude))
+        raCen = np.radians(last * 15.)
+        decCen = np.radians(site.latitude)
+        self._chipRasterScale = np.radians(rasterScale / 3600.)
+        halfSize = np.radians(self.radius) * 1.05
+        self._chipRasterN = int(np.ceil(2 * halfSize / self._chipRasterScale))
+        self._chipRasterHalfSize = self._chipRasterN * self._chipRasterScale / 2.
+        # The centers of the raster pixels, in the gnomonic projection.
+        centers = (np.arange(self._chipRasterN) + 0.5) * self._chipRasterScale - self._chipRasterHalfSize
+        x, y = np.meshgrid(centers, centers, indexing='ij')
+        x = x.ravel()
+        y = y.ravel()
+        ra, dec = self._gnomonicToRaDec(x, y, raCen, decCen)
+        obs_metadata = simsUtils.ObservationMetaData(pointingRA=np.degrees(raCen),
+                                                     pointingDec=np.degrees(decCen),
+                                                     rotSkyPos=0., mjd=mjd)
+        chipNames = _chipNameFromRaDec(ra, dec, epoch=self.epoch, camera=self.camera,
+                                       obs_metadata=obs_metadata)
+        onChip = chipNames != [None]
+        if self.chipsToUse != 'all':
+            onChip &= np.array([chipName in self.chipsToUse for chipName in chipNames])
+        self._chipRasterNames, chipIdx = np.unique(chipNames[onChip].astype(str), return_inverse=True)
+        self._chipRaster = np.zeros(self._chipRasterN * self._chipRasterN, dtype=np.int32) - 1
+        self._chipRaster[onChip] = chipIdx
+        self._chipRaster = self._chipRaster.reshape(self._chipRasterN, self._chipRasterN)
+        # Check the sense of rotation of the focal plane, using a set of points at another rotSkyPos.
+        rng = np.random.RandomState(42)
+        rotSkyPos = np.radians(60.)
+        x = (rng.rand(2000) * 2 - 1) * np.radians(self.radius) / np.sqrt(2)
+        y = (rng.rand(2000) * 2 - 1) * np.radians(self.radius) / np.sqrt(2)
+        ra, dec = self._gnomonicToRaDec(x, y, raCen, decCen)
+        obs_metadata = simsUtils.ObservationMetaData(pointingRA=np.degrees(raCen),
+                                                     pointingDec=np.degrees(decCen),
+                                                     rotSkyPos=np.degrees(rotSkyPos), mjd=mjd)
+        chipNames = _chipNameFromRaDec(ra, dec, epoch=self.epoch, camera=self.camera,
+                                       obs_metadata=obs_metadata)
+        chipNames = np.where(chipNames == [None], '', chipNames).astype(str)
+        matches = []
+        for sign in (1, -1):
+            self._chipRasterSign = sign
+            chipIdx = self._lookupChips(x, y, np.zeros(len(x)) + rotSkyPos)
+            lookupNames = np.where(chipIdx >= 0, self._chipRasterNames[chipIdx], '')
+            matches.append(np.sum(lookupNames == chipNames))
+        self._chipRasterSign = 1 if matches[0] >= matches[1] else -1
+
+    def _gnomonicToRaDec(self, x, y, raCen, decCen):
+        """Convert x/y values in a gnomonic projection centered at raCen/decCen (radians) to RA/Dec.
+        """
+        rho = np.sqrt(x**2 + y**2)
+        c = np.arctan(rho)
+        # Avoid dividing by zero at the center of the projection.
+        rho = np.where(rho == 0, 1e-20, rho)
+        dec = np.arcsin(np.cos(c) * np.sin(decCen) + y * np.sin(c) * np.cos(decCen) / rho)
+        ra = raCen + np.arctan2(x * np.sin(c), rho * np.cos(decCen) * np.cos(c) -
+                                y * np.sin(decCen) * np.sin(c))
+        return ra % (2. * np.pi), dec
+
+    def _lookupChips(self, x, y, rotSkyPos):
+        """Find the index of the chip (in self._chipRasterNames) at gnomonic x/y positions
+        relative to pointings with rotation angles rotSkyPos (radians). Returns -1 off the chips.
+        """
+        cosRot = np.cos(rotSkyPos)
+        sinRot = np.sin(rotSkyPos) * self._chipRasterSign
+        # Rotate the sky positions into the frame of the camera at rotSkyPos=0.
+        xCam = x * cosRot + y * sinRot
+        yCam = -x * sinRot + y * cosRot
+        ix = np.floor((xCam + self._chipRasterHalfSize) / self._chipRasterScale).astype(int)
+        iy = np.floor((yCam + self._chipRasterHalfSize) / self._chipRasterScale).astype(int)
+        inRaster = (ix >= 0) & (ix < self._chipRasterN) & (iy >= 0) & (iy < self._chipRasterN)
+        chipIdx = np.zeros(len(x), dtype=np.int32) - 1
+        chipIdx[inRaster] = self._chipRaster[ix[inRaster], iy[inRaster]]
+        return chipIdx
+
+    def _presliceFootprintRaster(self, simData, chunkSize=10000):
+        """Find which sky points fall on a chip for each pointing, for many pointings at once.
+
+        The healpixels near each pointing are found with a KD-tree on the slicePoints, then projected
+        into the focal plane and matched against the raster of chip locations.
+        Sets self.sliceIndexCSR, and self.sliceLookup and self.chipNames (as arrays for each slicePoint).
+
+        Parameters
+        ----------
+        simData : numpy.recarray
+            The simulated data, including the location and rotation angle of each pointing.
+        chunkSize : int, optional
+            The number of pointings to process at once. Default 10000.
+        """
+        self._buildChipRaster()
+        # Make a kdtree for the _slicepoints_
+        self._buildTree(self.slicePoints['ra'], self.slicePoints['dec'], leafsize=self.leafsize)
+        if self.latLonDeg:
+            lat = np.radians(simData[self.latCol])
+            lon = np.radians(simData[self.lonCol])
+        else:
+            lat = simData[self.latCol]
+            lon = simData[self.lonCol]
+        rotSkyPos = simData[self.rotSkyPosColName]
+        idxDtype = np.int32 if simData.size < np.iinfo(np.int32).max else np.int64
+        hpChunks = []
+        visitChunks = []
+        chipChunks = []
+        for start in range(0, simData.size, chunkSize):
+            stop = min(start + chunkSize, simData.size)
+            dx, dy, dz = simsUtils._xyz_from_ra_dec(lon[start:stop], lat[start:stop])
+            # Find healpixels inside the FoV of each pointing.
+            results = self.opsimtree.query_ball_point(np.array([dx, dy, dz]).T, self.rad)
+            counts = np.array([len(result) for result in results])
+            if counts.sum() == 0:
+                continue
+            hpIndices = np.concatenate([np.array(result, dtype=np.int64) for result in results])
+            visits = np.repeat(np.arange(start, stop), counts)
+            x, y = gnomonic_project_toxy(self.slicePoints['ra'][hpIndices],
+                                         self.slicePoints['dec'][hpIndices],
+                                         lon[visits], lat[visits])
+            chipIdx = self._lookupChips(x, y, rotSkyPos[visits])
+            good = np.where(chipIdx >= 0)[0]
+            hpChunks.append(hpIndices[good])
+            visitChunks.append(visits[good].astype(idxDtype))
+            chipChunks.append(chipIdx[good])
+        if len(hpChunks) > 0:
+            hpIndices = np.concatenate(hpChunks)
+            visits = np.concatenate(visitChunks)
+            chipIdx = np.concatenate(chipChunks)
+        else:
+            hpIndices = np.array([], dtype=np.int64)
+            visits = np.array([], dtype=idxDtype)
+            chipIdx = np.array([], dtype=np.int32)
+        # Order by slicePoint, then by visit (as for the per-pointing lookup).
+        order = np.lexsort((visits, hpIndices))
+        indptr = np.zeros(self.nslice + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(hpIndices, minlength=self.nslice))
+        indices = visits[order]
+        chipNames = self._chipRasterNames[chipIdx[order]]
+        self.sliceIndexCSR = (indptr, indices)
+        self.sliceLookup = [indices[indptr[i]:indptr[i + 1]] for i in range(self.nslice)]
+        self.chipNames = [chipNames[indptr[i]:indptr[i + 1]] for i in range(self.nslice)]
+        if self.verbose:
+            print('Created lookup table after checking for chip gaps.')
+
     def _buildTree(self, simDataRa, simDataDec, leafsize=100):
         """Build KD tree on simDataRA/Dec using utility function from mafUtils.
 
@@ -79,18 +79,29 @@ class HealpixSlicer(BaseSpatialSlicer):
     chipNames : array-like, optional
         List of chips to accept, if useCamera is True. This lets users turn 'on' only a subset of chips.
         Default 'all' - this uses all chips in the camera.
+    footprintMethod : str, optional
+        How to find the healpixels on the chips of each pointing, if useCamera is True:
+        'lsst' (evaluates the camera model for each pointing) or 'raster' (much faster, but approximates
+        the camera footprint with a raster; see BaseSpatialSlicer). Default 'lsst'.
+    cacheDir : str, optional
+        Directory in which to save (and look for) the slice membership calculated in setupSlicer,
+        so it can be reused when the same pointings are sliced again.
+        Default None (do not cache the slice membership on disk).
     """
     def __init__(self, nside=128, lonCol ='fieldRA',
                  latCol='fieldDec', latLonDeg=True, verbose=True, badval=hp.UNSEEN,
                  useCache=True, leafsize=100, radius=1.75,
                  useCamera=False, rotSkyPosColName='rotSkyPos',
-                 mjdColName='observationStartMJD', chipNames='all'):
+                 mjdColName='observationStartMJD', chipNames='all', footprintMethod='lsst',
+                 cacheDir=None):
         """Instantiate and set up healpix slicer object."""
         super(HealpixSlicer, self).__init__(verbose=verbose,
                                             lonCol=lonCol, latCol=latCol,
                                             badval=badval, radius=radius, leafsize=leafsize,
                                             useCamera=useCamera, rotSkyPosColName=rotSkyPosColName,
-                                            mjdColName=mjdColName, chipNames=chipNames, latLonDeg=latLonDeg)
+                                            mjdColName=mjdColName, chipNames=chipNames,
+                                            footprintMethod=footprintMethod,
+                                            cacheDir=cacheDir, latLonDeg=latLonDeg)
         # Valid values of nside are powers of 2.
         # nside=64 gives about 1 deg resolution
         # nside=256 gives about 13' resolution (~1 CCD)
@@ -0,0 +1,251 @@
+from __future__ import print_function
+from collections import OrderedDict
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+
+__all__ = ['moCacheDir', 'writeMoCache', 'writeMoCacheChunks', 'readMoCache']
+
+# Increment if the layout of the cache changes, so that older caches are rebuilt.
+_cacheVersion = 1
+
+
+def moCacheDir(filename):
+    """Return the name of the directory holding the binary cache of (text) file filename.
+
+    The cache is kept next to the text file, as filename + '.cache'.
+    """
+    return filename + '.cache'
+
+
+def _sourceInfo(filename, readArgs):
+    """The values identifying the version of filename (and how it was read), stored with the cache.
+    """
+    stat = os.stat(filename)
+    return {'version': _cacheVersion, 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'readArgs': readArgs}
+
+
+def writeMoCache(filename, data, indexCol=None, readArgs=None):
+    """Write a binary cache of a dataframe read from the text file filename.
+
+    Each column of data is saved as a (memory-mappable) numpy .npy file in moCacheDir(filename),
+    together with the size and modification time of filename, so that the cache is only used
+    while filename is unchanged.
+    If indexCol is set, the rows are (stably) sorted by indexCol, and the unique values of indexCol
+    and the offsets of their first rows are saved as well, so that the rows for each value
+    can be found without reading or sorting the data.
+
+    Parameters
+    ----------
+    filename : str
+        The text file the data was read from.
+    data : pandas.DataFrame
+        The data to cache.
+    indexCol : str, optional
+        The column to sort and index the data by (e.g. 'objId'). Default None (no index).
+    readArgs : dict, optional
+        Any options used to read filename (e.g. the delimiter). The cache is only used when
+        it is read with the same readArgs. Default None.
+
+    Returns
+    -------
+    str
+        The cache directory.
+    """
+    info = _sourceInfo(filename, readArgs)
+    if indexCol is not None:
+        ids = _indexValues(data, indexCol)
+        order = np.argsort(ids, kind='mergesort')
+        data = data.iloc[order]
+        ids = ids[order]
+        if len(ids) > 0:
+            starts = np.concatenate([[0], np.where(ids[1:] != ids[:-1])[0] + 1])
+        else:
+            starts = np.zeros(0, int)
+        info['indexCol'] = indexCol
+
+    def writeColumns(tmpDir):
+        columns = []
+        for col in data.columns:
+            values = np.asarray(data[col].values)
+            if values.dtype == 'object':
+                values = values.astype(str)
+            # Columns are saved by position, as the column names may not be valid filenames.
+            np.save(os.path.join(tmpDir, '%d.npy' % len(columns)), np.ascontiguousarray(values))
+            columns.append(str(col))
+        if indexCol is not None:
+            np.save(os.path.join(tmpDir, 'index.npy'), ids[starts])
+            np.save(os.path.join(tmpDir, 'offsets.npy'), np.append(starts, len(ids)).astype(np.int64))
+        return columns
+
+    return _writeCacheDir(filename, info, writeColumns)
+
+
+def writeMoCacheChunks(filename, readChunks, indexCol, readArgs=None):
+    """Write a binary cache of the text file filename, indexed by indexCol, reading it in chunks.
+
+    The result is the same as writeMoCache(filename, data, indexCol=indexCol), where data is all of the
+    chunks together, but only one chunk of the data is in memory at a time.
+    The chunks are read twice: first to find the type of each column and the number of rows for each
+    value of indexCol (and so where the rows for each value start in the sorted cache), then to copy each
+    chunk's rows into their places in the (memory-mapped) cache columns.
+
+    Parameters
+    ----------
+    filename : str
+        The text file the data is read from.
+    readChunks : callable
+        A function returning an iterator over the dataframes read from filename (e.g. read with pandas,
+        with a chunksize). It is called twice, and must return the same data each time.
+    indexCol : str
+        The column to sort and index the data by (e.g. 'objId').
+    readArgs : dict, optional
+        Any options used to read filename. Default None.
+
+    Returns
+    -------
+    str
+        The cache directory.
+    """
+    info = _sourceInfo(filename, readArgs)
+    info['indexCol'] = indexCol
+    # First pass: the column types, and the number of rows for each index value.
+    dtypes = OrderedDict()
+    counts = {}
+    for chunk in readChunks():
+        for col in chunk.columns:
+            values = np.asarray(chunk[col].values)
+            if values.dtype == 'object':
+                values = values.astype(str)
+            dtype = values.dtype
+            if col in dtypes:
+                dtype = np.promote_types(dtypes[col], dtype)
+            dtypes[col] = dtype
+        for objId, count in zip(*np.unique(_indexValues(chunk, indexCol), return_counts=True)):
+            counts[objId] = counts.get(objId, 0) + count
+    if len(dtypes) > 0 and dtypes[indexCol].kind == 'U':
+        # The index values of some chunks may have been read as numbers.
+        strCounts = {}
+        for objId, count in counts.items():
+            strCounts[str(objId)] = strCounts.get(str(objId), 0) + count
+        counts = strCounts
+    if len(counts) > 0:
+        ids = np.sort(np.array(list(counts.keys()), dtype=dtypes[indexCol]))
+    else:
+        ids = np.zeros(0, int)
+    offsets = np.zeros(len(ids) + 1, np.int64)
+    offsets[1:] = np.cumsum([counts[objId] for objId in ids.tolist()])
+    nRows = offsets[-1]
+
+    def writeColumns(tmpDir):
+        columns = list(dtypes.keys())
+        outColumns = [np.lib.format.open_memmap(os.path.join(tmpDir, '%d.npy' % i), mode='w+',
+                                                dtype=dtypes[col], shape=(nRows,))
+                      for i, col in enumerate(columns)]
+        # Second pass: copy each chunk's rows into place, keeping the rows of each index value
+        # in their original order.
+        filled = np.zeros(len(ids), np.int64)
+        for chunk in readChunks():
+            chunkIds = _indexValues(chunk, indexCol)
+            if dtypes[indexCol].kind == 'U':
+                chunkIds = chunkIds.astype(str)
+            idx = np.searchsorted(ids, chunkIds)
+            order = np.argsort(idx, kind='mergesort')
+            sortedIdx = idx[order]
+            groups, firstRows, groupCounts = np.unique(sortedIdx, return_index=True, return_counts=True)
+            # The position of each row among the rows of its index value in this chunk.
+            rank = np.arange(len(sortedIdx)) - np.repeat(firstRows, groupCounts)
+            rows = np.empty(len(idx), np.int64)
+            rows[order] = offsets[sortedIdx] + filled[sortedIdx] + rank
+            filled[groups] += groupCounts
+            for col, out in zip(columns, outColumns):
+                values = np.asarray(chunk[col].values)
+                if values.dtype == 'object':
+                    values = values.astype(str)
+                out[rows] = values
+        for out in outColumns:
+            out.flush()
+        del outColumns
+        np.save(os.path.join(tmpDir, 'index.npy'), ids)
+        np.save(os.path.join(tmpDir, 'offsets.npy'), offsets)
+        return [str(col) for col in columns]
+
+    return _writeCacheDir(filename, info, writeColumns)
+
+
+def _indexValues(data, indexCol):
+    """Return the values of indexCol in data (as strings, if they are python objects).
+    """
+    ids = np.asarray(data[indexCol].values)
+    if ids.dtype == 'object':
+        ids = ids.astype(str)
+    return ids
+
+
+def _writeCacheDir(filename, info, writeColumns):
+    """Write the cache of filename, using writeColumns(tmpDir) to write the column (and index) files
+    and return the list of column names, then save info.
+    """
+    cacheDir = moCacheDir(filename)
+    # Write to a temporary directory first, so other processes never see a partial cache.
+    tmpDir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(cacheDir)),
+                              prefix='.%s.' % os.path.basename(cacheDir))
+    try:
+        info['columns'] = writeColumns(tmpDir)
+        with open(os.path.join(tmpDir, 'info.json'), 'w') as f:
+            json.dump(info, f)
+        if os.path.isdir(cacheDir):
+            shutil.rmtree(cacheDir)
+        os.rename(tmpDir, cacheDir)
+    except Exception:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        raise
+    return cacheDir
+
+
+def readMoCache(filename, readArgs=None, mmap=True):
+    """Read the binary cache of the text file filename, if it is up to date.
+
+    Parameters
+    ----------
+    filename : str
+        The text file which was cached (with writeMoCache).
+    readArgs : dict, optional
+        The options used to read filename (these must match the values given to writeMoCache).
+        Default None.
+    mmap : bool, optional
+        Memory-map the columns (True, default), rather than reading them into memory.
+
+    Returns
+    -------
+    OrderedDict, numpy.ndarray, numpy.ndarray or None
+        The arrays of each column (keyed by column name), the unique values of the index column and
+        the offsets of their first rows (plus the total number of rows), or (columns, None, None) if
+        the cache has no index.
+        None is returned if there is no cache, or it is out of date.
+    """
+    cacheDir = moCacheDir(filename)
+    infoFile = os.path.join(cacheDir, 'info.json')
+    if not os.path.isfile(infoFile):
+        return None
+    try:
+        with open(infoFile, 'r') as f:
+            info = json.load(f)
+    except ValueError:
+        return None
+    expected = _sourceInfo(filename, readArgs)
+    for key in expected:
+        if info.get(key) != expected[key]:
+            return None
+    mmapMode = 'r' if mmap else None
+    columns = OrderedDict()
+    for i, col in enumerate(info['columns']):
+        columns[col] = np.load(os.path.join(cacheDir, '%d.npy' % i), mmap_mode=mmapMode)
+    if 'indexCol' not in info:
+        return columns, None, None
+    index = np.load(os.path.join(cacheDir, 'index.npy'), mmap_mode=mmapMode)
+    offsets = np.load(os.path.join(cacheDir, 'offsets.npy'))
+    return columns, index, offsets
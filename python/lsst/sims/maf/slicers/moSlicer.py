@@ -1,3 +1,4 @@
+from collections import OrderedDict
 import numpy as np
 import numpy.ma as ma
 import pandas as pd
@@ -7,6 +8,7 @@ from .baseSlicer import BaseSlicer
 from lsst.sims.maf.plots.moPlotters import MetricVsH, MetricVsOrbit
 
 from .orbits import Orbits
+from .moCache import writeMoCache, writeMoCacheChunks, readMoCache
 
 __all__ = ['MoObjSlicer']
 
@@ -22,17 +24,25 @@ class MoObjSlicer(BaseSlicer):
     ----------
     Hrange : numpy.ndarray or None
         The H values to clone the orbital parameters over. If Hrange is None, will not clone orbits.
+
+    The orbitFile and obsFile are (by default) cached in a binary format (see writeMoCache) the first
+    time they are read, in a directory next to each file; later reads of the same (unchanged) files
+    load the cached columns instead of parsing the text again.
     """
     def __init__(self, Hrange=None, verbose=True, badval=0):
         super(MoObjSlicer, self).__init__(verbose=verbose, badval=badval)
         self.Hrange = Hrange
         self.slicer_init = {'Hrange': Hrange, 'badval': badval}
+        self._obsRecords = None
+        self.obsChunksize = None
+        self.useCache = True
         # Set default plotFuncs.
         self.plotFuncs = [MetricVsH(),
                           MetricVsOrbit(xaxis='q', yaxis='e'),
                           MetricVsOrbit(xaxis='q', yaxis='inc')]
 
-    def setupSlicer(self, orbitFile, delim=None, skiprows=None, obsFile=None):
+    def setupSlicer(self, orbitFile, delim=None, skiprows=None, obsFile=None, obsChunksize=None,
+                    useCache=True):
         """Set up the slicer and read orbitFile and obsFile from disk.
 
         Sets self.orbits (with orbit parameters), self.allObs, and self.obs
@@ -46,9 +56,24 @@ class MoObjSlicer(BaseSlicer):
         obsFile : str, optional
             The file containing the observations of each object, optional.
             If not provided (default, None), then the slicer will not be able to 'slice', but can still plot.
+        obsChunksize : int, optional
+            If set, the observations are not all read into memory: instead, they are streamed from obsFile
+            in chunks of (about) this many lines, using iterObs. The observations in obsFile must then
+            be grouped by objId (unless they were already cached). Default None (read all of the observations).
+        useCache : bool, optional
+            Read the orbitFile and obsFile from their binary caches if these are up to date, and write
+            the caches if not (True, default). The observations are not cached when they are streamed
+            with obsChunksize, but an existing cache is used.
         """
+        self.useCache = useCache
         self.readOrbits(orbitFile, delim=delim, skiprows=skiprows)
-        if obsFile is not None:
+        self.obsChunksize = obsChunksize
+        if obsFile is not None and obsChunksize is not None:
+            # The observations will be read as they are used.
+            self.obsFile = obsFile
+            self.allObs = None
+            self.obs = None
+        elif obsFile is not None:
             self.readObs(obsFile)
         else:
             self.obsFile = None
@@ -59,11 +84,21 @@ class MoObjSlicer(BaseSlicer):
         self.slicer_init['obsFile'] = self.obsFile
 
     def readOrbits(self, orbitFile, delim=None, skiprows=None):
-        # Use sims_movingObjects to read orbit files.
-        orb = Orbits()
-        orb.readOrbits(orbitFile, delim=delim, skiprows=skiprows)
+        readArgs = {'delim': delim, 'skiprows': skiprows}
+        cache = None
+        if self.useCache:
+            cache = readMoCache(orbitFile, readArgs=readArgs)
+        if cache is not None:
+            self.orbits = self._cacheFrame(cache[0])
+        else:
+            # Use sims_movingObjects to read orbit files.
+            orb = Orbits()
+            orb.readOrbits(orbitFile, delim=delim, skiprows=skiprows)
+            self.orbits = orb.orbits
+            if self.useCache:
+                self._writeCache(orbitFile, self.orbits, readArgs=readArgs)
         self.orbitFile = orbitFile
-        self.orbits = orb.orbits
+        self._obsRecords = None
         # Then go on as previously. Need to refactor this into 'setupSlicer' style.
         self.nSso = len(self.orbits)
         self.slicePoints = {}
@@ -86,23 +121,209 @@ class MoObjSlicer(BaseSlicer):
         obsFile: str
             The file containing the observation information.
         """
-        # For now, just read all the observations (should be able to chunk this though).
-        self.allObs = pd.read_table(obsFile, delim_whitespace=True, comment='#')
+        # Read all the observations (see iterObs to read them in chunks).
+        cache = None
+        if self.useCache:
+            cache = readMoCache(obsFile)
+        if cache is not None:
+            # The cached observations are already sorted by objId.
+            self.allObs = self._cacheFrame(cache[0])
+        else:
+            names, skiprows = self._readObsHeader(obsFile)
+            self.allObs = self._prepObs(pd.read_table(obsFile, delim_whitespace=True, comment='#',
+                                                      header=None, names=names, skiprows=skiprows))
+            if self.useCache:
+                self._writeCache(obsFile, self.allObs, indexCol='objId')
         self.obsFile = obsFile
+        self.subsetObs()
+
+    def cacheObs(self, obsFile, chunksize=1000000):
+        """Write the binary cache of obsFile (as readObs does), reading obsFile in chunks.
+
+        Unlike readObs, the observations are not all read into memory (and obsFile does not need to be
+        grouped by objId); see writeMoCacheChunks. The cache is not rewritten if it is already up to date.
+
+        Parameters
+        ----------
+        obsFile : str
+            The file containing the observation information.
+        chunksize : int, optional
+            The number of lines of obsFile to read at a time. Default 1000000.
+
+        Returns
+        -------
+        int
+            The number of observations in the cache.
+        """
+        cache = readMoCache(obsFile)
+        if cache is None:
+            writeMoCacheChunks(obsFile, lambda: self._readObsChunks(obsFile, chunksize), indexCol='objId')
+            cache = readMoCache(obsFile)
+        return cache[2][-1]
+
+    def _writeCache(self, filename, data, indexCol=None, readArgs=None):
+        """Write the binary cache of filename, warning (rather than failing) if it can't be written.
+        """
+        try:
+            writeMoCache(filename, data, indexCol=indexCol, readArgs=readArgs)
+        except (IOError, OSError) as e:
+            warnings.warn('Could not write the binary cache of %s: %s' % (filename, e))
+
+    def _cacheFrame(self, columns, start=None, end=None):
+        """Return a dataframe of (rows start:end of) the columns read from a binary cache.
+        """
+        frame = OrderedDict()
+        for col, values in columns.items():
+            values = values[start:end]
+            if values.dtype.kind == 'U':
+                # Strings are read from the text files as objects.
+                values = values.astype(object)
+            else:
+                values = np.array(values)
+            frame[col] = values
+        return pd.DataFrame(frame)
+
+    def _readObsHeader(self, obsFile):
+        """Return the column names from the header line of obsFile, and the number of rows to skip to the data.
+
+        The header line may start with a comment character (which pandas would otherwise skip).
+        """
+        with open(obsFile, 'r') as f:
+            header = f.readline()
+        names = header.lstrip('#').split()
+        skiprows = 0 if header.startswith('#') else 1
+        return names, skiprows
+
+    def _prepObs(self, obs):
+        """Standardize the columns of a dataframe of observations read from the obsFile.
+        """
         # We may have to rename the first column from '#objId' to 'objId'.
-        if self.allObs.columns.values[0].startswith('#'):
-            newcols = self.allObs.columns.values
+        if obs.columns.values[0].startswith('#'):
+            newcols = obs.columns.values
             newcols[0] = newcols[0].replace('#', '')
-            self.allObs.columns = newcols
-        if 'velocity' not in self.allObs.columns.values:
-            self.allObs['velocity'] = np.sqrt(self.allObs['dradt']**2 + self.allObs['ddecdt']**2)
-        if 'visitExpTime' not in self.allObs.columns.values:
-            self.allObs['visitExpTime'] = np.zeros(len(self.allObs['objId']), float) + 30.0
+            obs.columns = newcols
+        if 'velocity' not in obs.columns.values:
+            obs['velocity'] = np.sqrt(obs['dradt']**2 + obs['ddecdt']**2)
+        if 'visitExpTime' not in obs.columns.values:
+            obs['visitExpTime'] = np.zeros(len(obs['objId']), float) + 30.0
         # If we created intermediate data products by pandas, we may have an inadvertent 'index'
         #  column. Since this creates problems later, drop it here.
-        if 'index' in self.allObs.columns.values:
-            self.allObs.drop('index', axis=1, inplace=True)
-        self.subsetObs()
+        if 'index' in obs.columns.values:
+            obs.drop('index', axis=1, inplace=True)
+        return obs
+
+    def iterObs(self, pandasConstraint=None):
+        """Read the observations from obsFile in chunks, yielding the observations of each object in turn.
+
+        Only (about) self.obsChunksize observations are in memory at a time, as each object's observations
+        are yielded as soon as they have all been read. This requires the observations in obsFile to be
+        grouped by objId (as written by sims_movingObjects); a ValueError is raised if they are not.
+        If there is an up to date binary cache of obsFile (and self.useCache is True), the observations
+        are read from the cache instead, in which case they are always grouped by objId.
+        Objects without any (matching) observations are not returned.
+
+        Parameters
+        ----------
+        pandasConstraint : str, optional
+            A constraint to select a subset of the observations (as in subsetObs). Default None.
+
+        Yields
+        ------
+        int, dict
+            The index of the object in the orbits dataframe, and its slicePoint (as for iteration over the
+            slicer: a dict of the 'obs', 'orbit' and 'Hvals').
+        """
+        chunksize = self.obsChunksize
+        if chunksize is None:
+            chunksize = 1000000
+        cache = None
+        if self.useCache:
+            cache = readMoCache(self.obsFile)
+        if cache is not None:
+            chunks = self._cachedObsChunks(cache, chunksize)
+        else:
+            chunks = self._textObsChunks(chunksize)
+        orbitIds = self.orbits['objId'].values
+        stringIds = None
+        orbitIdx = None
+        done = set()
+        for chunk in chunks:
+            if orbitIdx is None:
+                stringIds = (chunk['objId'].dtype == 'object')
+                if stringIds:
+                    orbitIds = orbitIds.astype(str)
+                orbitIdx = dict([(objId, idx) for idx, objId in enumerate(orbitIds)])
+            if stringIds:
+                chunk['objId'] = chunk['objId'].astype(str)
+            for idx, obs in self._groupObs(chunk, orbitIdx, done, pandasConstraint):
+                yield idx, obs
+
+    def _readObsChunks(self, obsFile, chunksize):
+        """Read obsFile in chunks of chunksize lines, yielding dataframes of the observations.
+        """
+        names, skiprows = self._readObsHeader(obsFile)
+        reader = pd.read_table(obsFile, delim_whitespace=True, comment='#', header=None, names=names,
+                               skiprows=skiprows, chunksize=chunksize)
+        for chunk in reader:
+            yield self._prepObs(chunk)
+
+    def _textObsChunks(self, chunksize):
+        """Read obsFile in chunks of (about) chunksize lines, yielding dataframes of complete objects.
+        """
+        leftover = None
+        for chunk in self._readObsChunks(self.obsFile, chunksize):
+            if leftover is not None:
+                chunk = pd.concat([leftover, chunk], ignore_index=True)
+            # The observations of the last object in the chunk may continue in the next chunk.
+            others = (chunk['objId'].values != chunk['objId'].values[-1])
+            if others.any():
+                last = len(others) - np.argmax(others[::-1])
+            else:
+                last = 0
+            leftover = chunk.iloc[last:]
+            yield chunk.iloc[:last]
+        if leftover is not None:
+            yield leftover
+
+    def _cachedObsChunks(self, cache, chunksize):
+        """Read the binary cache of obsFile in chunks of (about) chunksize rows of complete objects.
+        """
+        columns, index, offsets = cache
+        nObs = offsets[-1]
+        start = 0
+        while start < nObs:
+            # Take whole objects, up to chunksize rows (but at least one object).
+            end = offsets[max(np.searchsorted(offsets, start + chunksize, side='right') - 1,
+                              np.searchsorted(offsets, start, side='right'))]
+            yield self._cacheFrame(columns, start, end)
+            start = end
+
+    def _groupObs(self, obs, orbitIdx, done, pandasConstraint):
+        """Split a dataframe of complete objects into the slicePoints of each object.
+        """
+        if len(obs) == 0:
+            return
+        objIds = obs['objId'].values
+        # The start of the observations of each object.
+        starts = np.concatenate([[0], np.where(objIds[1:] != objIds[:-1])[0] + 1])
+        for objId in objIds[starts]:
+            if objId in done:
+                raise ValueError('The observations in %s are not grouped by objId (found objId %s again);'
+                                 ' cannot read them in chunks.' % (self.obsFile, objId))
+            done.add(objId)
+        if pandasConstraint is not None:
+            obs = obs.query(pandasConstraint)
+        records = obs.to_records()
+        objIds = records['objId']
+        starts = np.concatenate([[0], np.where(objIds[1:] != objIds[:-1])[0] + 1, [len(records)]])
+        for start, end in zip(starts[:-1], starts[1:]):
+            if end == start:
+                continue
+            objId = objIds[start]
+            if objId not in orbitIdx:
+                continue
+            idx = orbitIdx[objId]
+            yield idx, self._slicePoint(idx, records[start:end])
 
     def subsetObs(self, pandasConstraint=None):
         """
@@ -112,32 +333,61 @@ class MoObjSlicer(BaseSlicer):
             self.obs = self.allObs
         else:
             self.obs = self.allObs.query(pandasConstraint)
+        # The observations are grouped by object (again) when they are next sliced.
+        self._obsRecords = None
+
+    def _indexObs(self):
+        """Group the observations (self.obs) by objId.
+
+        Sets self._obsRecords, a recarray of all of the observations sorted by objId,
+        and self._obsStart / self._obsEnd, the offsets of the observations of each orbit in self._obsRecords.
+        """
+        obsIds = self.obs['objId'].values
+        orbitIds = self.orbits['objId'].values
+        if obsIds.dtype == 'object':
+            # String ids (compare them as strings, as the query in earlier versions did).
+            obsIds = obsIds.astype(str)
+            orbitIds = orbitIds.astype(str)
+        # A stable sort, so the observations of each object stay in their original order.
+        order = np.argsort(obsIds, kind='mergesort')
+        sortedIds = obsIds[order]
+        self._obsRecords = self.obs.iloc[order].to_records()
+        self._obsStart = np.searchsorted(sortedIds, orbitIds, side='left')
+        self._obsEnd = np.searchsorted(sortedIds, orbitIds, side='right')
 
     def _sliceObs(self, idx):
         """Return the observations of a given ssoId.
 
-        For now this works for any ssoId; in the future, this might only work as ssoId is
-        progressively iterated through the series of ssoIds (so we can 'chunk' the reading).
+        The observations are sorted and grouped by objId once (the first time they are sliced),
+        so the observations for each object are a slice (not a copy) of a single recarray.
 
         Parameters
         ----------
         idx : integer
             The integer index of the particular SSO in the orbits dataframe.
         """
+        if getattr(self, 'obs', None) is None:
+            if self.obsChunksize is not None:
+                raise ValueError('The observations are streamed from %s (obsChunksize is set);'
+                                 ' use iterObs() to read them.' % (self.obsFile))
+            raise ValueError('No observations have been read (setupSlicer was called without an obsFile).')
+        if self._obsRecords is None:
+            self._indexObs()
+        # Find the matching observations.
+        return self._slicePoint(idx, self._obsRecords[self._obsStart[idx]:self._obsEnd[idx]])
+
+    def _slicePoint(self, idx, obs):
+        """Return the slicePoint for the object with index idx in the orbits dataframe and its observations.
+        """
         # Find the matching orbit.
         orb = self.orbits.iloc[idx]
-        # Find the matching observations.
-        if self.obs['objId'].dtype == 'object':
-            obs = self.obs.query('objId == "%s"' %(orb['objId']))
-        else:
-            obs = self.obs.query('objId == %d' %(orb['objId']))
         # Return the values for H to consider for metric.
         if self.Hrange is not None:
             Hvals = self.Hrange
         else:
             Hvals = np.array([orb['H']], float)
         # Note that ssoObs / obs is a recarray not Dataframe!
-        return {'obs': obs.to_records(),
+        return {'obs': obs,
                 'orbit': orb,
                 'Hvals': Hvals}
 
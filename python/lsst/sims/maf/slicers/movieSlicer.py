@@ -56,6 +56,11 @@ class MovieSlicer(BaseSlicer):
         self.binMin = binMin
         self.binMax = binMax
         self.binsize = binsize
+        # The bins are set without looking at the data if they are given explicitly, or by binMin/binMax
+        # (setupSlicer changes self.bins etc., so this is decided here, from the constructor arguments).
+        self._fixedBins = ((binsize is None and hasattr(bins, '__iter__')) or
+                           (binMin is not None and binMax is not None and
+                            (binsize is not None or bins is not None)))
         self.cumulative = cumulative
         if sliceColUnits is None:
             co = ColInfo()
@@ -139,6 +144,27 @@ class MovieSlicer(BaseSlicer):
                         'slicePoint':{'sid':islice, 'binLeft':self.bins[islice], 'binRight':self.bins[islice+1]}}
             setattr(self, '_sliceSimData', _sliceSimData)
 
+    @property
+    def canStream(self):
+        """True if the bins are set without needing the data."""
+        return self._fixedBins
+
+    def _chunkBins(self, simData):
+        """Sort a chunk of data on sliceCol, and find where each bin starts in the sorted data."""
+        simIdxs = np.argsort(simData[self.sliceColName])
+        simFieldsSorted = simData[self.sliceColName][simIdxs]
+        left = np.searchsorted(simFieldsSorted, self.bins[:-1], 'left')
+        left = np.concatenate((left, np.array([len(simIdxs),])))
+        return simIdxs, left
+
+    def sliceChunk(self, simData):
+        """Slice a chunk of data on sliceCol, using the bins set up from the first chunk."""
+        simIdxs, left = self._chunkBins(simData)
+        if self.cumulative:
+            # Each chunk adds to all of the (cumulative) slices whose right edge is beyond its data.
+            return [(i, simIdxs[0:left[i+1]]) for i in range(self.nslice) if left[i+1] > 0]
+        return [(i, simIdxs[left[i]:left[i+1]]) for i in range(self.nslice) if left[i+1] > left[i]]
+
     def __eq__(self, otherSlicer):
         """
         Evaluate if slicers are equivalent.
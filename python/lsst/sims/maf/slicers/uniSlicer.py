@@ -31,6 +31,16 @@ class UniSlicer(BaseSlicer):
                     'slicePoint':{'sid':islice}}
         setattr(self, '_sliceSimData', _sliceSimData)
 
+    @property
+    def canStream(self):
+        return True
+
+    def sliceChunk(self, simData):
+        """All of the data in the chunk belongs to the single slicePoint."""
+        if len(simData) == 0:
+            return []
+        return [(0, np.arange(len(simData)))]
+
     def __eq__(self, otherSlicer):
         """Evaluate if slicers are equivalent."""
         if isinstance(otherSlicer, UniSlicer):
@@ -46,16 +46,27 @@ class UserPointsSlicer(BaseSpatialSlicer):
     chipNames : array-like, optional
         List of chips to accept, if useCamera is True. This lets users turn 'on' only a subset of chips.
         Default 'all' - this uses all chips in the camera.
+    footprintMethod : str, optional
+        How to find the healpixels on the chips of each pointing, if useCamera is True:
+        'lsst' (evaluates the camera model for each pointing) or 'raster' (much faster, but approximates
+        the camera footprint with a raster; see BaseSpatialSlicer). Default 'lsst'.
+    cacheDir : str, optional
+        Directory in which to save (and look for) the slice membership calculated in setupSlicer,
+        so it can be reused when the same pointings are sliced again.
+        Default None (do not cache the slice membership on disk).
     """
     def __init__(self, ra, dec, lonCol='fieldRA', latCol='fieldDec', latLonDeg=True, verbose=True,
                  badval=-666, leafsize=100, radius=1.75,
                  useCamera=False, rotSkyPosColName='rotSkyPos', mjdColName='observationStartMJD',
-                 chipNames='all'):
+                 chipNames='all', footprintMethod='lsst',
+                 cacheDir=None):
         super(UserPointsSlicer, self).__init__(lonCol=lonCol, latCol=latCol, latLonDeg=latLonDeg,
                                                verbose=verbose,
                                                badval=badval, radius=radius, leafsize=leafsize,
                                                useCamera=useCamera, rotSkyPosColName=rotSkyPosColName,
-                                               mjdColName=mjdColName, chipNames=chipNames)
+                                               mjdColName=mjdColName, chipNames=chipNames,
+                                               footprintMethod=footprintMethod,
+                                               cacheDir=cacheDir)
         # check that ra and dec are iterable, if not, they are probably naked numbers, wrap in list
         if not hasattr(ra, '__iter__'):
             ra = [ra]
@@ -9,3 +9,5 @@ from .moStackers import *
 from .getColInfo import *
 from .m5OptimalStacker import *
 from .nFollowStacker import *
+from .lazyColumns import *
+from .stackerPlan import *
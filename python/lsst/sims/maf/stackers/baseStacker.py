@@ -57,6 +57,10 @@ class BaseStacker(with_metaclass(StackerRegistry, object)):
     """Base MAF Stacker: add columns generated at run-time to the simdata array."""
     # List of the names of the columns generated by the Stacker.
     colsAdded = []
+    # True if the values added to each row depend only on that row of simData (and not, for example,
+    # on the first visit or on a random sequence), so that running the stacker on chunks of simData
+    # gives the same results as running it on all of the data.
+    rowLocal = False
 
     def __init__(self):
         """
@@ -151,6 +155,11 @@ class BaseStacker(with_metaclass(StackerRegistry, object)):
         if override:
             cols_present = False
         # Run the method to calculate/add new data.
+        return self._calculate(simData, cols_present)
+
+    def _calculate(self, simData, cols_present=False):
+        """Fill the stacker columns (which must already exist in simData), using the _run method.
+        """
         try:
             return self._run(simData, cols_present)
         except TypeError:
@@ -86,6 +86,7 @@ class GalacticStacker(BaseStacker):
         Name of the Dec column. Default fieldDec.
     """
     colsAdded = ['gall', 'galb']
+    rowLocal = True
 
     def __init__(self, raCol='fieldRA', decCol='fieldDec', degrees=True):
         self.colsReq = [raCol, decCol]
@@ -127,6 +128,7 @@ class EclipticStacker(BaseStacker):
         Flag to subtract the sun's ecliptic longitude. Default False.
     """
     colsAdded = ['eclipLat', 'eclipLon']
+    rowLocal = True
 
     def __init__(self, mjdCol='observationStartMJD', raCol='fieldRA', decCol='fieldDec', degrees=True,
                  subtractSunLon=False):
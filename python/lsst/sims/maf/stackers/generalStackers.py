@@ -24,6 +24,7 @@ class FiveSigmaStacker(BaseStacker):
     or m5 was not previously calculated.
     """
     colsAdded = ['m5_simsUtils']
+    rowLocal = True
 
     def __init__(self, airmassCol='airmass', seeingCol='seeingFwhmEff', skybrightnessCol='skyBrightness',
                  filterCol='filter', exptimeCol='visitExposureTime'):
@@ -54,6 +55,7 @@ class NormAirmassStacker(BaseStacker):
     """Calculate the normalized airmass for each opsim pointing.
     """
     colsAdded = ['normairmass']
+    rowLocal = True
 
     def __init__(self, airmassCol='airmass', decCol='fieldDec',
                  degrees=True, telescope_lat = -30.2446388):
@@ -87,6 +89,7 @@ class ZenithDistStacker(BaseStacker):
     If 'degrees' is False, assumes altCol is in radians and returns radians.
     """
     colsAdded = ['zenithDistance']
+    rowLocal = True
 
     def __init__(self, altCol='altitude', degrees=True):
         self.altCol = altCol
@@ -113,6 +116,7 @@ class ParallaxFactorStacker(BaseStacker):
     """Calculate the parallax factors for each opsim pointing.  Output parallax factor in arcseconds.
     """
     colsAdded = ['ra_pi_amp', 'dec_pi_amp']
+    rowLocal = True
 
     def __init__(self, raCol='fieldRA', decCol='fieldDec', dateCol='observationStartMJD', degrees=True):
         self.raCol = raCol
@@ -201,6 +205,7 @@ class DcrStacker(BaseStacker):
         for each observation.  Also runs ZenithDistStacker and ParallacticAngleStacker.
     """
     colsAdded = ['ra_dcr_amp', 'dec_dcr_amp']  # zenithDist, HA, PA
+    rowLocal = True
 
     def __init__(self, filterCol='filter', altCol='altitude', degrees=True,
                  raCol='fieldRA', decCol='fieldDec', lstCol='observationStartLST',
@@ -259,6 +264,7 @@ class HourAngleStacker(BaseStacker):
     Always in HOURS.
     """
     colsAdded = ['HA']
+    rowLocal = True
 
     def __init__(self, lstCol='observationStartLST', raCol='fieldRA', degrees=True):
         self.units = ['Hours']
@@ -300,6 +306,7 @@ class ParallacticAngleStacker(BaseStacker):
     If 'degrees' is True, this will be in degrees (as are all other angles). If False, then in radians.
     """
     colsAdded = ['PA']
+    rowLocal = True
 
     def __init__(self, raCol='fieldRA', decCol='fieldDec', degrees=True, mjdCol='observationStartMJD',
                  lstCol='observationStartLST', site='LSST'):
@@ -340,6 +347,7 @@ class FilterColorStacker(BaseStacker):
     """Translate filters ('u', 'g', 'r' ..) into RGB tuples.
     """
     colsAdded = ['rRGB', 'gRGB', 'bRGB']
+    rowLocal = True
 
     def __init__(self, filterCol='filter'):
         self.filter_rgb_map = {'u': (0, 0, 1),   # dark blue
@@ -430,6 +438,7 @@ class OpSimFieldStacker(BaseStacker):
 
     """
     colsAdded = ['opsimFieldId']
+    rowLocal = True
 
     def __init__(self, raCol='fieldRA', decCol='fieldDec', degrees=True):
         self.colsReq = [raCol, decCol]
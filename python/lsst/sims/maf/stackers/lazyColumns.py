@@ -0,0 +1,146 @@
+from builtins import str
+import numpy as np
+
+__all__ = ['LazyColumnArray']
+
+
+class LazyColumnArray(np.ndarray):
+    """A numpy structured array where some (stacker) columns are only calculated when first accessed.
+
+    The columns must already be present in the dtype of the array (see StackerPlan.addColumns);
+    they are filled in the first time they are indexed by name (e.g. dataSlice['HA']), and the
+    calculated values are kept for later use.
+
+    Rows selected from a LazyColumnArray (e.g. simData[idxs], as passed to the metrics) are also
+    LazyColumnArrays: when a lazy column is indexed in the selection, it is calculated for the full
+    (parent) array and the relevant values are copied into the selection.
+    Sorting a LazyColumnArray in place calculates all of its remaining lazy columns first.
+    Operations which copy whole records without indexing columns by name (e.g. np.concatenate)
+    do not fill in the lazy columns; call `materialize` before using them.
+
+    A LazyColumnArray is created from a structured array using `LazyColumnArray.wrap`.
+    """
+    def __array_finalize__(self, obj):
+        # Arrays created by numpy from a LazyColumnArray (views, ufunc results, etc.)
+        # behave like normal arrays, unless set up by __getitem__ or copy.
+        self._source = None
+        self._rows = None
+        self._unfilled = None
+
+    @classmethod
+    def wrap(cls, simData, source):
+        """Wrap a structured array, so that the columns pending in source are calculated when accessed.
+
+        Parameters
+        ----------
+        simData : numpy.ndarray
+            The structured array, containing (unfilled) columns for the lazy columns.
+        source : object
+            The object which calculates the lazy columns. It must have a `pending` dictionary
+            (keyed by the lazy columns not yet calculated), a `lazyData` attribute (the wrapped array)
+            and a `calculateColumn(col)` method, which fills in col and removes it from `pending`.
+
+        Returns
+        -------
+        LazyColumnArray
+        """
+        lazyData = simData.view(cls)
+        lazyData._source = source
+        return lazyData
+
+    def _isRoot(self):
+        return self._source is not None and self._rows is None
+
+    def _pendingCols(self):
+        if self._source is None:
+            return set()
+        if self._rows is None:
+            return set(self._source.pending)
+        return self._unfilled
+
+    def _fill(self, cols):
+        """Fill in the lazy columns cols (if they have not been already).
+        """
+        if self._source is None:
+            return
+        for col in cols:
+            if self._rows is None:
+                if col in self._source.pending:
+                    self._source.calculateColumn(col)
+            elif col in self._unfilled:
+                root = self._source.lazyData
+                if col in self._source.pending:
+                    root._fill([col])
+                np.ndarray.__setitem__(self, col, np.ndarray.__getitem__(root, col)[self._rows])
+                self._unfilled.discard(col)
+                if len(self._unfilled) == 0:
+                    # Everything is calculated: behave like a normal array from here on.
+                    self._source = None
+
+    def materialize(self):
+        """Calculate all of the remaining lazy columns.
+        """
+        self._fill(list(self._pendingCols()))
+
+    def __getitem__(self, key):
+        if self._source is None:
+            result = np.ndarray.__getitem__(self, key)
+            if isinstance(result, LazyColumnArray) and result.dtype.names is None:
+                return result.view(np.ndarray)
+            return result
+        if isinstance(key, str):
+            self._fill([key])
+            return np.ndarray.__getitem__(self, key).view(np.ndarray)
+        if isinstance(key, list) and len(key) > 0 and all([isinstance(k, str) for k in key]):
+            self._fill(key)
+            return np.ndarray.__getitem__(self, key).view(np.ndarray)
+        result = np.ndarray.__getitem__(self, key)
+        if not isinstance(result, LazyColumnArray):
+            # A single record: fill everything, so that all of its values are available.
+            self.materialize()
+            return np.ndarray.__getitem__(self, key)
+        if result.dtype.names is None or result.ndim != 1:
+            return result.view(np.ndarray)
+        unfilled = self._pendingCols()
+        if len(unfilled) > 0:
+            # Keep track of which rows of the full array are in the selection.
+            result._source = self._source
+            result._unfilled = set(unfilled)
+            result._rows = self._rowIndex(key)
+        return result
+
+    def _rowIndex(self, key):
+        """The rows of the full (root) array selected by indexing this array with key.
+        """
+        if self._rows is not None:
+            return self._rows[key]
+        if isinstance(key, np.ndarray) and key.ndim == 1:
+            if key.dtype == bool:
+                return np.flatnonzero(key)
+            if np.issubdtype(key.dtype, np.integer):
+                return np.where(key < 0, key + len(self), key)
+        return np.arange(len(self))[key]
+
+    def __setitem__(self, key, value):
+        if self._source is not None and isinstance(key, str):
+            if self._rows is None:
+                self._source.pending.pop(key, None)
+            else:
+                self._unfilled.discard(key)
+        np.ndarray.__setitem__(self, key, value)
+
+    def copy(self, *args, **kwargs):
+        if self._isRoot():
+            # A copy of the full array is not tracked: fill in all of the lazy columns first.
+            self.materialize()
+        result = np.ndarray.copy(self, *args, **kwargs)
+        if self._source is not None and self._rows is not None:
+            result._source = self._source
+            result._unfilled = set(self._unfilled)
+            result._rows = self._rows.copy()
+        return result
+
+    def sort(self, *args, **kwargs):
+        # Sorting reorders the rows, so fill all of the lazy columns first.
+        self.materialize()
+        np.ndarray.sort(self, *args, **kwargs)
@@ -63,6 +63,7 @@ class M5OptimalStacker(BaseStacker):
         been if the observation had been taken on the meridian.
     """
     colsAdded = ['m5Optimal']
+    rowLocal = True
 
     def __init__(self, airmassCol='airmass', decCol='dec_rad',
                  skyBrightCol='filtSkyBrightness', seeingCol='FWHMeff',
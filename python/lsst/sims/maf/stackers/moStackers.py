@@ -23,6 +23,54 @@ class BaseMoStacker(BaseStacker):
         # columns anymore (for different H values).
         return self._run(ssoObs, Href, Hval)
 
+    def runH(self, ssoObs, Href, Hvals):
+        """Add the stacker columns for all of the H values in Hvals at once.
+
+        This is only available if the stacker implements _runH (see supportsH).
+
+        Parameters
+        ----------
+        ssoObs : np.ndarray
+            The observations of the object.
+        Href : float
+            The reference H value of the object (from its orbit).
+        Hvals : np.ndarray
+            The H values to calculate the columns for.
+
+        Returns
+        -------
+        np.ndarray, dict of np.ndarray
+            ssoObs (with the new columns which do not depend on H filled in), and the new columns
+            which depend on H, as (nObs x nH) arrays.
+        """
+        if len(ssoObs) == 0:
+            return ssoObs, {}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            ssoObs, cols_present = self._addStackerCols(ssoObs)
+        return self._runH(ssoObs, Href, np.asarray(Hvals))
+
+    def reseed(self, offset):
+        """Reset the random number generator of the stacker (if it uses one) to its seed plus offset.
+
+        MoMetricBundleGroup calls this at the start of each chunk of objects, with the index of the first
+        object in the chunk, so that the random values do not depend on how the objects are split up
+        between worker processes.
+        """
+        pass
+
+    def _runH(self, ssoObs, Href, Hvals):
+        raise NotImplementedError('This stacker does not support calculation for all H values at once.')
+
+    @property
+    def supportsH(self):
+        """True if this stacker implements _runH (for the same class which defines _run).
+        """
+        for klass in type(self).__mro__:
+            if '_run' in klass.__dict__:
+                return '_runH' in klass.__dict__
+        return False
+
 
 class MoMagStacker(BaseMoStacker):
     """Add columns relevant to SSobject apparent magnitudes and visibility to the slicer ssoObs
@@ -79,16 +127,36 @@ class MoMagStacker(BaseMoStacker):
         xval = np.power(10, 0.5 * (ssoObs['appMag'] - ssoObs[self.m5Col]))
         ssoObs['SNR'] = 1.0 / np.sqrt((0.04 - self.gamma) * xval + self.gamma * xval * xval)
         completeness = 1.0 / (1 + np.exp((ssoObs['appMag'] - ssoObs[self.m5Col])/self.sigma))
-        if not hasattr(self, '_rng'):
-            if self.randomSeed is not None:
-                self._rng = np.random.RandomState(self.randomSeed)
-            else:
-                self._rng = np.random.RandomState(734421)
-
-        probability = self._rng.random_sample(len(ssoObs['appMag']))
+        probability = self._getRng().random_sample(len(ssoObs['appMag']))
         ssoObs['vis'] = np.where(probability <= completeness, 1, 0)
         return ssoObs
 
+    def _runH(self, ssoObs, Href, Hvals):
+        # The same calculation as _run, for all H values at once (as nObs x nH arrays).
+        appMagV = (ssoObs[self.vMagCol] + ssoObs[self.lossCol])[:, np.newaxis] + Hvals - Href
+        appMag = (ssoObs[self.vMagCol] + ssoObs[self.colorCol] + ssoObs[self.lossCol])[:, np.newaxis] \
+            + Hvals - Href
+        m5 = ssoObs[self.m5Col][:, np.newaxis]
+        xval = np.power(10, 0.5 * (appMag - m5))
+        snr = 1.0 / np.sqrt((0.04 - self.gamma) * xval + self.gamma * xval * xval)
+        completeness = 1.0 / (1 + np.exp((appMag - m5)/self.sigma))
+        # Draw the random numbers in the same order as running _run for each H value in turn.
+        probability = self._getRng().random_sample((len(Hvals), len(ssoObs))).T
+        vis = np.where(probability <= completeness, 1, 0)
+        return ssoObs, {'appMagV': appMagV, 'appMag': appMag, 'SNR': snr, 'vis': vis}
+
+    def reseed(self, offset):
+        if self.randomSeed is not None:
+            seed = self.randomSeed
+        else:
+            seed = 734421
+        self._rng = np.random.RandomState(seed + offset)
+
+    def _getRng(self):
+        if not hasattr(self, '_rng'):
+            self.reseed(0)
+        return self._rng
+
 
 class EclStacker(BaseMoStacker):
     """
@@ -131,6 +199,10 @@ class EclStacker(BaseMoStacker):
         ssoObs['ecLon'] = ssoObs['ecLon'] % 360
         return ssoObs
 
+    def _runH(self, ssoObs, Href, Hvals):
+        # The ecliptic coordinates do not depend on H.
+        return self._run(ssoObs, Href, Href), {}
+
 
 class CometMagStacker(BaseMoStacker):
     """Add apparent magnitude using a cometary magnitude model.
@@ -169,4 +241,8 @@ class CometMagStacker(BaseMoStacker):
         m_v = Href + 5 * np.log10(delta) + (5 + 2.5 * self.k) * np.log10(rh)
 
         ssObs['cometV'] = m_v
-        return ssObs
\ No newline at end of file
+        return ssObs
+
+    def _runH(self, ssObs, Href, Hvals):
+        # The magnitudes only depend on Href.
+        return self._run(ssObs, Href, Href), {}
\ No newline at end of file
@@ -121,6 +121,7 @@ class NFollowStacker(BaseStacker):
         Flag whether RA/Dec are in degrees (True) or radians (False).
     """
     colsAdded = ['nObservatories']
+    rowLocal = True
 
     def __init__(self, minSize=3.0, airmassLimit=2.5, timeSteps=np.arange(0.5, 12., 3.0),
                  mjdCol='observationStartMJD', raCol='fieldRA', decCol='fieldDec', degrees=True):
@@ -8,6 +8,7 @@ __all__ = ['SdssRADecStacker']
 class SdssRADecStacker(BaseStacker):
     """convert the p1,p2,p3... columns to radians and wrap them """
     colsAdded = ['RA1', 'Dec1', 'RA2', 'Dec2', 'RA3', 'Dec3', 'RA4', 'Dec4']
+    rowLocal = True
 
     def __init__(self, pcols = ['p1','p2','p3','p4','p5','p6','p7','p8']):
         """ The p1,p2 columns represent the corners of chips.  Could generalize this a bit."""
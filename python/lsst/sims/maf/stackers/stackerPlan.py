@@ -0,0 +1,255 @@
+from builtins import zip
+from builtins import object
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .baseStacker import BaseStacker
+from .lazyColumns import LazyColumnArray
+
+__all__ = ['StackerPlan']
+
+
+class StackerPlan(object):
+    """Plan the stacker calculations for all of the compatible groups of metricBundles with one constraint.
+
+    All of the stacker columns are added to simData with a single allocation (addColumns).
+    Each compatible group then fills the columns for its stackers in place (run). Columns already
+    calculated by the same stacker, from the same input columns, for an earlier group are reused
+    rather than recalculated.
+
+    The stackers for each group are scheduled as a graph, using their colsReq and colsAdded:
+    a stacker runs after the stackers which add the columns it requires. If a required column is
+    neither in simData nor added by one of the group's stackers, a default instance of the stacker
+    which adds that column (from the StackerRegistry sourceDict) is added to the group.
+    Stackers which do not depend on each other can be run at the same time in a pool of threads.
+
+    If lazy is True, run does not calculate the stacker columns; instead simData is returned
+    as a LazyColumnArray, and each stacker is run (on all of simData) the first time one of its
+    columns is accessed, e.g. by a metric indexing dataSlice[col]. Stacker columns which
+    are never read are never calculated.
+
+    Parameters
+    ----------
+    stackerLists : list of list of lsst.sims.maf.stackers.BaseStacker
+        The stackers needed for each compatible group of metricBundles.
+        Stackers which are equal (even if they are different objects) are only run once.
+    nThreads : int, optional
+        The number of threads to use to run independent stackers. Default 1 (run serially).
+        Not used if lazy is True.
+    lazy : bool, optional
+        Calculate the stacker columns only when they are first accessed. Default False.
+    """
+    def __init__(self, stackerLists, nThreads=1, lazy=False):
+        # The unique stackers, and the index of the unique stacker equal to each stacker object.
+        self.stackers = []
+        self._stackerIndex = {}
+        # Default stackers added to provide missing columns, by class.
+        self._defaults = {}
+        self.stackerLists = []
+        for stackerList in stackerLists:
+            self.stackerLists.append([self._findStacker(stacker) for stacker in stackerList])
+        if nThreads is None:
+            nThreads = 1
+        self.nThreads = nThreads
+        self.lazy = lazy
+        # The lazy columns not yet calculated (and the index of the stacker which calculates them).
+        self.pending = {}
+        self.lazyData = None
+        self._dbCols = None
+        self._versions = {}
+        self._producers = {}
+        self._nRuns = 0
+
+    def _findStacker(self, stacker):
+        """Return the index of the unique stacker equal to this stacker (adding it if new).
+        """
+        if id(stacker) in self._stackerIndex:
+            return self._stackerIndex[id(stacker)][1]
+        for i, s in enumerate(self.stackers):
+            if s is stacker or (s.__class__ == stacker.__class__ and s == stacker):
+                break
+        else:
+            self.stackers.append(stacker)
+            i = len(self.stackers) - 1
+        # Keep a reference to the stacker, so its id is not reused while it is in the index.
+        self._stackerIndex[id(stacker)] = (stacker, i)
+        return i
+
+    def addColumns(self, simData):
+        """Add all of the stacker columns to simData, in a single new array.
+
+        Parameters
+        ----------
+        simData : numpy.ndarray
+            The simulated data, as queried from the database.
+
+        Returns
+        -------
+        numpy.ndarray
+            The simulated data, with (unfilled) columns for all of the stackers.
+        """
+        self._dbCols = set(simData.dtype.names)
+        # Add any upstream stackers that are needed, so that their columns are allocated too.
+        for indexes in self.stackerLists:
+            self._schedule(indexes)
+        newdtype = simData.dtype.descr
+        newcols = []
+        for stacker in self.stackers:
+            dtypes = getattr(stacker, 'colsAddedDtypes', None)
+            if dtypes is None:
+                dtypes = [float for col in stacker.colsAdded]
+            for col, dtype in zip(stacker.colsAdded, dtypes):
+                if col in simData.dtype.names:
+                    warnings.warn('Warning - column %s already present in simData, may be overwritten '
+                                  '(depending on stacker).' % (col))
+                elif col not in newcols:
+                    newdtype += [(col, dtype)]
+                    newcols.append(col)
+        # Nothing has been calculated yet.
+        self._versions = {}
+        self._producers = {}
+        if len(newcols) == 0:
+            return simData
+        newData = np.empty(simData.shape, dtype=newdtype)
+        for col in simData.dtype.names:
+            newData[col] = simData[col]
+        return newData
+
+    def run(self, simData, stackerList):
+        """Fill in the columns for the stackers of one compatible group.
+
+        Parameters
+        ----------
+        simData : numpy.ndarray
+            The simulated data, after addColumns.
+        stackerList : list of lsst.sims.maf.stackers.BaseStacker
+            The stackers for this compatible group.
+
+        Returns
+        -------
+        numpy.ndarray
+            The simulated data, with the stacker columns for this group filled in
+            (or a LazyColumnArray, which fills them in when accessed, if lazy is True).
+        """
+        if len(simData) == 0:
+            return simData
+        if self._dbCols is None:
+            self._dbCols = set(simData.dtype.names)
+        if self.lazy:
+            # Columns which were not needed by the previous group have not been calculated.
+            for col in self.pending:
+                self._versions.pop(col, None)
+                self._producers.pop(col, None)
+            self.pending = {}
+            simData = simData.view(np.ndarray)
+        indexes = [self._findStacker(stacker) for stacker in stackerList]
+        for level in self._schedule(indexes):
+            # Skip stackers whose columns were already calculated from the current inputs.
+            toRun = []
+            for i in level:
+                inputs = tuple([self._versions.get(col, 0) for col in self.stackers[i].colsReq])
+                if not all([self._producers.get(col) == (i, inputs) for col in self.stackers[i].colsAdded]):
+                    toRun.append((i, inputs))
+            if self.lazy:
+                for i, inputs in toRun:
+                    for col in self.stackers[i].colsAdded:
+                        self.pending[col] = i
+                results = [simData for run in toRun]
+            elif self.nThreads > 1 and len(toRun) > 1:
+                # The stackers in one level are independent, and fill different columns of simData.
+                with ThreadPoolExecutor(max_workers=self.nThreads) as executor:
+                    results = list(executor.map(lambda run: self._runStacker(simData, run[0]), toRun))
+            else:
+                results = [self._runStacker(simData, i) for i, inputs in toRun]
+            for (i, inputs), result in zip(toRun, results):
+                if result is not simData:
+                    # The stacker returned a new array: copy its columns back into simData.
+                    for col in self.stackers[i].colsAdded:
+                        simData[col] = result[col]
+                # Record which stacker calculated these columns, from which versions of its input columns.
+                self._nRuns += 1
+                for col in self.stackers[i].colsAdded:
+                    self._versions[col] = self._nRuns
+                    self._producers[col] = (i, inputs)
+        if self.lazy and len(self.pending) > 0:
+            self.lazyData = LazyColumnArray.wrap(simData, self)
+            return self.lazyData
+        return simData
+
+    def calculateColumn(self, col):
+        """Calculate a lazy column (and the other columns added by the same stacker) in lazyData.
+
+        Parameters
+        ----------
+        col : str
+            The name of the column.
+        """
+        i = self.pending[col]
+        for c in self.stackers[i].colsAdded:
+            self.pending.pop(c, None)
+        # Columns required by this stacker are calculated as the stacker accesses them.
+        result = self._runStacker(self.lazyData, i)
+        if result is not self.lazyData:
+            for c in self.stackers[i].colsAdded:
+                self.lazyData[c] = result[c]
+
+    def _runStacker(self, simData, i):
+        """Calculate the columns for unique stacker i.
+        """
+        return self.stackers[i]._calculate(simData, False)
+
+    def _schedule(self, indexes):
+        """Order a group of stackers into levels, where each stacker only depends on earlier levels.
+
+        Stackers which add columns required by the group's stackers (and missing from the database data)
+        are added to the group (and to self.stackers) as needed.
+
+        Parameters
+        ----------
+        indexes : list of int
+            The indexes (in self.stackers) of the stackers in the group.
+
+        Returns
+        -------
+        list of list of int
+            The indexes of the stackers to run at each level.
+        """
+        indexes = [i for n, i in enumerate(indexes) if i not in indexes[:n]]
+        # Find the stacker in the group which adds each column.
+        producers = {}
+        for i in indexes:
+            for col in self.stackers[i].colsAdded:
+                producers.setdefault(col, i)
+        # Add default stackers for any required columns which are not available.
+        n = 0
+        while n < len(indexes):
+            for col in self.stackers[indexes[n]].colsReq:
+                if col in producers or col in self._dbCols or col not in BaseStacker.sourceDict:
+                    continue
+                stackerClass = BaseStacker.sourceDict[col]
+                if stackerClass not in self._defaults:
+                    self._defaults[stackerClass] = stackerClass()
+                j = self._findStacker(self._defaults[stackerClass])
+                if j not in indexes:
+                    indexes.append(j)
+                for c in self.stackers[j].colsAdded:
+                    producers.setdefault(c, j)
+            n += 1
+        # Each stacker depends on the (other) stackers which add its required columns.
+        depends = {}
+        for i in indexes:
+            depends[i] = set([producers[col] for col in self.stackers[i].colsReq
+                              if col in producers and producers[col] != i])
+        levels = []
+        done = set()
+        remaining = list(indexes)
+        while len(remaining) > 0:
+            level = [i for i in remaining if depends[i].issubset(done)]
+            if len(level) == 0:
+                warnings.warn('Stackers %s depend on each other; running them in the order given.'
+                              % ([self.stackers[i].__class__.__name__ for i in remaining]))
+                level = remaining
+            levels.append(level)
+            done.update(level)
+            remaining = [i for i in remaining if i not in done]
+        return levels
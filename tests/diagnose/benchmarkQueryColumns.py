@@ -0,0 +1,41 @@
+from __future__ import print_function
+import argparse
+import time
+import numpy as np
+import lsst.sims.maf.db as db
+
+# Compare the time taken by Database.query_columns to fetch data through the sqlalchemy ORM (the default)
+# and through the DB-API cursor (columnar=True), and check that both return the same data.
+# Usage: python benchmarkQueryColumns.py opsimDb.db --colnames observationStartMJD fieldRA fieldDec filter
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the columnar path of Database.query_columns.')
+    parser.add_argument('dbFile', type=str, help='Sqlite database file.')
+    parser.add_argument('--tableName', type=str, default='SummaryAllProps', help='Table to query.')
+    parser.add_argument('--colnames', type=str, nargs='+',
+                        default=['observationStartMJD', 'fieldRA', 'fieldDec', 'night', 'filter', 'airmass'],
+                        help='Columns to query.')
+    parser.add_argument('--sqlconstraint', type=str, default=None, help='Sql constraint for the query.')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='Rows converted at a time.')
+    parser.add_argument('--nRepeat', type=int, default=3, help='Number of times to repeat each query.')
+    args = parser.parse_args()
+
+    database = db.Database(args.dbFile)
+    times = {}
+    data = {}
+    for columnar in (False, True):
+        times[columnar] = []
+        for i in range(args.nRepeat):
+            t = time.time()
+            data[columnar] = database.query_columns(args.tableName, colnames=args.colnames,
+                                                    sqlconstraint=args.sqlconstraint,
+                                                    chunksize=args.chunksize, columnar=columnar)
+            times[columnar].append(time.time() - t)
+    database.close()
+
+    for col in args.colnames:
+        np.testing.assert_array_equal(data[False][col], data[True][col])
+    print('Fetched %d rows of %d columns from %s' % (len(data[True]), len(args.colnames), args.tableName))
+    for columnar, label in ((False, 'sqlalchemy'), (True, 'columnar')):
+        print('%s: best %.3fs, mean %.3fs' % (label, np.min(times[columnar]), np.mean(times[columnar])))
+    print('Speedup of columnar path: %.2f' % (np.min(times[False]) / np.min(times[True])))
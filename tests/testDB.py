@@ -2,6 +2,7 @@ import matplotlib
 matplotlib.use("Agg")
 import os
 import unittest
+import numpy as np
 import lsst.sims.maf.db as db
 import lsst.utils.tests
 from lsst.sims.utils.CodeUtilities import sims_clean_up
@@ -50,6 +51,67 @@ class TestDb(unittest.TestCase):
         self.assertRaises(IOError, db.Database, 'thisdatabasedoesntexist_sqlite.db')
 
 
+    def testLazyReflection(self):
+        """Test that table schemas are only reflected when the table is used."""
+        basedb = db.Database(database=self.database, driver=self.driver)
+        self.assertIn('Field', basedb.tables)
+        self.assertNotIn('Field', basedb.connection.metadata.tables)
+        self.assertIn('fieldId', basedb.columnNames['Field'])
+        basedb.query_columns('Field', colnames=['fieldId'], numLimit=3)
+        self.assertIn('Field', basedb.connection.metadata.tables)
+        self.assertNotIn('Proposal', basedb.connection.metadata.tables)
+        basedb.close()
+
+    def testQueryColumnar(self):
+        """Test the columnar query path returns the same data as the sqlalchemy path."""
+        basedb = db.Database(database=self.database, driver=self.driver)
+        colnames = ['observationId', 'observationStartMJD', 'filter', 'fieldRA']
+        for sqlconstraint, chunksize in (('night < 10', 1000000), ('filter = "r"', 1000), ('night < 0', 100)):
+            orm = basedb.query_columns('SummaryAllProps', colnames=colnames, sqlconstraint=sqlconstraint,
+                                       chunksize=chunksize, columnar=False)
+            columnar = basedb.query_columns('SummaryAllProps', colnames=colnames,
+                                            sqlconstraint=sqlconstraint, chunksize=chunksize, columnar=True)
+            self.assertIsInstance(columnar, np.recarray)
+            self.assertEqual(orm.dtype, columnar.dtype)
+            for col in colnames:
+                np.testing.assert_array_equal(orm[col], columnar[col])
+        basedb.close()
+
+    def testIterColumns(self):
+        """Test iterating over chunks of a query returns all of the data, in order."""
+        basedb = db.Database(database=self.database, driver=self.driver)
+        colnames = ['observationId', 'observationStartMJD', 'filter']
+        expected = basedb.query_columns('SummaryAllProps', colnames=colnames, sqlconstraint='night < 30')
+        for columnar in (True, False):
+            chunks = list(basedb.iterColumns('SummaryAllProps', colnames=colnames, sqlconstraint='night < 30',
+                                             orderBy='observationStartMJD', chunksize=100,
+                                             columnar=columnar))
+            self.assertTrue(all([len(chunk) <= 100 for chunk in chunks]))
+            data = np.concatenate(chunks)
+            self.assertEqual(len(data), len(expected))
+            self.assertTrue(np.all(np.diff(data['observationStartMJD']) >= 0))
+            np.testing.assert_array_equal(np.sort(data['observationId']), np.sort(expected['observationId']))
+        basedb.close()
+
+    def testSqlConstraint(self):
+        """Test evaluating sql constraints in memory matches the database."""
+        basedb = db.Database(database=self.database, driver=self.driver)
+        colnames = ['filter', 'night', 'fieldDec', 'proposalId']
+        data = basedb.query_columns('SummaryAllProps', colnames=colnames)
+        for constraint in ['filter = "r"', "filter='g' and night < 100", 'night % 7 = 2 or fieldDec > -10',
+                           'filter in ("u", "y") and not (proposalId = 1)', 'night between 5 and 10',
+                           'night/2 = 3', '']:
+            sqlconstraint = db.SqlConstraint(constraint, columns=basedb.columnNames['SummaryAllProps'])
+            expected = basedb.query_columns('SummaryAllProps', colnames=colnames, sqlconstraint=constraint)
+            selected = data[sqlconstraint(data)]
+            self.assertEqual(len(selected), len(expected))
+        # Constraints which can't be evaluated in memory should raise a ValueError.
+        for constraint in ['abs(fieldDec) < 10', 'filter like "r"', 'notAColumn > 1']:
+            with self.assertRaises(ValueError):
+                db.SqlConstraint(constraint, columns=basedb.columnNames['SummaryAllProps'])
+        basedb.close()
+
+
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
 
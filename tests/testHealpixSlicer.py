@@ -5,8 +5,12 @@ import numpy as np
 import numpy.lib.recfunctions as rfn
 import numpy.ma as ma
 import unittest
+import os
+import tempfile
+import shutil
 import healpy as hp
 from lsst.sims.maf.slicers.healpixSlicer import HealpixSlicer
+import lsst.sims.utils as simsUtils
 import lsst.utils.tests
 
 
@@ -189,6 +193,42 @@ class TestHealpixSlicerSlicing(unittest.TestCase):
                 sidxs = np.sort(sidxs)
                 np.testing.assert_equal(self.dv['testdata'][didxs], self.dv['testdata'][sidxs])
 
+    def testSliceIndexCSR(self):
+        """Test the precomputed slice membership matches querying the tree at each slicePoint."""
+        self.assertIsNone(self.testslicer.sliceIndexCSR)
+        self.testslicer.setupSlicer(self.dv)
+        indptr, indices = self.testslicer.sliceIndexCSR
+        self.assertEqual(len(indptr), self.testslicer.nslice + 1)
+        self.assertEqual(len(indices), indptr[-1])
+        for i, s in enumerate(self.testslicer):
+            sx, sy, sz = simsUtils._xyz_from_ra_dec(s['slicePoint']['ra'], s['slicePoint']['dec'])
+            tidxs = self.testslicer.opsimtree.query_ball_point((sx, sy, sz), self.testslicer.rad)
+            np.testing.assert_equal(np.sort(tidxs), indices[indptr[i]:indptr[i + 1]])
+            np.testing.assert_equal(s['idxs'], indices[indptr[i]:indptr[i + 1]])
+
+    def testSliceCache(self):
+        """Test the slice membership can be saved to and restored from the cache directory."""
+        cacheDir = tempfile.mkdtemp(prefix='TMB')
+        try:
+            slicer1 = HealpixSlicer(nside=self.nside, verbose=False, lonCol='ra', latCol='dec',
+                                    latLonDeg=False, radius=self.radius, cacheDir=cacheDir)
+            slicer1.setupSlicer(self.dv)
+            self.assertEqual(len(os.listdir(cacheDir)), 1)
+            slicer2 = HealpixSlicer(nside=self.nside, verbose=False, lonCol='ra', latCol='dec',
+                                    latLonDeg=False, radius=self.radius, cacheDir=cacheDir)
+            slicer2.setupSlicer(self.dv)
+            # The cached membership was used, so no tree was built.
+            self.assertFalse(hasattr(slicer2, 'opsimtree'))
+            for s1, s2 in zip(slicer1, slicer2):
+                np.testing.assert_equal(s1['idxs'], s2['idxs'])
+            # A different radius should not reuse the cached membership.
+            slicer3 = HealpixSlicer(nside=self.nside, verbose=False, lonCol='ra', latCol='dec',
+                                    latLonDeg=False, radius=self.radius / 2., cacheDir=cacheDir)
+            slicer3.setupSlicer(self.dv)
+            self.assertEqual(len(os.listdir(cacheDir)), 2)
+        finally:
+            shutil.rmtree(cacheDir)
+
 
 class TestHealpixChipGap(unittest.TestCase):
     # Note that this is really testing baseSpatialSlicer, as slicing is done there for healpix grid
@@ -227,6 +267,26 @@ class TestHealpixChipGap(unittest.TestCase):
                 for indx in sidxs:
                     self.assertIn(self.dv['testdata'][indx], self.dv['testdata'][didxs])
 
+    def testFootprintMethods(self):
+        """Test the raster footprint matches the per-pointing camera footprint calculation."""
+        self.assertEqual(self.testslicer.footprintMethod, 'lsst')
+        self.testslicer.setupSlicer(self.dv)
+        rasterslicer = HealpixSlicer(nside=self.nside, verbose=False,
+                                     lonCol='ra', latCol='dec', latLonDeg=False,
+                                     radius=self.radius, useCamera=True,
+                                     chipNames=['R:1,1 S:1,1'], footprintMethod='raster')
+        rasterslicer.setupSlicer(self.dv)
+        nMatch = 0
+        nRef = 0
+        for s, r in zip(rasterslicer, self.testslicer):
+            nRef += len(r['idxs'])
+            nMatch += len(np.intersect1d(s['idxs'], r['idxs']))
+            for idx, chipName in zip(s['idxs'], s['slicePoint']['chipNames']):
+                self.assertEqual(chipName, 'R:1,1 S:1,1')
+        # The raster is an approximation: allow for small differences at the edges of the chip.
+        self.assertGreater(nMatch, 0.95 * nRef)
+        self.assertLess(np.sum(np.diff(rasterslicer.sliceIndexCSR[0])), 1.05 * nRef)
+
 
 class TestHealpixSlicerPlotting(unittest.TestCase):
 
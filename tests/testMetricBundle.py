@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import matplotlib
 matplotlib.use("Agg")
 
@@ -10,6 +11,8 @@ import lsst.sims.maf.metricBundles as metricBundles
 import lsst.sims.maf.db as db
 import glob
 import os
+import sqlite3
+import warnings
 import tempfile
 import shutil
 import lsst.utils.tests
@@ -17,6 +20,31 @@ from lsst.utils import getPackageDir
 from lsst.sims.utils.CodeUtilities import sims_clean_up
 
 
+def makeMultiProposalDb(filename, nvisits=300):
+    """Write a small opsim v4-like database, where SummaryAllProps has a row for each proposal of a visit.
+
+    Every visit is part of proposal 1, and two thirds of the visits are also part of proposal 3.
+    """
+    rng = np.random.RandomState(44)
+    conn = sqlite3.connect(filename)
+    conn.execute('CREATE TABLE ObsHistory (observationId INTEGER PRIMARY KEY, observationStartMJD REAL, '
+                 'night INTEGER, filter TEXT, airmass REAL)')
+    conn.execute('CREATE TABLE ObsProposalHistory (propHistId INTEGER PRIMARY KEY, Proposal_propId INTEGER, '
+                 'ObsHistory_observationId INTEGER)')
+    propHistId = 0
+    for i in range(nvisits):
+        conn.execute('INSERT INTO ObsHistory VALUES (?, ?, ?, ?, ?)',
+                     (i, 60000. + i * 0.01, i // 20, 'ugrizy'[i % 6], 1. + rng.rand()))
+        for propId in ((1, 3) if i % 3 else (1,)):
+            conn.execute('INSERT INTO ObsProposalHistory VALUES (?, ?, ?)', (propHistId, propId, i))
+            propHistId += 1
+    conn.execute('CREATE VIEW SummaryAllProps AS SELECT o.*, p.Proposal_propId AS proposalId '
+                 'FROM ObsHistory o JOIN ObsProposalHistory p '
+                 'ON p.ObsHistory_observationId = o.observationId')
+    conn.commit()
+    conn.close()
+
+
 class TestMetricBundle(unittest.TestCase):
 
     @classmethod
@@ -63,6 +91,222 @@ class TestMetricBundle(unittest.TestCase):
         assert(len(outPdf) == 3)
         assert(len(outNpz) == 1)
 
+    def testParallel(self):
+        """
+        Check that calculating metric values with worker processes matches the serial calculation.
+        """
+        rng = np.random.RandomState(42)
+        nvisits = 5000
+        simData = np.zeros(nvisits, dtype=list(zip(['fieldRA', 'fieldDec', 'airmass'], [float] * 3)))
+        simData['fieldRA'] = rng.rand(nvisits) * 360.
+        simData['fieldDec'] = np.degrees(np.arcsin(rng.rand(nvisits) * 2. - 1.))
+        simData['airmass'] = rng.rand(nvisits) + 1.
+        metricValues = []
+        # Mean and Count implement runBulk; without useBulk they are calculated in the worker processes.
+        for nWorkers, useBulk in ((None, True), (3, True), (3, False)):
+            slicer = slicers.HealpixSlicer(nside=8, verbose=False)
+            bundles = {'mean': metricBundles.MetricBundle(metrics.MeanMetric(col='airmass'), slicer, ''),
+                       'count': metricBundles.MetricBundle(metrics.CountMetric(col='airmass'), slicer, '')}
+            bgroup = metricBundles.MetricBundleGroup(bundles, None, outDir=self.outDir,
+                                                     saveEarly=False, verbose=False, useBulk=useBulk)
+            bgroup.setCurrent('')
+            bgroup.runCurrent('', simData=simData, nWorkers=nWorkers)
+            metricValues.append(bundles)
+        for parallelBundles in metricValues[1:]:
+            for key in ('mean', 'count'):
+                serial = metricValues[0][key].metricValues
+                parallel = parallelBundles[key].metricValues
+                np.testing.assert_array_equal(serial.mask, parallel.mask)
+                np.testing.assert_allclose(serial.compressed(), parallel.compressed(), rtol=1e-12)
+
+    def testBulk(self):
+        """
+        Check that the metric values calculated with runBulk match those calculated at each slicepoint.
+        """
+        rng = np.random.RandomState(45)
+        nvisits = 500
+        names = ['fieldRA', 'fieldDec', 'airmass', 'fiveSigmaDepth']
+        simData = np.zeros(nvisits, dtype=list(zip(names, [float] * 4)))
+        # Only part of the sky is covered, so some slicepoints have no data.
+        simData['fieldRA'] = rng.rand(nvisits) * 90.
+        simData['fieldDec'] = np.degrees(np.arcsin(rng.rand(nvisits) - 1.))
+        simData['airmass'] = rng.rand(nvisits) + 1.
+        simData['fiveSigmaDepth'] = rng.rand(nvisits) + 24.
+        metricValues = []
+        for useBulk in (True, False):
+            slicer = slicers.HealpixSlicer(nside=16, verbose=False)
+            metricList = [metrics.Coaddm5Metric(), metrics.CountMetric(col='airmass'),
+                          metrics.MeanMetric(col='airmass'), metrics.MedianMetric(col='airmass'),
+                          metrics.SumMetric(col='airmass'), metrics.FracAboveMetric(col='airmass', cutoff=1.5)]
+            self.assertTrue(all([metric.supportsBulk for metric in metricList]))
+            bundles = dict([(metric.name, metricBundles.MetricBundle(metric, slicer, ''))
+                            for metric in metricList])
+            bgroup = metricBundles.MetricBundleGroup(bundles, None, outDir=self.outDir,
+                                                     saveEarly=False, verbose=False, useBulk=useBulk)
+            bgroup.setCurrent('')
+            bgroup.runCurrent('', simData=simData)
+            metricValues.append(bundles)
+        bulkBundles, loopBundles = metricValues
+        self.assertEqual(len(bulkBundles), 6)
+        for key in bulkBundles:
+            bulk = bulkBundles[key].metricValues
+            loop = loopBundles[key].metricValues
+            np.testing.assert_array_equal(bulk.mask, loop.mask)
+            np.testing.assert_allclose(bulk.compressed(), loop.compressed(), rtol=1e-12)
+        self.assertTrue(np.any(bulkBundles['Count airmass'].metricValues.mask))
+        self.assertFalse(np.all(bulkBundles['Count airmass'].metricValues.mask))
+
+    def testSliceCache(self):
+        """
+        Check that reusing metric values from the slice cache matches calculating every slicepoint.
+        """
+        rng = np.random.RandomState(43)
+        nvisits = 300
+        simData = np.zeros(nvisits, dtype=list(zip(['fieldRA', 'fieldDec', 'airmass'], [float] * 3)))
+        # Only a few distinct pointings, so many healpixels see the same set of visits.
+        simData['fieldRA'] = rng.choice([10., 50., 90.], size=nvisits)
+        simData['fieldDec'] = rng.choice([-30., -60.], size=nvisits)
+        simData['airmass'] = rng.rand(nvisits) + 1.
+        metricValues = []
+        for useCache, cacheBytes in ((False, None), (True, None), (True, 100)):
+            slicer = slicers.HealpixSlicer(nside=16, verbose=False, useCache=useCache)
+            bundle = metricBundles.MetricBundle(metrics.RmsMetric(col='airmass'), slicer, '')
+            bgroup = metricBundles.MetricBundleGroup({'rms': bundle}, None, outDir=self.outDir,
+                                                     saveEarly=False, verbose=False, cacheBytes=cacheBytes)
+            bgroup.setCurrent('')
+            bgroup.runCurrent('', simData=simData)
+            metricValues.append(bundle.metricValues)
+        for mv in metricValues[1:]:
+            np.testing.assert_array_equal(metricValues[0].mask, mv.mask)
+            np.testing.assert_array_equal(metricValues[0].compressed(), mv.compressed())
+
+    def testSharedQueries(self):
+        """
+        Check that selecting the data for each constraint from a shared query matches separate queries.
+        """
+        database = os.path.join(getPackageDir('sims_data'), 'OpSimData', 'astro-lsst-01_2014.db')
+        opsdb = db.OpsimDatabaseV4(database=database)
+        constraints = ['filter="r"', 'filter = "g" and night < 100', 'night between 10 and 20',
+                       'abs(fieldDec) < 10']
+        results = []
+        for shareQueries in (False, True):
+            bundles = {}
+            for i, constraint in enumerate(constraints):
+                bundles[i] = metricBundles.MetricBundle(metrics.MeanMetric(col='airmass'),
+                                                        slicers.UniSlicer(), constraint)
+            bgroup = metricBundles.MetricBundleGroup(bundles, opsdb, outDir=self.outDir,
+                                                     saveEarly=False, verbose=False,
+                                                     shareQueries=shareQueries)
+            bgroup.runAll()
+            results.append(bundles)
+        opsdb.close()
+        for i in range(len(constraints)):
+            np.testing.assert_almost_equal(results[0][i].metricValues.compressed(),
+                                           results[1][i].metricValues.compressed())
+
+    def testSharedQueriesMultiProposal(self):
+        """
+        Check that shared queries keep all of the visits matching a proposalId constraint,
+        when there is a row for each proposal of a visit.
+        """
+        database = os.path.join(self.outDir, 'multiprop.db')
+        makeMultiProposalDb(database, nvisits=300)
+        opsdb = db.OpsimDatabaseV4(database=database)
+        constraints = ['proposalId = 3', 'filter = "r"', 'proposalId = 1 and night < 5', 'night > 10']
+        results = []
+        for shareQueries in (False, True):
+            bundles = {}
+            for i, constraint in enumerate(constraints):
+                countMetric = metrics.CountMetric(col='observationStartMJD')
+                bundles[(i, 'count')] = metricBundles.MetricBundle(countMetric, slicers.UniSlicer(),
+                                                                   constraint)
+                bundles[(i, 'mean')] = metricBundles.MetricBundle(metrics.MeanMetric(col='airmass'),
+                                                                  slicers.UniSlicer(), constraint)
+            bgroup = metricBundles.MetricBundleGroup(bundles, opsdb, outDir=self.outDir,
+                                                     saveEarly=False, verbose=False,
+                                                     shareQueries=shareQueries)
+            bgroup.runAll()
+            results.append(bundles)
+        opsdb.close()
+        # Two thirds of the visits are part of proposal 3.
+        self.assertEqual(results[1][(0, 'count')].metricValues[0], 200)
+        for key in results[0]:
+            np.testing.assert_almost_equal(results[0][key].metricValues.compressed(),
+                                           results[1][key].metricValues.compressed())
+
+    def testStreaming(self):
+        """
+        Check that calculating metric values from data streamed in chunks matches using all of the data.
+        """
+        database = os.path.join(getPackageDir('sims_data'), 'OpSimData', 'astro-lsst-01_2014.db')
+        opsdb = db.OpsimDatabaseV4(database=database)
+        results = []
+        for chunksize in (None, 500):
+            bundles = {'count': metricBundles.MetricBundle(metrics.CountMetric(col='night'),
+                                                           slicers.OneDSlicer(sliceColName='night',
+                                                                              bins=np.arange(0, 40, 5)),
+                                                           'night < 30'),
+                       'mean': metricBundles.MetricBundle(metrics.MeanMetric(col='airmass'),
+                                                          slicers.UniSlicer(), 'night < 30')}
+            bgroup = metricBundles.MetricBundleGroup(bundles, opsdb, outDir=self.outDir,
+                                                     saveEarly=False, verbose=False)
+            bgroup.runAll(chunksize=chunksize)
+            results.append(bundles)
+        opsdb.close()
+        for key in ('count', 'mean'):
+            np.testing.assert_array_equal(results[0][key].metricValues.mask, results[1][key].metricValues.mask)
+            np.testing.assert_almost_equal(results[0][key].metricValues.compressed(),
+                                           results[1][key].metricValues.compressed())
+
+    def testStreamingStackers(self):
+        """
+        Check that data is not streamed when a stacker does not calculate each row independently.
+        """
+        database = os.path.join(getPackageDir('sims_data'), 'OpSimData', 'astro-lsst-01_2014.db')
+        opsdb = db.OpsimDatabaseV4(database=database)
+        results = []
+        for chunksize in (None, 500):
+            stacker = stackers.RandomDitherPerNightStacker(randomSeed=42)
+            metric = metrics.MeanMetric(col='randomDitherPerNightRa')
+            bundle = metricBundles.MetricBundle(metric, slicers.UniSlicer(), 'night < 30',
+                                                stackerList=[stacker])
+            bgroup = metricBundles.MetricBundleGroup({'mean': bundle}, opsdb, outDir=self.outDir,
+                                                     saveEarly=False, verbose=False)
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                bgroup.runAll(chunksize=chunksize)
+            if chunksize is not None:
+                self.assertTrue(any(['RandomDitherPerNightStacker' in str(wi.message) for wi in w]))
+            results.append(bundle.metricValues)
+        opsdb.close()
+        np.testing.assert_almost_equal(results[0].compressed(), results[1].compressed())
+
+    def testStackerPlanReset(self):
+        """
+        Check that the stacker plan of one runCurrent is not reused for later data.
+        """
+        rng = np.random.RandomState(46)
+        nvisits = 100
+        simData = np.zeros(nvisits, dtype=list(zip(['fieldRA', 'fieldDec', 'airmass'], [float] * 3)))
+        simData['fieldRA'] = rng.rand(nvisits) * 360.
+        simData['fieldDec'] = rng.rand(nvisits) * -60.
+        simData['airmass'] = rng.rand(nvisits) + 1.
+        bundle = metricBundles.MetricBundle(metrics.MeanMetric(col='normairmass'), slicers.UniSlicer(), '',
+                                            stackerList=[stackers.NormAirmassStacker()])
+        bgroup = metricBundles.MetricBundleGroup({'mean': bundle}, None, outDir=self.outDir,
+                                                 saveEarly=False, verbose=False)
+        bgroup.setCurrent('')
+        bgroup.runCurrent('', simData=simData)
+        self.assertIsNone(bgroup.stackerPlan)
+        expected = bundle.metricValues.compressed()
+        # New data, without the stacker columns, run through a compatible list directly.
+        bgroup.simData = simData[:50]
+        bgroup._runCompatible(['mean'])
+        self.assertIn('normairmass', bgroup.simData.dtype.names)
+        self.assertIsNone(bgroup.stackerPlan)
+        self.assertAlmostEqual(bundle.metricValues.compressed()[0], np.mean(bgroup.simData['normairmass']))
+        self.assertNotEqual(bundle.metricValues.compressed()[0], expected[0])
+
     def tearDown(self):
         if os.path.isdir(self.outDir):
             shutil.rmtree(self.outDir)
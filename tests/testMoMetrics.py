@@ -1,6 +1,7 @@
 import numpy as np
 import unittest
 import lsst.sims.maf.metrics as metrics
+import lsst.sims.maf.stackers as stackers
 
 
 class TestMoMetrics1(unittest.TestCase):
@@ -287,5 +288,77 @@ class TestKnownObjectMetrics(unittest.TestCase):
         self.assertEqual(mVal, knownObjectMetric.badval)
 
 
+
+class TestMoMetricsH(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(4213)
+        times = np.sort(rng.rand(60) * 30)
+        ssoObs = np.recarray([len(times)], dtype=([('observationStartMJD', '<f8'), ('night', '<f8'),
+                                                   ('magV', '<f8'), ('dmagColor', '<f8'), ('dmagDetect', '<f8'),
+                                                   ('fiveSigmaDepth', '<f8')]))
+        ssoObs['observationStartMJD'] = times
+        ssoObs['night'] = np.floor(times)
+        ssoObs['magV'] = 20.0 + rng.rand(len(times)) * 3
+        ssoObs['dmagColor'] = -0.2
+        ssoObs['dmagDetect'] = rng.rand(len(times)) * 0.1
+        ssoObs['fiveSigmaDepth'] = 23.5 + rng.rand(len(times))
+        self.ssoObs = ssoObs
+        self.orb = np.recarray([1], dtype=([('H', '<f8')]))[0]
+        self.orb['H'] = 18.0
+        self.Hvals = np.arange(14, 24, 0.25)
+
+    def _obsH(self):
+        """Return the observations with the stacker columns for each H value, and for all H values at once."""
+        stacker = stackers.MoMagStacker(randomSeed=42)
+        obsH = [stacker.run(self.ssoObs.copy(), self.orb['H'], Hval).copy() for Hval in self.Hvals]
+        stackerH = stackers.MoMagStacker(randomSeed=42)
+        self.assertTrue(stackerH.supportsH)
+        ssoObs, Hcols = stackerH.runH(self.ssoObs.copy(), self.orb['H'], self.Hvals)
+        return obsH, ssoObs, Hcols
+
+    def testMoMagStackerH(self):
+        obsH, ssoObs, Hcols = self._obsH()
+        for col in ['appMagV', 'appMag', 'SNR', 'vis']:
+            self.assertEqual(Hcols[col].shape, (len(self.ssoObs), len(self.Hvals)))
+            for j in range(len(self.Hvals)):
+                np.testing.assert_array_equal(Hcols[col][:, j], obsH[j][col])
+        self.assertTrue(stackers.EclStacker().supportsH)
+
+    def testMetricsH(self):
+        obsH, ssoObs, Hcols = self._obsH()
+        metricList = [metrics.NObsMetric(snrLimit=5), metrics.NObsMetric(),
+                      metrics.NNightsMetric(snrLimit=5), metrics.NNightsMetric(),
+                      metrics.ObsArcMetric(snrLimit=5), metrics.ObsArcMetric()]
+        for metric in metricList:
+            self.assertTrue(metric.supportsH)
+            valuesH = metric.runH(ssoObs, self.orb, self.Hvals, Hcols)
+            values = [metric.run(obsH[j], self.orb, Hval) for j, Hval in enumerate(self.Hvals)]
+            np.testing.assert_array_equal(valuesH, values)
+            # The faintest objects are not seen at all.
+            self.assertEqual(values[-1], 0)
+            self.assertGreater(values[0], 0)
+        # A metric which does not implement runH.
+        self.assertFalse(metrics.NObsNoSinglesMetric().supportsH)
+
+    def testDiscoveryMetricH(self):
+        obsH, ssoObs, Hcols = self._obsH()
+        for snrLimit in [5, None]:
+            discMetric = metrics.DiscoveryMetric(nObsPerNight=1, tMin=0, nNightsPerWindow=3, tWindow=5,
+                                                 snrLimit=snrLimit)
+            self.assertTrue(discMetric.supportsH)
+            valuesH = discMetric.runH(ssoObs, self.orb, self.Hvals, Hcols)
+            self.assertEqual(len(valuesH), len(self.Hvals))
+            for j, Hval in enumerate(self.Hvals):
+                value = discMetric.run(obsH[j], self.orb, Hval)
+                if value == discMetric.badval:
+                    self.assertEqual(valuesH[j], discMetric.badval)
+                else:
+                    for key in value:
+                        np.testing.assert_array_equal(valuesH[j][key], value[key])
+            self.assertNotEqual(valuesH[0], discMetric.badval)
+            self.assertEqual(valuesH[-1], discMetric.badval)
+
+
 if __name__ == "__main__":
     unittest.main()
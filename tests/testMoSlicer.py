@@ -0,0 +1,243 @@
+import matplotlib
+matplotlib.use("Agg")
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from lsst.sims.maf.slicers import MoObjSlicer, moCacheDir, readMoCache
+import lsst.sims.maf.metrics as metrics
+import lsst.sims.maf.metricBundles as mmb
+import lsst.utils.tests
+
+
+def makeMoFiles(outDir, nSso=5, nObsPerSso=12, randomSeed=42, grouped=False):
+    """Write a small orbit file and a matching observation file to outDir.
+
+    The observations are in random order, unless grouped is True (then they are grouped by objId).
+    Object 3 has no observations. Returns the names of the orbit and observation files.
+    """
+    rng = np.random.RandomState(randomSeed)
+    orbitFile = os.path.join(outDir, 'orbits.txt')
+    with open(orbitFile, 'w') as f:
+        f.write('objId q e inc Omega argPeri tPeri epoch H g sed_filename\n')
+        for i in range(nSso):
+            f.write('%d %f %f %f %f %f %f %f %f %f %s\n' % (i, 1.0 + 0.1 * i, 0.1, 5.0, 10.0, 20.0,
+                                                             59000.0, 59000.0, 18.0 + i, 0.15,
+                                                             'C.dat'))
+    obs = []
+    for i in range(nSso):
+        if i == 3:
+            continue
+        for j in range(nObsPerSso):
+            obs.append((i, 59580.0 + j * 1.1 + i * 0.01, rng.rand(), rng.rand(), 20.0 + rng.rand(),
+                        24.0 + rng.rand(), int(j * 1.1), 0.1, 0.05))
+    if grouped:
+        order = np.arange(len(obs))
+    else:
+        order = rng.permutation(len(obs))
+    obsFile = os.path.join(outDir, 'obs.txt')
+    with open(obsFile, 'w') as f:
+        f.write('#objId observationStartMJD dradt ddecdt magV fiveSigmaDepth night dmagColor dmagDetect\n')
+        for k in order:
+            f.write('%d %f %f %f %f %f %d %f %f\n' % obs[k])
+    return orbitFile, obsFile
+
+
+class TestMoObjSlicer(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='moSlicer')
+        self.orbitFile, self.obsFile = makeMoFiles(self.outDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir)
+
+    def testSliceObs(self):
+        """Test the observations of each object are found, in their original order."""
+        slicer = MoObjSlicer(Hrange=np.arange(15, 20, 0.5))
+        slicer.setupSlicer(self.orbitFile, obsFile=self.obsFile)
+        self.assertEqual(slicer.nSso, 5)
+        for i, slicePoint in enumerate(slicer):
+            objId = slicer.orbits['objId'].iloc[i]
+            expected = slicer.obs.query('objId == %d' % (objId)).to_records()
+            self.assertEqual(len(slicePoint['obs']), len(expected))
+            np.testing.assert_array_equal(slicePoint['obs'], expected)
+            np.testing.assert_array_equal(slicePoint['Hvals'], slicer.Hrange)
+        self.assertEqual(len(slicer[3]['obs']), 0)
+        # Subsetting the observations regroups them.
+        slicer.subsetObs('night < 5')
+        for i in range(slicer.nSso):
+            obs = slicer[i]['obs']
+            self.assertTrue(np.all(obs['night'] < 5))
+            self.assertTrue(np.all(obs['objId'] == slicer.orbits['objId'].iloc[i]))
+
+    def testIterObs(self):
+        """Test streaming the observations in chunks matches reading them all at once."""
+        groupedDir = os.path.join(self.outDir, 'grouped')
+        os.makedirs(groupedDir)
+        orbitFile, obsFile = makeMoFiles(groupedDir, grouped=True)
+        slicer = MoObjSlicer()
+        slicer.setupSlicer(orbitFile, obsFile=obsFile)
+        slicer.subsetObs('night < 8')
+        # Stream the observations from the text file and from the binary cache (written by slicer).
+        for useCache in [False, True]:
+            for chunksize in [1, 5, 100]:
+                streamSlicer = MoObjSlicer()
+                streamSlicer.setupSlicer(orbitFile, obsFile=obsFile, obsChunksize=chunksize,
+                                         useCache=useCache)
+                self.assertIsNone(streamSlicer.allObs)
+                idxs = []
+                for i, slicePoint in streamSlicer.iterObs('night < 8'):
+                    idxs.append(i)
+                    np.testing.assert_array_equal(slicePoint['obs']['observationStartMJD'],
+                                                  slicer[i]['obs']['observationStartMJD'])
+                self.assertEqual(idxs, [0, 1, 2, 4])
+                # The streamed observations can't be sliced by index.
+                with self.assertRaises(ValueError):
+                    streamSlicer[0]
+                with self.assertRaises(ValueError):
+                    next(iter(streamSlicer))
+        # Observations which are not grouped by objId can't be streamed (from the text file).
+        streamSlicer = MoObjSlicer()
+        streamSlicer.setupSlicer(self.orbitFile, obsFile=self.obsFile, obsChunksize=5, useCache=False)
+        with self.assertRaises(ValueError):
+            list(streamSlicer.iterObs())
+
+    def testCache(self):
+        """Test the binary caches of the orbit and observation files are written, reused and refreshed."""
+        slicer = MoObjSlicer(Hrange=np.arange(15, 20, 0.5))
+        slicer.setupSlicer(self.orbitFile, obsFile=self.obsFile, useCache=False)
+        self.assertFalse(os.path.isdir(moCacheDir(self.obsFile)))
+        cacheSlicer = MoObjSlicer(Hrange=np.arange(15, 20, 0.5))
+        cacheSlicer.setupSlicer(self.orbitFile, obsFile=self.obsFile)
+        self.assertTrue(os.path.isdir(moCacheDir(self.orbitFile)))
+        columns, objIds, offsets = readMoCache(self.obsFile)
+        np.testing.assert_array_equal(objIds, [0, 1, 2, 4])
+        np.testing.assert_array_equal(offsets, [0, 12, 24, 36, 48])
+        # Read the files again, this time from the caches.
+        for i in range(2):
+            self.assertEqual(list(cacheSlicer.orbits.columns), list(slicer.orbits.columns))
+            np.testing.assert_array_equal(cacheSlicer.orbits['q'], slicer.orbits['q'])
+            self.assertEqual(list(cacheSlicer.orbits['sed_filename']), list(slicer.orbits['sed_filename']))
+            self.assertEqual(sorted(cacheSlicer.allObs.columns), sorted(slicer.allObs.columns))
+            for idx in range(slicer.nSso):
+                np.testing.assert_array_equal(cacheSlicer[idx]['obs']['observationStartMJD'],
+                                              slicer[idx]['obs']['observationStartMJD'])
+            cacheSlicer = MoObjSlicer(Hrange=np.arange(15, 20, 0.5))
+            cacheSlicer.setupSlicer(self.orbitFile, obsFile=self.obsFile)
+        # Changing the observation file invalidates its cache.
+        with open(self.obsFile, 'a') as f:
+            f.write('4 59600.0 0.1 0.1 20.0 24.0 30 0.1 0.05\n')
+        self.assertIsNone(readMoCache(self.obsFile))
+        cacheSlicer = MoObjSlicer()
+        cacheSlicer.setupSlicer(self.orbitFile, obsFile=self.obsFile)
+        self.assertEqual(len(cacheSlicer[4]['obs']), 13)
+        self.assertEqual(readMoCache(self.obsFile)[2][-1], 49)
+
+    def testCacheChunks(self):
+        """Test building the observation cache in chunks matches caching all of the observations at once."""
+        slicer = MoObjSlicer()
+        slicer.setupSlicer(self.orbitFile, obsFile=self.obsFile)
+        columns, objIds, offsets = readMoCache(self.obsFile, mmap=False)
+        for chunksize in [1, 7, 1000]:
+            shutil.rmtree(moCacheDir(self.obsFile))
+            self.assertEqual(slicer.cacheObs(self.obsFile, chunksize=chunksize), 48)
+            chunkColumns, chunkObjIds, chunkOffsets = readMoCache(self.obsFile)
+            self.assertEqual(list(chunkColumns.keys()), list(columns.keys()))
+            for col in columns:
+                self.assertEqual(chunkColumns[col].dtype, columns[col].dtype)
+                np.testing.assert_array_equal(chunkColumns[col], columns[col])
+            np.testing.assert_array_equal(chunkObjIds, objIds)
+            np.testing.assert_array_equal(chunkOffsets, offsets)
+        # The streamed observations are read from the new cache.
+        streamSlicer = MoObjSlicer()
+        streamSlicer.setupSlicer(self.orbitFile, obsFile=self.obsFile, obsChunksize=5)
+        for i, slicePoint in streamSlicer.iterObs():
+            np.testing.assert_array_equal(slicePoint['obs']['observationStartMJD'],
+                                          slicer[i]['obs']['observationStartMJD'])
+
+
+class TestMoMetricBundleGroup(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='moBundleGroup')
+        self.orbitFile, self.obsFile = makeMoFiles(self.outDir, nSso=11, randomSeed=7)
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir)
+
+    def testParallel(self):
+        """Test calculating the metric values with worker processes matches the serial calculation."""
+        metricValues = []
+        for nWorkers in (None, 2, 3):
+            slicer = MoObjSlicer(Hrange=np.arange(16, 26, 1.0))
+            slicer.setupSlicer(self.orbitFile, obsFile=self.obsFile, useCache=False)
+            # The metrics use the (random) visibility 'vis', which must not depend on the number of workers.
+            discovery = metrics.DiscoveryMetric(nObsPerNight=1, tMin=0)
+            childMetrics = dict([(cName, discovery.childMetrics[cName]) for cName in ['N_Chances', 'Time']])
+            bundles = {'nobs': mmb.MoMetricBundle(metrics.NObsMetric(), slicer, None),
+                       'discovery': mmb.MoMetricBundle(discovery, slicer, None, childMetrics=childMetrics)}
+            bgroup = mmb.MoMetricBundleGroup(bundles, outDir=os.path.join(self.outDir, '%s' % nWorkers),
+                                             verbose=False, objectChunkSize=2)
+            bgroup.runAll(nWorkers=nWorkers)
+            metricValues.append(bundles)
+        serialBundles = metricValues[0]
+        for parallelBundles in metricValues[1:]:
+            for key in serialBundles:
+                pairs = [(serialBundles[key], parallelBundles[key])]
+                for cName in serialBundles[key].childBundles:
+                    pairs.append((serialBundles[key].childBundles[cName],
+                                  parallelBundles[key].childBundles[cName]))
+                for serial, parallel in pairs:
+                    self.assertEqual(serial.metricValues.shape, (11, 10))
+                    np.testing.assert_array_equal(serial.metricValues.mask, parallel.metricValues.mask)
+                    if serial.metricValues.dtype != object:
+                        np.testing.assert_array_equal(serial.metricValues.compressed(),
+                                                      parallel.metricValues.compressed())
+            # Object 3 has no observations.
+            self.assertTrue(np.all(parallelBundles['nobs'].metricValues.mask[3]))
+            self.assertFalse(np.all(parallelBundles['nobs'].metricValues.mask))
+        # Some of the objects are only visible in some of their observations.
+        nobs = serialBundles['nobs'].metricValues.compressed()
+        self.assertTrue(np.any((nobs > 0) & (nobs < 12)))
+
+    def testVectorH(self):
+        """Test calculating the metric values for all H values at once matches running each H value."""
+        metricValues = []
+        for vectorH in (False, True):
+            slicer = MoObjSlicer(Hrange=np.arange(16, 26, 0.5))
+            slicer.setupSlicer(self.orbitFile, obsFile=self.obsFile, useCache=False)
+            discovery = metrics.DiscoveryMetric(nObsPerNight=1, tMin=0)
+            childMetrics = dict([(cName, discovery.childMetrics[cName]) for cName in ['N_Chances', 'Time']])
+            bundles = {'nobs': mmb.MoMetricBundle(metrics.NObsMetric(), slicer, None),
+                       'nobsNoSingles': mmb.MoMetricBundle(metrics.NObsNoSinglesMetric(), slicer, None),
+                       'discovery': mmb.MoMetricBundle(discovery, slicer, None, childMetrics=childMetrics)}
+            bgroup = mmb.MoMetricBundleGroup(bundles, outDir=os.path.join(self.outDir, '%s' % vectorH),
+                                             verbose=False, vectorH=vectorH)
+            bgroup.runAll()
+            metricValues.append(bundles)
+        loopBundles, vectorBundles = metricValues
+        for key in loopBundles:
+            pairs = [(loopBundles[key], vectorBundles[key])]
+            for cName in loopBundles[key].childBundles:
+                pairs.append((loopBundles[key].childBundles[cName], vectorBundles[key].childBundles[cName]))
+            for loop, vector in pairs:
+                np.testing.assert_array_equal(loop.metricValues.mask, vector.metricValues.mask)
+                if loop.metricValues.dtype != object:
+                    np.testing.assert_array_equal(loop.metricValues.compressed(), vector.metricValues.compressed())
+        self.assertTrue(np.any(vectorBundles['nobs'].metricValues.mask[:, -1]))
+        self.assertFalse(np.any(vectorBundles['nobs'].metricValues.mask[:, 0][[0, 1, 2, 4]]))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
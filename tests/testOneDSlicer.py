@@ -138,6 +138,22 @@ class TestOneDSlicerSetup(unittest.TestCase):
         bins = optimalBins(dv['testdata'])
         np.testing.assert_equal(self.testslicer.nslice, bins)
 
+    def testCanStream(self):
+        """Test the slicer can only stream data if its bins don't depend on the data."""
+        dv = makeDataValues(100, 0, 1, random=2235)
+        for kwargs, canStream in (({}, False), ({'bins': 10}, False), ({'binsize': 0.1}, False),
+                                  ({'bins': np.arange(0, 1.1, 0.1)}, True),
+                                  ({'bins': np.arange(0, 1.1, 0.1), 'binsize': 0.1}, False),
+                                  ({'binMin': 0, 'binMax': 1, 'bins': 10}, True),
+                                  ({'binMin': 0, 'binMax': 1, 'binsize': 0.1}, True)):
+            self.testslicer = OneDSlicer(sliceColName='testdata', **kwargs)
+            self.assertEqual(self.testslicer.canStream, canStream)
+            # Bins calculated from earlier data don't make the slicer streamable.
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                self.testslicer.setupSlicer(dv)
+            self.assertEqual(self.testslicer.canStream, canStream)
+
 
 class TestOneDSlicerIteration(unittest.TestCase):
 
@@ -2,6 +2,12 @@ import matplotlib
 matplotlib.use("Agg")
 import os
 import unittest
+import tempfile
+import shutil
+import sqlite3
+import warnings
+import numpy as np
+from sqlalchemy.engine import reflection
 import lsst.sims.maf.db as db
 import lsst.utils.tests
 from lsst.utils import getPackageDir
@@ -38,6 +44,137 @@ class TestOpsimDb(unittest.TestCase):
         self.assertEqual(data.dtype.names, ('seeingFwhmEff',))
         self.assertLessEqual(data['seeingFwhmEff'].max(), 1.0)
 
+    def testOpsimDbGroupBy(self):
+        """Test grouping by MJD in numpy matches the sql GROUP BY."""
+        cols = ['observationStartMJD', 'night', 'filter']
+        for sqlconstraint in ['filter = "r" and night < 100', '']:
+            expected = self.oo.query_columns(self.oo.defaultTable, colnames=cols, sqlconstraint=sqlconstraint,
+                                             groupBy='observationStartMJD')
+            data = self.oo.fetchMetricData(cols, sqlconstraint)
+            np.testing.assert_array_equal(data['observationStartMJD'], expected['observationStartMJD'])
+            # The MJD column is not returned, unless it was requested.
+            data = self.oo.fetchMetricData(['night'], sqlconstraint)
+            self.assertEqual(data.dtype.names, ('night',))
+            self.assertEqual(len(data), len(expected))
+        # Each visit is only counted once, but every visit for a proposal is kept.
+        data = self.oo.fetchMetricData(['observationStartMJD', 'proposalId'], 'proposalId = 3')
+        self.assertTrue(np.all(data['proposalId'] == 3))
+        expected = self.oo.query_columns(self.oo.defaultTable, colnames=['observationStartMJD'],
+                                         sqlconstraint='proposalId = 3', groupBy='observationStartMJD')
+        np.testing.assert_array_equal(data['observationStartMJD'], expected['observationStartMJD'])
+
+    def testOpsimDbColumnCache(self):
+        """Test fetching metric data through the column cache matches querying the database."""
+        cacheDir = tempfile.mkdtemp(prefix='colcache')
+        try:
+            cached = db.OpsimDatabaseV4(database=self.database, cacheDir=cacheDir)
+            cols = ['observationStartMJD', 'night', 'filter', 'fieldRA']
+            for sqlconstraint in ['filter = "r" and night < 100', '', 'abs(fieldDec) < 10']:
+                expected = self.oo.fetchMetricData(cols, sqlconstraint)
+                # Once to fill the cache, and once to read from it.
+                for i in range(2):
+                    data = cached.fetchMetricData(cols, sqlconstraint)
+                    self.assertEqual(data.dtype, expected.dtype)
+                    self.assertEqual(len(data), len(expected))
+                    np.testing.assert_array_equal(data['observationStartMJD'], expected['observationStartMJD'])
+                    np.testing.assert_array_equal(data['night'], expected['night'])
+            # Adding a column to the cache later must keep it aligned with the cached columns.
+            expected = self.oo.fetchMetricData(cols + ['fieldDec'], 'night < 100')
+            data = cached.fetchMetricData(cols + ['fieldDec'], 'night < 100')
+            for col in ['observationStartMJD', 'fieldDec']:
+                np.testing.assert_array_equal(data[col], expected[col])
+            # The cache was used (SummaryAllProps is a view in opsim v4 outputs).
+            self.assertEqual(cached._cacheDisabled, {})
+            self.assertEqual(len(os.listdir(cacheDir)), 1)
+            cacheFiles = os.listdir(os.path.join(cacheDir, os.listdir(cacheDir)[0]))
+            self.assertIn('SummaryAllProps.observationId.npy', cacheFiles)
+            self.assertIn('SummaryAllProps.fieldDec.npy', cacheFiles)
+            cached.close()
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def testOpsimDbEnsureIndexes(self):
+        """Test adding indexes for constraints does not change the metric data."""
+        tmpDir = tempfile.mkdtemp(prefix='opsimIndexes')
+        try:
+            dbCopy = os.path.join(tmpDir, os.path.basename(self.database))
+            shutil.copyfile(self.database, dbCopy)
+            opsdb = db.OpsimDatabaseV4(database=dbCopy)
+            cols = ['observationStartMJD', 'night', 'filter']
+            constraints = ['filter = "r" and night < 100', 'night < 10', '']
+            expected = [self.oo.fetchMetricData(cols, c) for c in constraints]
+            # By default, the indexes are added to a copy of the database.
+            mtime = os.stat(dbCopy).st_mtime
+            indexed = opsdb.ensureIndexes(constraints, localCopy=os.path.join(tmpDir, 'indexed.db'),
+                                          verbose=False)
+            self.assertIsNot(indexed, opsdb)
+            self.assertEqual(os.stat(dbCopy).st_mtime, mtime)
+            self.assertEqual(indexed.indexTimes, {})
+            self.assertIsNone(indexed.indexCopyDir)
+            indexed.close()
+            # Without a localCopy, the copy is made in a temporary directory, which the caller removes.
+            indexed = opsdb.ensureIndexes(constraints, verbose=False)
+            self.assertTrue(os.path.isfile(os.path.join(indexed.indexCopyDir, os.path.basename(dbCopy))))
+            indexed.close()
+            shutil.rmtree(indexed.indexCopyDir)
+            # The copy is writable, so the indexes can be added in place.
+            indexed = opsdb.ensureIndexes(constraints, inPlace=True, timeQueries=True, verbose=False)
+            self.assertIs(indexed, opsdb)
+            self.assertEqual(set(indexed.indexTimes.keys()), set(constraints))
+            checkDb = db.Database(dbCopy)
+            if opsdb.defaultTable in checkDb._inspector.get_view_names():
+                # Views can't be indexed, so the index is on the table the visit columns come from.
+                indexes = checkDb._inspector.get_indexes('ObsHistory')
+            else:
+                indexes = checkDb._inspector.get_indexes(opsdb.defaultTable)
+            checkDb.close()
+            self.assertIn(['filter', 'night', 'observationStartMJD'], [i['column_names'] for i in indexes])
+            for c, e in zip(constraints, expected):
+                np.testing.assert_array_equal(indexed.fetchMetricData(cols, c), e)
+            # The database now has the indexes, so it is not copied again.
+            againFile = os.path.join(tmpDir, 'again.db')
+            self.assertIs(opsdb.ensureIndexes(constraints, localCopy=againFile, verbose=False), opsdb)
+            self.assertFalse(os.path.exists(againFile))
+            opsdb.close()
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testOpsimDbEnsureIndexesView(self):
+        """Test adding indexes for constraints on a view indexes the tables of the view."""
+        tmpDir = tempfile.mkdtemp(prefix='opsimIndexes')
+        try:
+            dbFile = os.path.join(tmpDir, 'view.db')
+            conn = sqlite3.connect(dbFile)
+            conn.execute('CREATE TABLE ObsHistory (observationId INTEGER PRIMARY KEY, '
+                         'observationStartMJD REAL, night INTEGER, filter TEXT)')
+            conn.execute('CREATE TABLE ObsProposalHistory (propHistId INTEGER PRIMARY KEY, '
+                         'Proposal_propId INTEGER, ObsHistory_observationId INTEGER)')
+            for i in range(100):
+                conn.execute('INSERT INTO ObsHistory VALUES (?, ?, ?, ?)', (i, 60000. + i * 0.01, i // 10,
+                                                                            'ugrizy'[i % 6]))
+                conn.execute('INSERT INTO ObsProposalHistory VALUES (?, ?, ?)', (i, 1 + i % 2, i))
+            conn.execute('CREATE VIEW SummaryAllProps AS SELECT o.*, p.Proposal_propId AS proposalId '
+                         'FROM ObsHistory o JOIN ObsProposalHistory p '
+                         'ON p.ObsHistory_observationId = o.observationId')
+            conn.commit()
+            conn.close()
+            opsdb = db.OpsimDatabaseV4(database=dbFile)
+            cols = ['observationStartMJD', 'night']
+            constraints = ['filter = "r" and night < 5', 'proposalId = 2']
+            expected = [opsdb.fetchMetricData(cols, c) for c in constraints]
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                indexed = opsdb.ensureIndexes(constraints, inPlace=True, verbose=False)
+            # There is no table with a proposalId column to index.
+            self.assertTrue(any(['proposalId' in str(wi.message) for wi in w]))
+            indexes = reflection.Inspector.from_engine(indexed.connection.engine).get_indexes('ObsHistory')
+            self.assertIn(['filter', 'night', 'observationStartMJD'], [i['column_names'] for i in indexes])
+            for c, e in zip(constraints, expected):
+                np.testing.assert_array_equal(indexed.fetchMetricData(cols, c), e)
+            opsdb.close()
+        finally:
+            shutil.rmtree(tmpDir)
+
     def testOpsimDbPropID(self):
         """Test queries for prop ID"""
         propids, propTags = self.oo.fetchPropInfo()
@@ -60,6 +60,14 @@ class TestResultsDb(unittest.TestCase):
         self.assertEqual(metricId, metricId2)
         run1 = resultsDb.session.query(db.MetricRow).filter_by(metricId=metricId).all()
         self.assertEqual(len(run1), 1)
+        # The metricId is also found when the database is reopened.
+        resultsDb.close()
+        resultsDb = db.ResultsDb(outDir=tempdir)
+        metricId3 = resultsDb.updateMetric(self.metricName, self.slicerName,
+                                           self.runName, self.constraint,
+                                           self.metadata, self.metricDataFile)
+        self.assertEqual(metricId, metricId3)
+        self.assertEqual(len(resultsDb.getAllMetricIds()), 1)
         # Add plot.
         resultsDb.updatePlot(metricId, self.plotType, self.plotName)
         # Add normal summary statistics.
@@ -81,6 +89,52 @@ class TestResultsDb(unittest.TestCase):
             self.assertIn("not save", str(w[-1].message))
         shutil.rmtree(tempdir)
 
+    def testBatch(self):
+        tempdir = tempfile.mkdtemp(prefix='resDb')
+        resultsDb = db.ResultsDb(outDir=tempdir)
+        with resultsDb.batch():
+            metricId = resultsDb.updateMetric(self.metricName, self.slicerName,
+                                              self.runName, self.constraint,
+                                              self.metadata, self.metricDataFile)
+            resultsDb.updatePlot(metricId, self.plotType, self.plotName)
+            resultsDb.updateSummaryStat(metricId, self.summaryStatName1, self.summaryStatValue1)
+            resultsDb.updateSummaryStat(metricId, self.summaryStatName3, self.summaryStatValue3)
+            # The updates are visible in this session, but are not committed yet.
+            self.assertEqual(len(resultsDb.getSummaryStats(metricId)), 11)
+            otherDb = db.ResultsDb(outDir=tempdir)
+            self.assertEqual(len(otherDb.getAllMetricIds()), 0)
+            otherDb.close()
+        self.assertTrue(resultsDb.autocommit)
+        otherDb = db.ResultsDb(outDir=tempdir)
+        self.assertEqual(otherDb.getAllMetricIds(), [metricId])
+        self.assertEqual(len(otherDb.getSummaryStats(metricId)), 11)
+        otherDb.close()
+        # Without autocommit, updates are committed on close.
+        resultsDb.close()
+        resultsDb = db.ResultsDb(outDir=tempdir, autocommit=False)
+        resultsDb.updateSummaryStat(metricId, self.summaryStatName2, self.summaryStatValue2)
+        resultsDb.close()
+        otherDb = db.ResultsDb(outDir=tempdir)
+        self.assertEqual(len(otherDb.getSummaryStats(metricId)), 12)
+        otherDb.close()
+        # If an exception is raised in a batch, its updates are rolled back.
+        resultsDb = db.ResultsDb(outDir=tempdir)
+        with self.assertRaises(RuntimeError):
+            with resultsDb.batch():
+                resultsDb.updateMetric('Failed metric', self.slicerName, self.runName,
+                                       self.constraint, self.metadata, self.metricDataFile)
+                resultsDb.updateSummaryStat(metricId, self.summaryStatName2, self.summaryStatValue2)
+                raise RuntimeError('Metric failed')
+        self.assertTrue(resultsDb.autocommit)
+        self.assertEqual(resultsDb.getAllMetricIds(), [metricId])
+        self.assertEqual(len(resultsDb.getSummaryStats(metricId)), 12)
+        # The rolled back metric is added again (not looked up in the index).
+        newId = resultsDb.updateMetric('Failed metric', self.slicerName, self.runName,
+                                       self.constraint, self.metadata, self.metricDataFile)
+        self.assertEqual(sorted(resultsDb.getAllMetricIds()), sorted([metricId, newId]))
+        resultsDb.close()
+        shutil.rmtree(tempdir)
+
 
 class TestUseResultsDb(unittest.TestCase):
 
@@ -118,6 +172,18 @@ class TestUseResultsDb(unittest.TestCase):
     def testshowSummary(self):
         self.resultsDb.getSummaryStats()
 
+    def testGetSummaryStats(self):
+        metricId2 = self.resultsDb.updateMetric('Mean ExpMJD', self.slicerName, self.runName, self.constraint,
+                                                self.metadata, self.metricDataFile)
+        self.resultsDb.updateSummaryStat(metricId2, self.summaryStatName1, 5.0)
+        stats = self.resultsDb.getSummaryStats([metricId2, self.metricId])
+        self.assertEqual(list(stats['metricId']), [metricId2, self.metricId, self.metricId])
+        self.assertEqual(list(stats['summaryName']), [self.summaryStatName1, self.summaryStatName1,
+                                                      self.summaryStatName2])
+        stats = self.resultsDb.getSummaryStats(summaryName=self.summaryStatName2)
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats['summaryValue'][0], self.summaryStatValue2)
+
     def tearDown(self):
         self.resultsDb.close()
         shutil.rmtree(self.tempdir)
@@ -0,0 +1,101 @@
+import matplotlib
+matplotlib.use("Agg")
+import os
+import copy
+import warnings
+import unittest
+import shutil
+import tempfile
+import pandas as pd
+import lsst.sims.maf.db as db
+import lsst.utils.tests
+
+with warnings.catch_warnings():
+    # The runComparison module warns if bokeh is not installed.
+    warnings.simplefilter("ignore")
+    from lsst.sims.maf.runComparison import RunComparison
+
+
+class TestRunComparison(unittest.TestCase):
+
+    def setUp(self):
+        # Two runs, each with two subdirectories containing a resultsDb.
+        self.baseDir = tempfile.mkdtemp(prefix='runComp')
+        self.runlist = ['run1', 'run2']
+        for i, runName in enumerate(self.runlist):
+            for subdir in ('scheduler', 'science'):
+                outDir = os.path.join(self.baseDir, runName, subdir)
+                os.makedirs(outDir)
+                resultsDb = db.ResultsDb(outDir=outDir)
+                if subdir == 'scheduler':
+                    metricId = resultsDb.updateMetric('Count observationStartMJD', 'OneDSlicer', runName,
+                                                      '', 'All props', 'count.npz')
+                    resultsDb.updateSummaryStat(metricId, 'Sum', 100 + i)
+                    metricId = resultsDb.updateMetric('Mean slewTime', 'UniSlicer', runName,
+                                                      '', 'All props', 'slew.npz')
+                    resultsDb.updateSummaryStat(metricId, 'Identity', 4.5 + i)
+                else:
+                    for f in ('g', 'r'):
+                        metricId = resultsDb.updateMetric('CoaddM5', 'HealpixSlicer', runName,
+                                                          'filter = "%s"' % f, '%s band' % f,
+                                                          'coadd_%s.npz' % f)
+                        resultsDb.updateSummaryStat(metricId, 'Median', 26.0 + i)
+                        resultsDb.updateSummaryStat(metricId, 'Rms', 0.5)
+                    # A metric which is only in the second run.
+                    if i == 1:
+                        metricId = resultsDb.updateMetric('Parallax', 'HealpixSlicer', runName,
+                                                          '', 'All props', 'parallax.npz')
+                        resultsDb.updateSummaryStat(metricId, 'Median', 2.0)
+                resultsDb.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.baseDir)
+
+    def testBulkSummaryStats(self):
+        # The summary stats found in the harvested stats are the same as those found by querying
+        # each resultsDb for each metric.
+        runComp = RunComparison(self.baseDir, self.runlist)
+        metricDict = runComp.buildMetricDict()
+        self.assertEqual(len(metricDict), 5)
+        stats = runComp.harvestSummaryStats(nThreads=2)
+        self.assertEqual(len(stats), 6 + 7)
+        with warnings.catch_warnings():
+            # Parallax is not in run1.
+            warnings.simplefilter("ignore")
+            runComp.addSummaryStats(copy.deepcopy(metricDict), bulk=True, nThreads=2)
+            runCompSingle = RunComparison(self.baseDir, self.runlist)
+            runCompSingle.addSummaryStats(copy.deepcopy(metricDict), bulk=False)
+        pd.testing.assert_frame_equal(runComp.summaryStats, runCompSingle.summaryStats, check_like=True)
+        pd.testing.assert_frame_equal(runComp.headerStats, runCompSingle.headerStats, check_like=True)
+        self.assertTrue(pd.isnull(runComp.summaryStats['Parallax All props HealpixSlicer']['run1']))
+        self.assertEqual(runComp.summaryStats['Parallax All props HealpixSlicer']['run2'], 2.0)
+        self.assertEqual(runComp.summaryStats['Median CoaddM5 r band HealpixSlicer']['run2'], 27.0)
+        runComp.close()
+        runCompSingle.close()
+
+    def testSummaryName(self):
+        # Metrics which are given with a summaryName are looked up too (and only that summary stat).
+        metricDict = {'Median g': {'metricName': 'CoaddM5', 'metricMetadata': 'g band',
+                                   'slicerName': 'HealpixSlicer', 'summaryName': 'Median'},
+                      'Slew': {'metricName': 'Mean slewTime', 'metricMetadata': 'All props',
+                               'slicerName': 'UniSlicer'}}
+        for bulk in (True, False):
+            runComp = RunComparison(self.baseDir, self.runlist)
+            runComp.addSummaryStats(copy.deepcopy(metricDict), bulk=bulk)
+            self.assertEqual(sorted(runComp.summaryStats.columns), ['Median g', 'Slew'])
+            self.assertEqual(list(runComp.summaryStats['Median g']), [26.0, 27.0])
+            self.assertEqual(list(runComp.summaryStats['Slew']), [4.5, 5.5])
+            runComp.close()
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
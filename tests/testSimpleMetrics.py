@@ -165,6 +165,42 @@ class TestSimpleMetrics(unittest.TestCase):
         result = result
         self.assertGreater(result, 355)
 
+    def testRunBulk(self):
+        """Test that runBulk matches run at each slicePoint."""
+        rng = np.random.RandomState(42)
+        dv = np.array(list(zip(rng.rand(200) * 10.)), dtype=[('testdata', 'float')])
+        # Build overlapping slices of different lengths (including an empty slice).
+        idxList = [rng.choice(len(dv), size=n, replace=False) for n in (5, 0, 1, 40, 17, 2)]
+        indptr = np.concatenate([[0], np.cumsum([len(idxs) for idxs in idxList])])
+        indices = np.concatenate(idxList).astype(int)
+        testmetrics = [metrics.Coaddm5Metric(m5Col='testdata'), metrics.CountMetric('testdata'),
+                       metrics.MeanMetric('testdata'), metrics.MedianMetric('testdata'),
+                       metrics.SumMetric('testdata'), metrics.FracAboveMetric('testdata', cutoff=5.)]
+        for testmetric in testmetrics:
+            self.assertTrue(testmetric.supportsBulk)
+            result = testmetric.runBulk(dv, (indptr, indices))
+            self.assertEqual(len(result), len(idxList))
+            for i, idxs in enumerate(idxList):
+                if len(idxs) > 0:
+                    self.assertAlmostEqual(result[i], testmetric.run(dv[idxs]))
+        self.assertFalse(metrics.RmsMetric('testdata').supportsBulk)
+
+    def testAccumulate(self):
+        """Test that accumulating chunks of data matches run on all of the data."""
+        rng = np.random.RandomState(43)
+        dv = np.array(list(zip(rng.rand(100) * 10.)), dtype=[('testdata', 'float')])
+        testmetrics = [metrics.Coaddm5Metric(m5Col='testdata'), metrics.CountMetric('testdata'),
+                       metrics.MeanMetric('testdata'), metrics.SumMetric('testdata'),
+                       metrics.MaxMetric('testdata'), metrics.MinMetric('testdata'),
+                       metrics.FracAboveMetric('testdata', cutoff=5.)]
+        for testmetric in testmetrics:
+            self.assertTrue(testmetric.supportsAccumulate)
+            state = None
+            for start, stop in ((0, 1), (1, 30), (30, 100)):
+                state = testmetric.accumulate(state, dv[start:stop])
+            self.assertAlmostEqual(testmetric.finalize(state), testmetric.run(dv))
+        self.assertFalse(metrics.MedianMetric('testdata').supportsAccumulate)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -437,6 +437,88 @@ class TestStackerClasses(unittest.TestCase):
 
         self.assertGreater(new_data['opsimFieldId'].max(), 0)
 
+    def testStackerPlan(self):
+        """
+        Test the stacker plan adds columns once and reuses stacker results between groups.
+        """
+        rng = np.random.RandomState(4522)
+        data = np.zeros(600, dtype=list(zip(['airmass', 'fieldDec'], [float, float])))
+        data['airmass'] = rng.random_sample(600) + 1.
+        data['fieldDec'] = np.degrees(rng.random_sample(600) * np.pi - np.pi / 2.)
+        s1 = stackers.NormAirmassStacker(degrees=True)
+        s2 = stackers.NormAirmassStacker(degrees=True)
+        s3 = stackers.NormAirmassStacker(degrees=True, telescope_lat=0.)
+        plan = stackers.StackerPlan([[s1], [s2], [s3]])
+        # s1 and s2 are equal, so only one of them should run.
+        self.assertEqual(len(plan.stackers), 2)
+        planData = plan.addColumns(data)
+        self.assertIn('normairmass', planData.dtype.names)
+        expected = s1.run(data)
+        planData = plan.run(planData, [s1])
+        np.testing.assert_array_equal(planData['normairmass'], expected['normairmass'])
+        # Reusing the results for s2 should not recalculate the column.
+        planData['normairmass'][0] = -1
+        planData = plan.run(planData, [s2])
+        self.assertEqual(planData['normairmass'][0], -1)
+        # A different stacker filling the same column should recalculate it ..
+        planData = plan.run(planData, [s3])
+        np.testing.assert_array_equal(planData['normairmass'], s3.run(data)['normairmass'])
+        # .. and then so should the original stacker.
+        planData = plan.run(planData, [s1])
+        np.testing.assert_array_equal(planData['normairmass'], expected['normairmass'])
+
+    def testStackerPlanDAG(self):
+        """
+        Test the stacker plan adds and orders upstream stackers.
+        """
+        rng = np.random.RandomState(4523)
+        data = np.zeros(100, dtype=list(zip(['fieldRA', 'fieldDec'], [float, float])))
+        data['fieldRA'] = rng.rand(100) * 360.
+        data['fieldDec'] = rng.rand(100) * -90.
+        galStacker = stackers.GalacticStacker(raCol='randomDitherFieldPerVisitRa',
+                                              decCol='randomDitherFieldPerVisitDec')
+        plan = stackers.StackerPlan([[galStacker]], nThreads=2)
+        planData = plan.addColumns(data)
+        # The dither stacker providing the RA/Dec columns should have been added before the galactic stacker.
+        self.assertEqual(len(plan.stackers), 2)
+        self.assertIsInstance(plan.stackers[1], stackers.RandomDitherFieldPerVisitStacker)
+        self.assertEqual(plan._schedule([0]), [[1], [0]])
+        planData = plan.run(planData, [galStacker])
+        gall, galb = _galacticFromEquatorial(np.radians(planData['randomDitherFieldPerVisitRa']),
+                                             np.radians(planData['randomDitherFieldPerVisitDec']))
+        np.testing.assert_array_equal(planData['gall'], gall)
+        np.testing.assert_array_equal(planData['galb'], galb)
+
+    def testLazyStackerPlan(self):
+        """
+        Test that lazy stacker columns are only calculated when accessed.
+        """
+        rng = np.random.RandomState(4524)
+        names = ['airmass', 'fieldDec', 'fieldRA', 'observationStartLST']
+        data = np.zeros(300, dtype=list(zip(names, [float] * 4)))
+        data['airmass'] = rng.random_sample(300) + 1.
+        data['fieldDec'] = rng.random_sample(300) * -90.
+        data['fieldRA'] = rng.random_sample(300) * 360.
+        data['observationStartLST'] = rng.random_sample(300) * 360.
+        airmassStacker = stackers.NormAirmassStacker(degrees=True)
+        haStacker = stackers.HourAngleStacker()
+        plan = stackers.StackerPlan([[airmassStacker, haStacker]], lazy=True)
+        planData = plan.addColumns(data)
+        planData = plan.run(planData, [airmassStacker, haStacker])
+        self.assertEqual(set(plan.pending), set(['normairmass', 'HA']))
+        # Accessing a column in a subset of the data calculates it (for all of the data).
+        idxs = np.array([5, 3, 200])
+        dataSlice = planData[idxs]
+        np.testing.assert_array_equal(dataSlice['HA'], haStacker.run(data)['HA'][idxs])
+        self.assertEqual(list(plan.pending), ['normairmass'])
+        # Sorting a subset fills in the remaining columns before reordering the rows.
+        dataSlice = planData[planData['fieldDec'] < -45.]
+        dataSlice.sort(order='fieldRA')
+        expected = airmassStacker.run(data)
+        expected = np.sort(expected[expected['fieldDec'] < -45.], order='fieldRA')
+        np.testing.assert_array_equal(dataSlice['normairmass'], expected['normairmass'])
+        self.assertEqual(len(plan.pending), 0)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass